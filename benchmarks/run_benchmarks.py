@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for the MaSIF launcher, descriptor extraction, t-SNE, nearest-neighbour and repacking scripts.
+
+Every case runs the real script as a subprocess against synthetic inputs. The MaSIF container and
+PyRosetta are replaced by the stand-ins in benchmarks/stubs/, so this runs on any machine with numpy
+(plus pandas/scikit-learn for the extraction and t-SNE suites). Wall time and peak RSS of each run are
+saved as JSON under --results_dir so runs can be compared over time.
+
+Usage example:
+python benchmarks/run_benchmarks.py --suites launcher,extract,tsne --sizes 100,1000 --label baseline
+python benchmarks/run_benchmarks.py --suites extract --sizes 100000 --patches 50 --label big
+python benchmarks/run_benchmarks.py --suites knn --sizes 10000 --patches 1000 --label knn
+python benchmarks/run_benchmarks.py compare benchmarks/results/baseline.json benchmarks/results/new.json
+"""
+
+import os
+import sys
+import json
+import glob
+import re
+import shutil
+import socket
+import tempfile
+import platform
+import argparse
+import subprocess
+import time
+from datetime import datetime
+
+from synth import make_pdb_library, make_descriptor_tree, make_descriptor_store
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUB_DIR = os.path.join(BENCH_DIR, "stubs")
+MASIF_DIR = os.path.join(REPO_DIR, "masif_files")
+REPACK_SCRIPT = os.path.join(REPO_DIR, "other_related_files", "pyrosetta_repack_stuff", "2repack_biosensor.py")
+DEFAULT_TEMPLATE = sorted(glob.glob(os.path.join(REPO_DIR, "other_related_files", "pyrosetta_repack_stuff",
+                                                 "2repack_biosensors", "*.pdb")))[:1]
+SUITES = ("launcher", "extract", "tsne", "knn", "repack")
+
+def measure(cmd, cwd, env=None):
+    """Run cmd and return wall seconds, peak RSS (largest process in the tree, MB), exit code and stderr tail."""
+    stderr_path = os.path.join(cwd, "bench_stderr.txt")
+    start = time.perf_counter()
+    with open(os.path.join(cwd, "bench_stdout.txt"), "w") as out, open(stderr_path, "w") as err:
+        process = subprocess.Popen(cmd, cwd=cwd, env={**os.environ, **(env or {})}, stdout=out, stderr=err)
+        _, wait_status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(wait_status)
+    wall = time.perf_counter() - start
+    with open(stderr_path) as f:
+        tail = f.read()[-2000:]
+    return {"wall_s": round(wall, 3), "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+            "returncode": process.returncode, "stderr_tail": tail if process.returncode else ""}
+
+def fresh_dir(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    return path
+
+def result(suite, case, size, measurement, **extra):
+    record = {"suite": suite, "case": case, "size": size, **measurement, **extra}
+    if measurement.get("returncode") == 0 and measurement.get("wall_s"):
+        record["per_s"] = round(size / measurement["wall_s"], 2)
+    status = "ok" if measurement.get("returncode") == 0 else measurement.get("skipped") or f"exit {measurement.get('returncode')}"
+    reported = f"  (query {extra['query_s']:.3f}s)" if extra.get("query_s") is not None else ""
+    print(f"  {suite:<8} {case:<22} n={size:<7} {measurement.get('wall_s', 0):9.2f}s "
+          f"{measurement.get('peak_rss_mb') or 0:8.1f} MB  {status}{reported}")
+    return record
+
+def skipped(reason):
+    return {"skipped": reason, "returncode": None}
+
+def bench_launcher(args, size, work):
+    """Cold run (every structure through the stub container), then a warm rerun where everything is cached."""
+    pdb_dir = make_pdb_library(args.template_pdb, os.path.join(work, f"pdbs_{size}"), size)
+    run_dir = fresh_dir(os.path.join(work, f"launcher_{size}"))
+    env = {"PATH": f"{STUB_DIR}{os.pathsep}{os.environ['PATH']}", "BENCH_LATENCY": args.latency,
+           "BENCH_STUB_STATE": os.path.join(run_dir, "stub_state")}
+    cmd = [sys.executable, os.path.join(MASIF_DIR, "run_masif_sif_v2.py"), "--pdb_dir", pdb_dir,
+           "--output_dir", os.path.join(run_dir, "masif_output"), "--log_dir", os.path.join(run_dir, "logs"),
+           "--sif", os.path.join(run_dir, "stub.sif"), "--workers", str(args.workers)]
+    cases = [("cold", []), ("cached_rerun", [])]
+    if args.launcher_options:
+        cases.append((f"cold{args.launcher_options.replace(' ', '')}", args.launcher_options.split()))
+    records = []
+    for case, options in cases:
+        if case != "cached_rerun" and records:
+            shutil.rmtree(os.path.join(run_dir, "masif_output"), ignore_errors=True)
+        if "--stage_local" in options:
+            options = options + ["--stage_dir", fresh_dir(os.path.join(run_dir, "stage"))]
+        records.append(result("launcher", case, size, measure(cmd + options, run_dir, env),
+                              workers=args.workers, latency=args.latency))
+    return records
+
+def bench_extract(args, size, work):
+    """Descriptor extraction in every output format from a synthetic tree, returning the store for t-SNE."""
+    output_dir, log_dir, metadata_csv = make_descriptor_tree(
+        os.path.join(work, f"tree_{size}_{args.patches}{'_zip' if args.archives else ''}"), size,
+        patches=args.patches, archives=args.archives)
+    run_dir = fresh_dir(os.path.join(work, f"extract_{size}"))
+    base = [sys.executable, os.path.join(MASIF_DIR, "extract_descriptors_to_csv.py"), "--output_dir", output_dir,
+            "--log_dir", log_dir, "--workers", str(args.workers)]
+    cases = [
+        ("csv_flat", ["--csv_path", "flat.csv"]),
+        ("csv_patch", ["--csv_path", "patch.csv", "--layout", "patch"]),
+        ("csv_pooled", ["--csv_path", "pooled.csv", "--layout", "pooled", "--pooling", "mean,max"]),
+        ("store", ["--format", "store", "--store_dir", "store", "--metadata_csv", metadata_csv]),
+    ]
+    records = []
+    for case, options in cases:
+        if case == "csv_flat" and size > args.flat_max_size:
+            records.append(result("extract", case, size, skipped(f"size > --flat_max_size {args.flat_max_size}")))
+            continue
+        records.append(result("extract", case, size, measure(base + options, run_dir),
+                              patches=args.patches, archives=args.archives))
+    return records, os.path.join(run_dir, "store"), os.path.join(run_dir, "flat.csv")
+
+def bench_tsne(args, size, store_dir, flat_csv):
+    run_dir = os.path.dirname(store_dir)
+    script = os.path.join(MASIF_DIR, "run_tsne.py")
+    perplexity = str(min(20, max(2, (size - 1) // 3)))
+    cases = [
+        ("store_pooled_pca", ["-s", store_dir, "--pooling", "mean,max", "--pca", "50"]),
+        ("csv_flat", ["-i", flat_csv]),
+    ]
+    records = []
+    for case, options in cases:
+        if size > args.tsne_max_size:
+            records.append(result("tsne", case, size, skipped(f"size > --tsne_max_size {args.tsne_max_size}")))
+        elif not os.path.exists(options[1]):
+            records.append(result("tsne", case, size, skipped(f"no input ({os.path.basename(options[1])} not built)")))
+        else:
+            cmd = [sys.executable, script] + options + ["-o", f"tsne_{case}", "-p", perplexity, "-n", str(args.tsne_iter)]
+            records.append(result("tsne", case, size, measure(cmd, run_dir), n_iter=args.tsne_iter))
+    return records
+
+def bench_knn(args, size, work):
+    """
+    Patch-level index build over a synthetic store of size x --patches patches, then by-name queries.
+    query_s is the time the query CLI reports for loading the index and ranking, without interpreter start-up.
+    """
+    store_dir = make_descriptor_store(os.path.join(work, f"store_{size}_{args.patches}"), size, patches=args.patches)
+    run_dir = fresh_dir(os.path.join(work, f"knn_{size}_{args.patches}"))
+    script = os.path.join(MASIF_DIR, "descriptor_knn.py")
+    records = [result("knn", "build_patch", size, measure([sys.executable, script, "build", "-s", store_dir, "-x", "index",
+                                                           "--level", "patch"], run_dir), patches=args.patches)]
+    for i, slot in enumerate((0, size // 2, size - 1)):
+        cmd = [sys.executable, script, "query", "-x", "index", "-q", f"variant_{slot:06d}", "-k", "10",
+               "--nprobe", str(args.knn_nprobe)]
+        measurement = measure(cmd, run_dir)
+        with open(os.path.join(run_dir, "bench_stdout.txt")) as f:
+            reported = re.findall(r"ranked structures in ([0-9.]+)s", f.read())
+        records.append(result("knn", f"query_patch_{i}", size, measurement, patches=args.patches,
+                              nprobe=args.knn_nprobe, query_s=float(reported[-1]) if reported else None))
+    return records
+
+def bench_repack(args, size, work):
+    pdb_dir = make_pdb_library(args.template_pdb, os.path.join(work, f"pdbs_{size}"), size)
+    run_dir = fresh_dir(os.path.join(work, f"repack_{size}"))
+    env = {"PYTHONPATH": STUB_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""),
+           "BENCH_REPACK_SECONDS_PER_RESIDUE": str(args.repack_seconds_per_residue)}
+    cmd = [sys.executable, REPACK_SCRIPT, "-p", pdb_dir, "-o", "out", "-c", "scores.csv",
+           "-n", str(args.repack_cycles), "-j", str(args.workers)]
+    return [result("repack", "full", size, measure(cmd, run_dir, env), cycles=args.repack_cycles, workers=args.workers)]
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "-C", REPO_DIR, "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    suites = [s.strip() for s in args.suites.split(",") if s.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        raise SystemExit(f"Unknown suite(s): {', '.join(sorted(unknown))} (choose from {', '.join(SUITES)})")
+    if ({"launcher", "repack"} & set(suites)) and not args.template_pdb:
+        raise SystemExit("--template_pdb is required for the launcher/repack suites")
+    sizes = [int(s) for s in args.sizes.split(",")]
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    records = []
+    for size in sizes:
+        print(f"Size {size}:")
+        if "launcher" in suites:
+            records += bench_launcher(args, size, args.work_dir)
+        if "extract" in suites or "tsne" in suites:
+            extract_records, store_dir, flat_csv = bench_extract(args, size, args.work_dir)
+            if "extract" in suites:
+                records += extract_records
+            if "tsne" in suites:
+                records += bench_tsne(args, size, store_dir, flat_csv)
+        if "knn" in suites:
+            records += bench_knn(args, size, args.work_dir)
+        if "repack" in suites and size <= args.repack_max_size:
+            records += bench_repack(args, size, args.work_dir)
+
+    report = {
+        "label": args.label, "created": datetime.now().isoformat(timespec="seconds"), "git_commit": git_commit(),
+        "host": socket.gethostname(), "platform": platform.platform(), "python": platform.python_version(),
+        "cpu_count": os.cpu_count(), "slurm_job_id": os.environ.get("SLURM_JOB_ID"),
+        "args": {k: v for k, v in vars(args).items() if k != "command"}, "results": records,
+    }
+    os.makedirs(args.results_dir, exist_ok=True)
+    name = args.label or datetime.now().strftime("%Y%m%d_%H%M%S")
+    report_path = os.path.join(args.results_dir, f"{name}.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"Results saved to {report_path}")
+
+def compare(args):
+    """Print wall-time and peak-memory ratios (new / old) for every case present in both reports."""
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    key = lambda r: (r["suite"], r["case"], r["size"])
+    old_results = {key(r): r for r in old["results"] if r.get("returncode") == 0}
+    print(f"{'suite':<8} {'case':<22} {'size':>7} {'old s':>9} {'new s':>9} {'time x':>7} {'old MB':>8} {'new MB':>8} {'mem x':>6}")
+    for r in new["results"]:
+        before = old_results.get(key(r))
+        if before is None or r.get("returncode") != 0:
+            continue
+        print(f"{r['suite']:<8} {r['case']:<22} {r['size']:>7} {before['wall_s']:>9.2f} {r['wall_s']:>9.2f} "
+              f"{r['wall_s'] / max(before['wall_s'], 1e-9):>7.2f} {before['peak_rss_mb']:>8.1f} {r['peak_rss_mb']:>8.1f} "
+              f"{r['peak_rss_mb'] / max(before['peak_rss_mb'], 1e-9):>6.2f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+        parser.add_argument("command")
+        parser.add_argument("old", help="Earlier results JSON")
+        parser.add_argument("new", help="Later results JSON")
+        compare(parser.parse_args())
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Benchmark the MaSIF launcher, descriptor extraction, t-SNE, nearest-neighbour search and repacking.")
+    parser.add_argument("--suites", default="launcher,extract,tsne", help=f"Comma-separated suites to run ({', '.join(SUITES)})")
+    parser.add_argument("--sizes", default="100,1000", help="Comma-separated numbers of structures (e.g. 100,1000,10000,100000)")
+    parser.add_argument("--workers", type=int, default=4, help="--workers/--jobs passed to the benchmarked scripts (default: 4)")
+    parser.add_argument("--label", help="Name of the results file (default: timestamp)")
+    parser.add_argument("--results_dir", default=os.path.join(BENCH_DIR, "results"), help="Where results JSON files are written")
+    parser.add_argument("--work_dir", default=os.path.join(tempfile.gettempdir(), "masif_bench"),
+                        help="Scratch directory for synthetic inputs and outputs (synthetic inputs are reused between runs)")
+    parser.add_argument("--template_pdb", default=DEFAULT_TEMPLATE[0] if DEFAULT_TEMPLATE else None,
+                        help="PDB copied to build the launcher/repack inputs (default: first repacked biosensor)")
+    parser.add_argument("--latency", default="", help="Stub MaSIF stage latencies, e.g. protonate=0.5,surface=2,precompute=1,descriptors=1")
+    parser.add_argument("--launcher_options", default="", help="Extra launcher flags benchmarked as a third case, e.g. '--slim --stage_local'")
+    parser.add_argument("--patches", type=int, default=200, help="Mean surface patches per synthetic structure (default: 200)")
+    parser.add_argument("--archives", action="store_true", help="Write the synthetic descriptor tree as <id>.zip archives")
+    parser.add_argument("--flat_max_size", type=int, default=5000, help="Skip the zero-padded flat CSV above this size")
+    parser.add_argument("--tsne_max_size", type=int, default=10000, help="Skip t-SNE above this size")
+    parser.add_argument("--tsne_iter", type=int, default=500, help="t-SNE iterations (default: 500)")
+    parser.add_argument("--knn_nprobe", type=int, default=8, help="--nprobe for the knn query case (default: 8)")
+    parser.add_argument("--repack_max_size", type=int, default=200, help="Skip the repack suite above this size")
+    parser.add_argument("--repack_cycles", type=int, default=3, help="Repacking cycles per structure (default: 3)")
+    parser.add_argument("--repack_seconds_per_residue", type=float, default=0.0005, help="Stub packing cost per repacked residue")
+    run(parser.parse_args())
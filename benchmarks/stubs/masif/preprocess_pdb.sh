@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Stand-in for MaSIF-neosurf's preprocess_pdb.sh: ./preprocess_pdb.sh <pdb> <ID>_<chains> -o <output dir>
+
+Writes the same output tree as the real script with realistically shaped arrays (about
+BENCH_VERTICES_PER_RESIDUE surface vertices per residue, 80-dim descriptors) and sleeps between stages.
+
+Environment:
+    BENCH_LATENCY                 per-stage seconds, e.g. "protonate=0.5,surface=2,precompute=1,descriptors=1"
+    BENCH_LATENCY_SCALE           multiplies every stage latency (default 1)
+    BENCH_VERTICES_PER_RESIDUE    surface vertices per residue (default 25)
+    BENCH_MAX_PATCH               vertices per precomputed patch (default 100)
+    BENCH_FAIL_RATE               fraction of structures (chosen by ID hash) that fail in precompute
+"""
+
+import os
+import sys
+import time
+import shutil
+import zlib
+import numpy as np
+
+STAGES = ("protonate", "surface", "precompute", "descriptors")
+
+def latencies():
+    values = dict.fromkeys(STAGES, 0.0)
+    for item in os.environ.get("BENCH_LATENCY", "").split(","):
+        if "=" in item:
+            stage, seconds = item.split("=")
+            values[stage.strip()] = float(seconds)
+    scale = float(os.environ.get("BENCH_LATENCY_SCALE", "1"))
+    return {stage: seconds * scale for stage, seconds in values.items()}
+
+def count_residues(pdb_path, chains):
+    n = 0
+    with open(pdb_path, "rb") as f:
+        for line in f:
+            if line.startswith(b"ATOM") and line[12:16].strip() == b"CA" and chr(line[21]) in chains:
+                n += 1
+    return n
+
+def main(argv):
+    pdb_path, pdb_chains = argv[0], argv[1]
+    out_dir = argv[argv.index("-o") + 1]
+    pdbid, chains = pdb_chains.split("_", 1)
+    delay = latencies()
+    rng = np.random.default_rng(zlib.crc32(pdb_chains.encode()))
+
+    prep = os.path.join(out_dir, "data_preparation")
+    for sub in ("00-raw_pdbs", "01-benchmark_pdbs"):
+        os.makedirs(os.path.join(prep, sub), exist_ok=True)
+    shutil.copyfile(pdb_path, os.path.join(prep, "00-raw_pdbs", f"{pdbid}.pdb"))
+    shutil.copyfile(pdb_path, os.path.join(prep, "01-benchmark_pdbs", f"{pdb_chains}.pdb"))
+    n_residues = count_residues(pdb_path, chains)
+    if n_residues == 0:
+        print(f"No residues in chain(s) {chains}", file=sys.stderr)
+        return 1
+    time.sleep(delay["protonate"])
+
+    n_vertices = int(n_residues * float(os.environ.get("BENCH_VERTICES_PER_RESIDUE", "25")) * rng.uniform(0.9, 1.1))
+    surfaces = os.path.join(prep, "01-benchmark_surfaces")
+    os.makedirs(surfaces, exist_ok=True)
+    with open(os.path.join(surfaces, f"{pdb_chains}.ply"), "wb") as f:
+        f.write(b"ply\nformat binary_little_endian 1.0\n")
+        f.write(rng.random((n_vertices, 14), dtype=np.float32).tobytes())
+        f.write(rng.integers(0, n_vertices, (2 * n_vertices, 3), dtype=np.int32).tobytes())
+    time.sleep(delay["surface"])
+
+    fail_rate = float(os.environ.get("BENCH_FAIL_RATE", "0"))
+    if zlib.crc32(pdbid.encode()) % 10000 < fail_rate * 10000:
+        print("Traceback (most recent call last):", file=sys.stderr)
+        print("ValueError: stub precompute failure", file=sys.stderr)
+        return 1
+    max_patch = int(os.environ.get("BENCH_MAX_PATCH", "100"))
+    precomputation = os.path.join(prep, "04a-precomputation_9A", "precomputation", pdb_chains)
+    os.makedirs(precomputation, exist_ok=True)
+    np.save(os.path.join(precomputation, "p1_input_feat.npy"), rng.random((n_vertices, max_patch, 5), dtype=np.float32))
+    for name in ("p1_rho_wrt_center", "p1_theta_wrt_center", "p1_mask"):
+        np.save(os.path.join(precomputation, f"{name}.npy"), rng.random((n_vertices, max_patch), dtype=np.float32))
+    for axis in "XYZ":
+        np.save(os.path.join(precomputation, f"p1_{axis}.npy"), rng.random(n_vertices, dtype=np.float32))
+    time.sleep(delay["precompute"])
+
+    descriptors = os.path.join(out_dir, "descriptors", "sc05", "all_feat", pdb_chains)
+    os.makedirs(descriptors, exist_ok=True)
+    for name in ("p1_desc_straight", "p1_desc_flipped"):
+        np.save(os.path.join(descriptors, f"{name}.npy"), rng.standard_normal((n_vertices, 80), dtype=np.float32))
+    time.sleep(delay["descriptors"])
+    print(f"{pdb_chains}: {n_residues} residues, {n_vertices} vertices")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
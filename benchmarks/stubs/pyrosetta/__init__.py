@@ -0,0 +1,89 @@
+"""
+Stand-in for the subset of PyRosetta used by 2repack_biosensor.py, for benchmarking without a Rosetta licence.
+
+Poses are read from real PDB files (sequence, chains, CA coordinates), so sequence-based mutation lookup and
+distance-shell selection behave as with PyRosetta. Packing sleeps BENCH_REPACK_SECONDS_PER_RESIDUE
+(default 0.0005) per repackable residue and lowers the score by a random, shrinking amount.
+"""
+
+import zlib
+import numpy as np
+from . import rosetta
+
+THREE_TO_ONE = {
+    "ALA": "A", "ARG": "R", "ASN": "N", "ASP": "D", "CYS": "C", "GLN": "Q", "GLU": "E", "GLY": "G", "HIS": "H",
+    "ILE": "I", "LEU": "L", "LYS": "K", "MET": "M", "PHE": "F", "PRO": "P", "SER": "S", "THR": "T", "TRP": "W",
+    "TYR": "Y", "VAL": "V",
+}
+
+class Pose:
+    def __init__(self, path=None):
+        self.path = path
+        self.lines, self.residues, self.ca, self.chains = [], [], [], []
+        if path is not None:
+            self._read(path)
+            self.score = -3.0 * len(self.residues) + zlib.crc32(path.encode()) % 1000
+            self.rng = np.random.default_rng(zlib.crc32(path.encode()))
+
+    def _read(self, path):
+        previous = None
+        with open(path) as f:
+            for line in f:
+                if not line.startswith("ATOM"):
+                    continue
+                self.lines.append(line)
+                # A new residue starts whenever chain/number/insertion code changes, like Rosetta's PDB reader
+                key = (line[21], line[22:27])
+                if key != previous:
+                    previous = key
+                    self.residues.append((line[21], THREE_TO_ONE.get(line[17:20], "X")))
+                    self.ca.append(None)
+                    if not self.chains or self.chains[-1][0] != line[21]:
+                        self.chains.append([line[21], len(self.residues), len(self.residues)])
+                    self.chains[-1][2] = len(self.residues)
+                if line[12:16].strip() == "CA" or self.ca[-1] is None:
+                    self.ca[-1] = [float(line[30:38]), float(line[38:46]), float(line[46:54])]
+        self.ca = np.array(self.ca, dtype=np.float32).reshape(-1, 3)
+
+    def clone(self):
+        pose = Pose()
+        pose.assign(self)
+        pose.rng = self.rng
+        return pose
+
+    def assign(self, other):
+        self.path, self.lines, self.residues, self.ca, self.chains = other.path, other.lines, other.residues, other.ca, other.chains
+        self.score = other.score
+
+    def sequence(self):
+        return "".join(aa for _, aa in self.residues)
+
+    def total_residue(self):
+        return len(self.residues)
+
+    def num_chains(self):
+        return len(self.chains)
+
+    def chain_begin(self, chain):
+        return self.chains[chain - 1][1]
+
+    def chain_end(self, chain):
+        return self.chains[chain - 1][2]
+
+    def chain_sequence(self, chain):
+        return self.sequence()[self.chain_begin(chain) - 1:self.chain_end(chain)]
+
+    def dump_pdb(self, output_file):
+        with open(output_file, "w") as f:
+            f.write(f"REMARK   1 STUB SCORE {self.score:.3f}\n")
+            f.writelines(self.lines)
+            f.write("END\n")
+
+def init(options=""):
+    print(f"[stub pyrosetta] init {options}")
+
+def create_score_function(name):
+    return lambda pose: pose.score
+
+def pose_from_file(path):
+    return Pose(path)
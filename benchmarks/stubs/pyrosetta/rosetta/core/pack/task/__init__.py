@@ -0,0 +1,8 @@
+from . import operation
+
+class TaskFactory:
+    def __init__(self):
+        self.operations = []
+
+    def push_back(self, op):
+        self.operations.append(op)
@@ -0,0 +1,13 @@
+class _Operation:
+    def __init__(self, *args):
+        self.args = args
+
+class InitializeFromCommandline(_Operation): pass
+class IncludeCurrent(_Operation): pass
+class NoRepackDisulfides(_Operation): pass
+class RestrictToRepacking(_Operation): pass
+class PreventRepackingRLT(_Operation): pass
+
+class OperateOnResidueSubset(_Operation):
+    def __init__(self, op, selector, flip=False):
+        self.op, self.selector, self.flip = op, selector, flip
@@ -0,0 +1 @@
+from . import residue_selector
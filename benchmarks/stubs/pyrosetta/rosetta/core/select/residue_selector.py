@@ -0,0 +1,26 @@
+import numpy as np
+
+class ResidueIndexSelector:
+    def __init__(self, indices):
+        self.indices = [int(i) for i in str(indices).split(",") if i]
+
+    def apply(self, pose):
+        selected = [False] * pose.total_residue()
+        for i in self.indices:
+            selected[i - 1] = True
+        return selected
+
+class NeighborhoodResidueSelector:
+    """Residues whose CA is within distance of a focus residue's CA."""
+    def __init__(self, focus, distance, include_focus=True):
+        self.focus, self.distance, self.include_focus = focus, distance, include_focus
+
+    def apply(self, pose):
+        focus = np.array(self.focus.apply(pose))
+        distances = np.linalg.norm(pose.ca[:, None, :] - pose.ca[None, focus, :], axis=2)
+        selected = (distances <= self.distance).any(axis=1) if focus.any() else np.zeros(len(focus), bool)
+        if self.include_focus:
+            selected |= focus
+        else:
+            selected &= ~focus
+        return selected.tolist()
@@ -0,0 +1 @@
+from . import minimization_packing
@@ -0,0 +1,19 @@
+import os
+import time
+from ..core.pack.task.operation import OperateOnResidueSubset
+
+class PackRotamersMover:
+    def __init__(self):
+        self.factory = None
+
+    def task_factory(self, factory):
+        self.factory = factory
+
+    def apply(self, pose):
+        """Sleep in proportion to the number of repackable residues and lower the score."""
+        n_repack = pose.total_residue()
+        for op in (self.factory.operations if self.factory else []):
+            if isinstance(op, OperateOnResidueSubset) and op.flip:
+                n_repack = sum(op.selector.apply(pose))
+        time.sleep(float(os.environ.get("BENCH_REPACK_SECONDS_PER_RESIDUE", "0.0005")) * n_repack)
+        pose.score += pose.rng.uniform(-0.05, 0.01) * n_repack * pose.rng.random()
@@ -0,0 +1,124 @@
+"""
+Synthetic inputs for the benchmarks.
+
+make_pdb_library   copies of a template PDB that differ only in a REMARK line, so each gets its own content hash/ID
+make_descriptor_tree   a MaSIF output tree (folders or <id>.zip archives), pdb_mapping.txt and a metadata CSV
+make_descriptor_store  a descriptor store written directly, for library sizes where a MaSIF tree is impractical
+
+Both are cached: a tree is only regenerated when its parameters change (see synth.json in the tree).
+"""
+
+import os
+import sys
+import json
+import shutil
+import zipfile
+import io
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "masif_files"))
+from run_masif_sif_v2 import slot_to_id
+from descriptor_store import append_structures
+
+LIGAND_FAMILIES = ["nitazene", "fentanyl", "benzimidazole", "piperidine", "opioid_other"]
+
+def _cached(root, params):
+    marker = os.path.join(root, "synth.json")
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f) == params:
+                return True
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+    os.makedirs(root)
+    return False
+
+def _mark(root, params):
+    with open(os.path.join(root, "synth.json"), "w") as f:
+        json.dump(params, f)
+
+def make_pdb_library(template_pdb, root, n):
+    """Directory root/pdbs with n distinct copies of template_pdb; returns that directory."""
+    params = {"kind": "pdbs", "template": os.path.abspath(template_pdb), "n": n}
+    pdb_dir = os.path.join(root, "pdbs")
+    if _cached(root, params):
+        return pdb_dir
+    os.makedirs(pdb_dir)
+    with open(template_pdb) as f:
+        body = f.read()
+    for i in range(n):
+        with open(os.path.join(pdb_dir, f"variant_{i:06d}.pdb"), "w") as f:
+            f.write(f"REMARK 999 BENCHMARK VARIANT {i}\n{body}")
+    _mark(root, params)
+    return pdb_dir
+
+def _npy_bytes(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+def make_descriptor_tree(root, n, patches=200, jitter=0.2, dim=80, archives=False, seed=0):
+    """
+    root/masif_output with n structures of about `patches` (+/- jitter) x dim float32 descriptors,
+    root/logs/pdb_mapping.txt and root/metadata.csv. Returns (output_dir, log_dir, metadata_csv).
+    """
+    params = {"kind": "descriptors", "n": n, "patches": patches, "jitter": jitter, "dim": dim,
+              "archives": archives, "seed": seed}
+    output_dir = os.path.join(root, "masif_output")
+    log_dir = os.path.join(root, "logs")
+    metadata_csv = os.path.join(root, "metadata.csv")
+    if _cached(root, params):
+        return output_dir, log_dir, metadata_csv
+    os.makedirs(output_dir)
+    os.makedirs(log_dir)
+
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((len(LIGAND_FAMILIES), dim)).astype(np.float32)
+    with open(os.path.join(log_dir, "pdb_mapping.txt"), "w") as mapping, open(metadata_csv, "w") as metadata:
+        metadata.write("structure,ligand_family\n")
+        for i in range(n):
+            structure_id = slot_to_id(i)
+            name = f"variant_{i:06d}"
+            family = i % len(LIGAND_FAMILIES)
+            n_patches = max(1, int(patches * rng.uniform(1 - jitter, 1 + jitter)))
+            straight = centres[family] + rng.standard_normal((n_patches, dim), dtype=np.float32)
+            flipped = straight[:, ::-1].copy()
+            member_dir = f"descriptors/sc05/all_feat/{structure_id}_A"
+            if archives:
+                with zipfile.ZipFile(os.path.join(output_dir, f"{structure_id}.zip"), "w", zipfile.ZIP_STORED) as archive:
+                    archive.writestr(f"{member_dir}/p1_desc_straight.npy", _npy_bytes(straight))
+                    archive.writestr(f"{member_dir}/p1_desc_flipped.npy", _npy_bytes(flipped))
+            else:
+                desc_dir = os.path.join(output_dir, structure_id, member_dir)
+                os.makedirs(desc_dir)
+                np.save(os.path.join(desc_dir, "p1_desc_straight.npy"), straight)
+                np.save(os.path.join(desc_dir, "p1_desc_flipped.npy"), flipped)
+            mapping.write(f"{structure_id}.pdb -> {name}.pdb\n")
+            metadata.write(f"{name},{LIGAND_FAMILIES[family]}\n")
+    _mark(root, params)
+    return output_dir, log_dir, metadata_csv
+
+def make_descriptor_store(root, n, patches=200, jitter=0.2, dim=80, motifs=1024, seed=0):
+    """
+    root/store with n structures of about `patches` (+/- jitter) x dim descriptors. Patches are noisy copies
+    of shared surface motifs, so inverted lists have realistic structure; structures of one ligand family
+    favour the same motifs. Returns the store directory.
+    """
+    params = {"kind": "store", "n": n, "patches": patches, "jitter": jitter, "dim": dim, "motifs": motifs, "seed": seed}
+    store_dir = os.path.join(root, "store")
+    if _cached(root, params):
+        return store_dir
+
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((motifs, dim)).astype(np.float32)
+    family_motifs = [rng.choice(motifs, motifs // 4, replace=False) for _ in LIGAND_FAMILIES]
+
+    def entries():
+        for i in range(n):
+            n_patches = max(1, int(patches * rng.uniform(1 - jitter, 1 + jitter)))
+            chosen = rng.choice(family_motifs[i % len(LIGAND_FAMILIES)], n_patches)
+            yield slot_to_id(i), f"variant_{i:06d}", centres[chosen] + 0.3 * rng.standard_normal((n_patches, dim), dtype=np.float32)
+
+    append_structures(store_dir, entries())
+    _mark(root, params)
+    return store_dir
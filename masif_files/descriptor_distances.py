@@ -0,0 +1,289 @@
+"""
+Structure-by-structure surface similarity over MaSIF descriptor sets, and hierarchical clustering on it.
+
+Each structure is a set of per-patch descriptors, so two structures are compared with a set-to-set
+distance built from nearest-patch distances in both directions:
+    chamfer             mean of the two directed mean-min distances (default)
+    modified_hausdorff  larger of the two directed mean-min distances
+    hausdorff           largest nearest-patch distance in either direction
+
+Usage example:
+python descriptor_distances.py compute -s <store_dir> -o <distance_dir> --max_patches 1000 --workers 16
+python descriptor_distances.py cluster -o <distance_dir> --method average --plot dendrogram.png
+
+compute writes <distance_dir>/distances.npy (an n x n float32 matrix, opened with mmap_mode="r"),
+structures.csv (its row order, with the store index metadata such as ligand_family) and distances.json.
+Pairs are computed in tiles of structures on a process pool; within a pair the patch distances are
+computed in float32 blocks as |a|^2 - 2 a.b + |b|^2, so memory stays bounded however large the sets are.
+Re-running after structures were appended to the store copies the existing matrix and only computes
+the rows and columns of the new structures.
+
+cluster runs scipy hierarchical clustering on the matrix and writes clusters.csv, linkage.npy and,
+when ligand_family is known, a cluster x family table with the adjusted Rand index.
+"""
+
+import argparse
+import json
+import os
+import zlib
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from descriptor_store import open_store
+from descriptor_knn import squared_norms, block_distances, MAX_BLOCK_ELEMENTS
+
+METRICS = ("chamfer", "modified_hausdorff", "hausdorff")
+DATA_FILE = "distances.npy"
+STRUCTURES_FILE = "structures.csv"
+HEADER_FILE = "distances.json"
+
+def patch_rows(offset, n_rows, structure_id, max_patches, seed=0):
+    """
+    Store rows used for one structure: all of them, or a random subset of max_patches.
+    The subset is seeded by the structure ID so it is the same in every run, whatever else is in the store.
+    """
+    if not max_patches or n_rows <= max_patches:
+        return np.arange(offset, offset + n_rows)
+    rng = np.random.default_rng([seed, zlib.crc32(str(structure_id).encode())])
+    return offset + np.sort(rng.choice(n_rows, max_patches, replace=False))
+
+def nearest_patch_distances(a, a_norms, b, b_norms):
+    """Distance from every patch of a to its nearest patch in b and vice versa, in blocks of a."""
+    block_rows = max(1, MAX_BLOCK_ELEMENTS // max(1, len(b)))
+    a_to_b = np.empty(len(a), dtype=np.float32)
+    b_to_a = np.full(len(b), np.inf, dtype=np.float32)
+    for start in range(0, len(a), block_rows):
+        d = block_distances(a[start:start + block_rows], a_norms[start:start + block_rows], b, b_norms)
+        a_to_b[start:start + len(d)] = d.min(axis=1)
+        np.minimum(b_to_a, d.min(axis=0), out=b_to_a)
+    return np.sqrt(a_to_b), np.sqrt(b_to_a)
+
+def set_distance(a_to_b, b_to_a, metric="chamfer"):
+    if metric == "chamfer":
+        return 0.5 * (a_to_b.mean() + b_to_a.mean())
+    if metric == "modified_hausdorff":
+        return max(a_to_b.mean(), b_to_a.mean())
+    return max(a_to_b.max(), b_to_a.max())
+
+# Per-process state, set up once by init_worker
+worker = {}
+
+def init_worker(store_dir, matrix_path, metric, max_patches, seed, new):
+    matrix, index = open_store(store_dir)
+    worker.update(matrix=matrix, offsets=index["row_offset"].to_numpy(), counts=index["n_rows"].to_numpy(),
+                  ids=index["structure_id"].to_numpy(), distances=np.load(matrix_path, mmap_mode="r+"),
+                  metric=metric, max_patches=max_patches, seed=seed, new=new)
+
+def load_set(i):
+    rows = patch_rows(worker["offsets"][i], worker["counts"][i], worker["ids"][i], worker["max_patches"], worker["seed"])
+    patches = np.asarray(worker["matrix"][rows], dtype=np.float32)
+    return patches, squared_norms(patches)
+
+def compute_tile(row_start, row_stop, col_start, col_stop):
+    """Fill every pair (i < j) of a tile that involves a new structure, in both triangles. Returns the pair count."""
+    new, distances = worker["new"], worker["distances"]
+    cols = {}
+    n_pairs = 0
+    for i in range(row_start, row_stop):
+        a = None
+        for j in range(max(col_start, i + 1), col_stop):
+            if not (new[i] or new[j]):
+                continue
+            if a is None:
+                a = load_set(i)
+            if j not in cols:
+                cols[j] = load_set(j)
+            value = set_distance(*nearest_patch_distances(*a, *cols[j]), worker["metric"])
+            distances[i, j] = distances[j, i] = value
+            n_pairs += 1
+    distances.flush()
+    return n_pairs
+
+def read_previous(out_dir, params):
+    """Structure keys of an existing matrix computed with the same parameters, or None."""
+    header_path = out_dir / HEADER_FILE
+    if not header_path.exists() or not (out_dir / DATA_FILE).exists():
+        return None
+    with open(header_path) as f:
+        if json.load(f)["params"] != params:
+            print("[INFO] Parameters changed since the last run; recomputing the whole matrix")
+            return None
+    previous = pd.read_csv(out_dir / STRUCTURES_FILE, dtype={"structure": str, "structure_id": str})
+    return list(zip(previous["structure"], previous["structure_id"]))
+
+def copy_previous(old_path, distances, old_positions, new_positions):
+    """Copy the kept part of the previous matrix into its new positions, a block of rows at a time."""
+    old = np.load(old_path, mmap_mode="r")
+    old_positions, new_positions = np.asarray(old_positions), np.asarray(new_positions)
+    prefix = np.array_equal(old_positions, np.arange(len(old))) and np.array_equal(new_positions, old_positions)
+    block_rows = max(1, MAX_BLOCK_ELEMENTS // max(1, len(old)))
+    for start in range(0, len(old_positions), block_rows):
+        stop = min(start + block_rows, len(old_positions))
+        if prefix:
+            # Usual case, structures only appended: the old matrix is the top-left corner of the new one
+            distances[start:stop, :len(old)] = old[start:stop]
+        else:
+            rows = np.asarray(old[old_positions[start:stop]])[:, old_positions]
+            distances[new_positions[start:stop, None], new_positions[None, :]] = rows
+
+def compute_distances(store_dir, out_dir, metric="chamfer", max_patches=1000, seed=0, workers=1, tile=32):
+    """Write (or extend) the set-distance matrix of every structure in the store."""
+    out_dir = Path(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    matrix, index = open_store(store_dir)
+    keys = list(zip(index["structure"], index["structure_id"]))
+    n = len(keys)
+    params = {"metric": metric, "max_patches": max_patches, "seed": seed, "store": str(Path(store_dir).resolve())}
+
+    previous = read_previous(out_dir, params)
+    old_of = {key: i for i, key in enumerate(previous or [])}
+    kept = [(i, old_of[key]) for i, key in enumerate(keys) if key in old_of]
+    new = np.ones(n, dtype=bool)
+    new[[i for i, _ in kept]] = False
+
+    tmp_path = out_dir / (DATA_FILE + ".tmp")
+    distances = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(n, n))
+    if kept:
+        copy_previous(out_dir / DATA_FILE, distances, [old for _, old in kept], [i for i, _ in kept])
+    distances.flush()
+    del distances
+
+    # Upper-triangle tiles that hold at least one pair involving a new structure
+    starts = range(0, n, tile)
+    tiles = [(r, min(r + tile, n), c, min(c + tile, n)) for r in starts for c in starts
+             if c >= r and (new[r:r + tile].any() or new[c:c + tile].any())]
+    n_pairs = (n * (n - 1) - (n - new.sum()) * (n - new.sum() - 1)) // 2
+    print(f"[INFO] {n} structures ({new.sum()} new, {len(kept)} reused): computing {n_pairs} {metric} distances "
+          f"in {len(tiles)} tiles on {workers} workers")
+
+    start = time.time()
+    done = 0
+    initargs = (store_dir, tmp_path, metric, max_patches, seed, new)
+    if workers <= 1:
+        init_worker(*initargs)
+        results = (compute_tile(*t) for t in tiles)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs)
+        results = (future.result() for future in as_completed([executor.submit(compute_tile, *t) for t in tiles]))
+    try:
+        for n_tile in results:
+            done += n_tile
+            if n_tile and n_pairs and done * 10 // n_pairs != (done - n_tile) * 10 // n_pairs:
+                print(f"[INFO] {done}/{n_pairs} pairs ({time.time() - start:.0f}s)")
+    finally:
+        if workers > 1:
+            executor.shutdown(cancel_futures=True)
+
+    os.replace(tmp_path, out_dir / DATA_FILE)
+    index.drop(columns=["row_offset", "n_rows"]).to_csv(out_dir / STRUCTURES_FILE, index=False)
+    with open(out_dir / HEADER_FILE, "w") as f:
+        json.dump({"params": params, "n_structures": n}, f, indent=1)
+    print(f"[INFO] Saved {n} x {n} distance matrix: {out_dir / DATA_FILE}")
+
+def condensed_distances(distances):
+    """Upper triangle of a (memory-mapped) square matrix in scipy's condensed order, read a row at a time."""
+    n = len(distances)
+    condensed = np.empty(n * (n - 1) // 2, dtype=np.float64)
+    start = 0
+    for i in range(n - 1):
+        condensed[start:start + n - i - 1] = distances[i, i + 1:]
+        start += n - i - 1
+    return condensed
+
+def cluster_structures(out_dir, method="average", n_clusters=None, threshold=None, metadata_csv=None,
+                       family_column="ligand_family", plot=None):
+    """Hierarchical clustering of the distance matrix; writes clusters.csv and linkage.npy."""
+    from scipy.cluster.hierarchy import linkage, fcluster, dendrogram
+    from sklearn.metrics import adjusted_rand_score
+
+    out_dir = Path(out_dir)
+    with open(out_dir / HEADER_FILE) as f:
+        metric = json.load(f)["params"]["metric"]
+    distances = np.load(out_dir / DATA_FILE, mmap_mode="r")
+    structures = pd.read_csv(out_dir / STRUCTURES_FILE, dtype={"structure": str, "structure_id": str})
+    if metadata_csv:
+        metadata = pd.read_csv(metadata_csv).astype({"structure": str}).drop_duplicates("structure")
+        replaced = [c for c in metadata.columns if c in structures.columns and c != "structure"]
+        structures = structures.drop(columns=replaced).merge(metadata, on="structure", how="left")
+    families = structures[family_column] if family_column in structures.columns else None
+
+    if n_clusters is None and threshold is None:
+        if families is None:
+            raise SystemExit(f"No '{family_column}' column to take the cluster count from; pass --n_clusters or --threshold")
+        n_clusters = int(families.nunique())
+    if method in ("ward", "centroid", "median"):
+        print(f"[WARN] {method} linkage assumes Euclidean distances; set distances are not, so average or complete is safer")
+
+    Z = linkage(condensed_distances(distances), method=method)
+    if threshold is not None:
+        labels = fcluster(Z, threshold, criterion="distance")
+    else:
+        labels = fcluster(Z, n_clusters, criterion="maxclust")
+    structures.insert(2, "cluster", labels)
+    np.save(out_dir / "linkage.npy", Z)
+    structures.to_csv(out_dir / "clusters.csv", index=False)
+    print(f"[INFO] {len(structures)} structures in {labels.max()} clusters ({method} linkage): {out_dir / 'clusters.csv'}")
+
+    if families is not None:
+        known = families.notna().to_numpy()
+        table = pd.crosstab(structures["cluster"], structures[family_column])
+        print(table.to_string())
+        table.to_csv(out_dir / "clusters_by_family.csv")
+        print(f"Adjusted Rand index vs {family_column}: "
+              f"{adjusted_rand_score(families[known].astype(str), labels[known]):.3f}")
+
+    if plot:
+        import matplotlib.pyplot as plt
+        show_labels = len(structures) <= 200
+        fig, ax = plt.subplots(figsize=(max(8, 0.12 * len(structures)) if show_labels else 12, 6))
+        # Colour the branches of the clusters that were cut
+        cut = threshold if threshold is not None else (Z[-(labels.max() - 1), 2] if labels.max() > 1 else 0)
+        tree = dendrogram(Z, ax=ax, color_threshold=cut, no_labels=not show_labels, leaf_font_size=6,
+                          labels=structures["structure"].tolist() if show_labels else None)
+        if show_labels and families is not None:
+            palette = plt.get_cmap("tab10")
+            colours = {family: palette(i % 10) for i, family in enumerate(sorted(families.dropna().astype(str).unique()))}
+            family_of = dict(zip(structures["structure"], families.astype(str)))
+            for tick in ax.get_xticklabels():
+                tick.set_color(colours.get(family_of.get(tick.get_text()), "black"))
+        ax.set_ylabel(f"{metric} distance")
+        fig.tight_layout()
+        fig.savefig(plot, dpi=300)
+        print(f"[INFO] Saved dendrogram ({len(tree['leaves'])} leaves): {plot}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Set-to-set distances between MaSIF descriptor sets and hierarchical clustering.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compute = subparsers.add_parser("compute", help="Compute or extend the distance matrix of a descriptor store")
+    compute.add_argument("-s", "--store", type=str, required=True, help="Descriptor store directory")
+    compute.add_argument("-o", "--out_dir", type=str, required=True, help="Directory for distances.npy and structures.csv")
+    compute.add_argument("--metric", choices=METRICS, default="chamfer", help="Set-to-set distance (default: chamfer)")
+    compute.add_argument("--max_patches", type=int, default=1000,
+                         help="Random patches per structure (fixed per structure ID); 0 uses every patch (default: 1000)")
+    compute.add_argument("--seed", type=int, default=0, help="Seed for the patch subsets")
+    compute.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: all CPUs)")
+    compute.add_argument("--tile", type=int, default=32, help="Structures per tile side handed to a worker (default: 32)")
+
+    cluster = subparsers.add_parser("cluster", help="Hierarchical clustering of a computed distance matrix")
+    cluster.add_argument("-o", "--out_dir", type=str, required=True, help="Directory written by compute")
+    cluster.add_argument("--method", choices=["average", "complete", "single", "weighted", "ward"], default="average",
+                         help="Linkage method (default: average)")
+    cluster.add_argument("--n_clusters", type=int, help="Number of clusters (default: number of ligand families)")
+    cluster.add_argument("--threshold", type=float, help="Cut the tree at this distance instead of --n_clusters")
+    cluster.add_argument("--metadata_csv", type=str, help="Metadata CSV to merge on 'structure' (default: store index columns)")
+    cluster.add_argument("--family_column", type=str, default="ligand_family", help="Column compared with the clusters")
+    cluster.add_argument("--plot", type=str, help="Optional dendrogram image path")
+    args = parser.parse_args()
+
+    if args.command == "compute":
+        compute_distances(args.store, args.out_dir, args.metric, args.max_patches, args.seed,
+                          max(1, args.workers), max(1, args.tile))
+        return
+    cluster_structures(args.out_dir, args.method, args.n_clusters, args.threshold, args.metadata_csv,
+                       args.family_column, args.plot)
+
+if __name__ == "__main__":
+    main()
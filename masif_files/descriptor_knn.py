@@ -0,0 +1,313 @@
+"""
+Nearest-neighbour search over MaSIF surface descriptors.
+
+Build an index once from a descriptor store (extract_descriptors_to_csv.py --format store), then
+query it with a structure name or a p1_desc_*.npy file to find the most similar structures.
+
+Usage example:
+python descriptor_knn.py build --store <store_dir> --index_dir <index_dir> --level patch
+python descriptor_knn.py query --index_dir <index_dir> --query Nitazene_M_N13 -k 10
+
+Two levels are supported:
+    structure  one pooled vector per structure (see --pooling), searched exhaustively
+    patch      every surface patch in an inverted-file index (k-means coarse lists, about sqrt(N) of them).
+               A query patch is compared only with the patches in its --nprobe closest lists, a query is
+               capped at --max_query_patches patches, and only the --max_lists lists most of them probe
+               are scanned, so the cost of a query grows with sqrt(N) rather than N
+Distances are Euclidean and computed in float32 blocks as |q|^2 - 2 q.x + |x|^2.
+"""
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from descriptor_store import open_store, parse_pooling, pool_descriptors, pooled_matrix
+
+BLOCK_ROWS = 262144
+MAX_LISTS = 64  # inverted lists scanned per query, shared by all of its patches
+MAX_QUERY_PATCHES = 512  # query patches used per patch-level query (a fixed random subset beyond this)
+MAX_BLOCK_ELEMENTS = 1 << 24  # largest query x database distance block held at once (64 MB of float32)
+
+def squared_norms(x):
+    return np.einsum("ij,ij->i", x, x)
+
+def block_distances(queries, query_norms, block, block_norms):
+    """Squared Euclidean distances between queries and a block of database rows, clipped at 0."""
+    d = query_norms[:, None] - 2.0 * (queries @ block.T) + block_norms[None, :]
+    return np.maximum(d, 0.0, out=d)
+
+def merge_topk(best_d, best_i, d, ids, k):
+    """Merge candidate distances/ids into the running top-k arrays (rows are queries)."""
+    all_d = np.concatenate([best_d, d], axis=1)
+    all_i = np.concatenate([best_i, np.broadcast_to(ids, d.shape)], axis=1)
+    if all_d.shape[1] > k:
+        part = np.argpartition(all_d, k - 1, axis=1)[:, :k]
+        all_d = np.take_along_axis(all_d, part, axis=1)
+        all_i = np.take_along_axis(all_i, part, axis=1)
+    return all_d, all_i
+
+def exhaustive_search(queries, vectors, norms, k):
+    """Top-k over all vectors, in query and database blocks so memory stays bounded."""
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    query_norms = squared_norms(queries)
+    block_rows = max(1, min(BLOCK_ROWS, len(vectors)))
+    query_rows = max(1, MAX_BLOCK_ELEMENTS // block_rows)
+    out_d, out_i = [], []
+    for q_start in range(0, len(queries), query_rows):
+        q = slice(q_start, q_start + query_rows)
+        best_d = np.empty((len(queries[q]), 0), dtype=np.float32)
+        best_i = np.empty((len(queries[q]), 0), dtype=np.int64)
+        for block_start in range(0, len(vectors), block_rows):
+            block_stop = min(block_start + block_rows, len(vectors))
+            block = np.asarray(vectors[block_start:block_stop], dtype=np.float32)
+            d = block_distances(queries[q], query_norms[q], block, np.asarray(norms[block_start:block_stop]))
+            best_d, best_i = merge_topk(best_d, best_i, d, np.arange(block_start, block_stop), k)
+        out_d.append(best_d)
+        out_i.append(best_i)
+    return np.concatenate(out_d), np.concatenate(out_i)
+
+def train_coarse_lists(vectors, nlist, n_iter=10, sample_size=None, seed=0):
+    """k-means centroids for the inverted lists, trained on a random sample of rows."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), sample_size or 32 * nlist)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(n_iter):
+        _, assign = exhaustive_search(sample, centroids, squared_norms(centroids), 1)
+        assign = assign[:, 0]
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Reseed empty lists with the sample points furthest from their centroid
+        if empty.any():
+            far = np.argsort(squared_norms(sample - centroids[assign]))[-empty.sum():]
+            centroids[empty] = sample[far]
+    return centroids
+
+def assign_lists(vectors, centroids):
+    centroid_norms = squared_norms(centroids)
+    assign = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + BLOCK_ROWS], dtype=np.float32)
+        _, nearest = exhaustive_search(block, centroids, centroid_norms, 1)
+        assign[start:start + len(block)] = nearest[:, 0]
+    return assign
+
+def build_index(store_dir, index_dir, level="structure", pooling="mean,max", nlist=None):
+    """Write vectors, norms, row labels and (for patch level) inverted lists to index_dir."""
+    index_dir = Path(index_dir)
+    os.makedirs(index_dir, exist_ok=True)
+    matrix, store_index = open_store(store_dir)
+    structure_of_row = np.repeat(np.arange(len(store_index), dtype=np.int32), store_index["n_rows"].to_numpy())
+
+    if level == "structure":
+        vectors = pooled_matrix(matrix, store_index, parse_pooling(pooling))
+        labels = np.arange(len(store_index), dtype=np.int32)
+        vertices = np.zeros(len(store_index), dtype=np.int32)
+        row_offsets, n_rows = np.arange(len(store_index)), np.ones(len(store_index), dtype=np.int64)
+        nlist = 1
+    else:
+        vectors = matrix
+        labels = structure_of_row
+        vertices = (np.arange(len(matrix)) - store_index["row_offset"].to_numpy()[structure_of_row]).astype(np.int32)
+        row_offsets, n_rows = store_index["row_offset"].to_numpy(), store_index["n_rows"].to_numpy()
+        if nlist is None:
+            nlist = 1 if len(matrix) < 10_000 else int(np.sqrt(len(matrix)))
+
+    if nlist > 1:
+        print(f"[INFO] Training {nlist} coarse lists on {len(vectors)} vectors...")
+        centroids = train_coarse_lists(vectors, nlist)
+        assign = assign_lists(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))])
+        np.save(index_dir / "centroids.npy", centroids)
+    else:
+        order = np.arange(len(vectors))
+        list_offsets = np.array([0, len(vectors)])
+    np.save(index_dir / "list_offsets.npy", list_offsets)
+
+    out = np.lib.format.open_memmap(index_dir / "vectors.npy", mode="w+", dtype=np.float32,
+                                    shape=(len(vectors), vectors.shape[1]))
+    norms = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(order), BLOCK_ROWS):
+        rows = order[start:start + BLOCK_ROWS]
+        block = np.asarray(vectors[np.sort(rows)], dtype=np.float32)[np.argsort(np.argsort(rows))]
+        out[start:start + len(rows)] = block
+        norms[start:start + len(rows)] = squared_norms(block)
+    out.flush()
+    np.save(index_dir / "norms.npy", norms)
+    np.save(index_dir / "labels.npy", labels[order])
+    np.save(index_dir / "vertices.npy", vertices[order])
+    # positions[r] is the index row holding input row r, so a structure's rows are positions[start:stop]
+    positions = np.empty(len(order), dtype=np.int64)
+    positions[order] = np.arange(len(order))
+    np.save(index_dir / "positions.npy", positions)
+    structures = store_index[["structure", "structure_id"]].assign(row_offset=row_offsets, n_rows=n_rows)
+    structures.to_csv(index_dir / "structures.csv", index=False)
+
+    with open(index_dir / "index.json", "w") as f:
+        json.dump({"level": level, "pooling": pooling, "dim": int(vectors.shape[1]),
+                   "n_vectors": int(len(vectors)), "nlist": int(nlist),
+                   "store": str(Path(store_dir).resolve())}, f, indent=1)
+    print(f"[INFO] Built {level}-level index over {len(vectors)} vectors ({nlist} lists): {index_dir}")
+
+def load_index(index_dir):
+    index_dir = Path(index_dir)
+    with open(index_dir / "index.json") as f:
+        index = json.load(f)
+    index["vectors"] = np.load(index_dir / "vectors.npy", mmap_mode="r")
+    index["norms"] = np.load(index_dir / "norms.npy", mmap_mode="r")
+    index["labels"] = np.load(index_dir / "labels.npy", mmap_mode="r")
+    index["vertices"] = np.load(index_dir / "vertices.npy", mmap_mode="r")
+    index["list_offsets"] = np.load(index_dir / "list_offsets.npy")
+    if (index_dir / "positions.npy").exists():
+        index["positions"] = np.load(index_dir / "positions.npy", mmap_mode="r")
+    index["structures"] = pd.read_csv(index_dir / "structures.csv", dtype=str)
+    if index["nlist"] > 1:
+        index["centroids"] = np.load(index_dir / "centroids.npy")
+    return index
+
+def search(index, queries, k, nprobe=8, max_lists=None):
+    """
+    Top-k (squared distance, row) per query; with inverted lists only the nprobe closest lists of each
+    query are scanned. max_lists caps the lists scanned for the whole batch of queries: the lists probed
+    by the most queries (ties broken by how close they rank) are kept. Queries whose probes were all
+    dropped get no hits (row -1).
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    vectors, norms, offsets = index["vectors"], index["norms"], index["list_offsets"]
+    if index["nlist"] == 1:
+        return exhaustive_search(queries, vectors, norms, k)
+
+    centroids = index["centroids"]
+    nprobe = min(nprobe, len(centroids))
+    _, probes = exhaustive_search(queries, centroids, squared_norms(centroids), nprobe)
+    lists = np.unique(probes)
+    if max_lists is not None and len(lists) > max_lists:
+        # Rank lists by how many queries probe them, then by how highly those queries rank them
+        rank_weight = np.broadcast_to(nprobe - np.arange(nprobe), probes.shape)
+        counts = np.bincount(probes.ravel(), minlength=len(centroids))
+        weights = np.bincount(probes.ravel(), weights=rank_weight.ravel(), minlength=len(centroids))
+        lists = np.sort(np.lexsort((-weights, -counts))[:max_lists])
+    query_norms = squared_norms(queries)
+    best_d = np.full((len(queries), k), np.inf, dtype=np.float32)
+    best_i = np.full((len(queries), k), -1, dtype=np.int64)
+    # Group the (query, list) probes by list so each scanned list is compared with all its queries at once
+    by_list = np.argsort(probes.ravel(), kind="stable")
+    sorted_probes = probes.ravel()[by_list]
+    first = np.searchsorted(sorted_probes, lists, side="left")
+    last = np.searchsorted(sorted_probes, lists, side="right")
+    for list_id, lo, hi in zip(lists, first, last):
+        start, stop = offsets[list_id], offsets[list_id + 1]
+        if start == stop:
+            continue
+        q = by_list[lo:hi] // nprobe
+        block = np.asarray(vectors[start:stop], dtype=np.float32)
+        d = block_distances(queries[q], query_norms[q], block, np.asarray(norms[start:stop]))
+        best_d[q], best_i[q] = merge_topk(best_d[q], best_i[q], d, np.arange(start, stop), k)
+    return best_d, best_i
+
+def query_vectors(index, query):
+    """Vectors for a structure name/ID in the index, or for a p1_desc_*.npy file. Returns (vectors, structure row or None)."""
+    structures = index["structures"]
+    if query.endswith(".npy") and Path(query).exists():
+        array = np.load(query)
+        array = array.reshape(array.shape[0], -1) if array.ndim > 1 else array.reshape(1, -1)
+        if index["level"] == "structure":
+            return pool_descriptors(array, parse_pooling(index["pooling"]))[None, :], None
+        return array.astype(np.float32), None
+
+    match = np.flatnonzero((structures["structure"] == query) | (structures["structure_id"] == query))
+    if len(match) == 0:
+        raise ValueError(f"'{query}' is not a structure in the index or an existing .npy file.")
+    if "positions" in index:
+        start, n = int(structures["row_offset"].iloc[match[0]]), int(structures["n_rows"].iloc[match[0]])
+        rows = np.sort(index["positions"][start:start + n])
+    else:  # indexes built before positions.npy was written
+        rows = np.flatnonzero(np.asarray(index["labels"]) == match[0])
+    return np.asarray(index["vectors"][rows], dtype=np.float32), int(match[0])
+
+def rank_structures(index, query, k=10, nprobe=8, patch_k=10, max_lists=MAX_LISTS,
+                    max_query_patches=MAX_QUERY_PATCHES):
+    """
+    Top-k most similar structures as a DataFrame, excluding the query structure itself.
+    At patch level at most max_query_patches query patches (a fixed random subset) vote, and together
+    they scan at most max_lists inverted lists.
+    """
+    vectors, self_row = query_vectors(index, query)
+    labels = index["labels"]
+    names = index["structures"]["structure"].to_numpy()
+
+    if index["level"] == "structure":
+        d, rows = search(index, vectors, k + 1, nprobe)
+        hits = [(labels[r], float(np.sqrt(dist))) for dist, r in sorted(zip(d[0], rows[0])) if r >= 0]
+        hits = [(s, dist) for s, dist in hits if s != self_row][:k]
+        return pd.DataFrame({"structure": [names[s] for s, _ in hits], "distance": [dist for _, dist in hits]})
+
+    # Patch level: each query patch votes for the structure of its nearest patch outside the query structure
+    if max_query_patches and len(vectors) > max_query_patches:
+        rng = np.random.default_rng(0)
+        vectors = vectors[np.sort(rng.choice(len(vectors), max_query_patches, replace=False))]
+    d, rows = search(index, vectors, patch_k, nprobe, max_lists)
+    hit_labels = np.where(rows >= 0, np.asarray(labels)[np.maximum(rows, 0)], -1)
+    d = np.where((hit_labels == self_row) | (hit_labels < 0), np.inf, d)
+    nearest = np.argmin(d, axis=1)
+    best_d = d[np.arange(len(d)), nearest]
+    best_s = hit_labels[np.arange(len(d)), nearest]
+    found = np.isfinite(best_d)
+    votes = np.bincount(best_s[found], minlength=len(names))
+    dist_sum = np.bincount(best_s[found], weights=np.sqrt(best_d[found]), minlength=len(names))
+    candidates = np.flatnonzero(votes)
+    mean_dist = dist_sum[candidates] / votes[candidates]
+    order = np.lexsort((mean_dist, -votes[candidates]))[:k]
+    return pd.DataFrame({"structure": names[candidates[order]],
+                         "votes": votes[candidates[order]],
+                         "patch_fraction": votes[candidates[order]] / len(vectors),
+                         "mean_patch_distance": mean_dist[order]})
+
+def main():
+    parser = argparse.ArgumentParser(description="Nearest-neighbour index over MaSIF descriptors.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Build an index from a descriptor store")
+    build.add_argument("-s", "--store", type=str, required=True, help="Descriptor store directory")
+    build.add_argument("-x", "--index_dir", type=str, required=True, help="Directory to write the index to")
+    build.add_argument("-l", "--level", choices=["structure", "patch"], default="structure",
+                       help="Index pooled per-structure vectors or individual surface patches")
+    build.add_argument("--pooling", type=str, default="mean,max", help="Pooling for --level structure (default: mean,max)")
+    build.add_argument("--nlist", type=int, help="Inverted lists for --level patch (default: sqrt(N) above 10k patches, else exhaustive)")
+
+    query = subparsers.add_parser("query", help="Find the structures most similar to a query")
+    query.add_argument("-x", "--index_dir", type=str, required=True, help="Index directory")
+    query.add_argument("-q", "--query", type=str, required=True, help="Structure name/ID in the index, or a p1_desc_*.npy file")
+    query.add_argument("-k", "--top_k", type=int, default=10, help="Number of structures to return")
+    query.add_argument("--nprobe", type=int, default=8, help="Inverted lists scanned per query patch")
+    query.add_argument("--patch_k", type=int, default=10, help="Neighbours retrieved per query patch (patch level)")
+    query.add_argument("--max_lists", type=int, default=MAX_LISTS,
+                       help=f"Inverted lists scanned per query, across all of its patches (default: {MAX_LISTS})")
+    query.add_argument("--max_query_patches", type=int, default=MAX_QUERY_PATCHES,
+                       help=f"Query patches used at patch level, 0 for all (default: {MAX_QUERY_PATCHES})")
+    query.add_argument("-o", "--output_csv", type=str, help="Optional CSV to save the results to")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_index(args.store, args.index_dir, args.level, args.pooling, args.nlist)
+        return
+
+    start = time.perf_counter()
+    index = load_index(args.index_dir)
+    results = rank_structures(index, args.query, args.top_k, args.nprobe, args.patch_k, args.max_lists,
+                              args.max_query_patches)
+    print(results.to_string(index=False))
+    print(f"[INFO] Loaded the index and ranked structures in {time.perf_counter() - start:.3f}s")
+    if args.output_csv:
+        results.to_csv(args.output_csv, index=False)
+        print(f"[INFO] Saved matches to {args.output_csv}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Binary descriptor store for MaSIF outputs.
+
+A store is a directory holding:
+    descriptors.f32  raw float32 rows (one row per surface patch), appended in place
+    index.csv        one row per structure: structure, structure_id, row_offset, n_rows + merged metadata
+    store.json       dtype, descriptor dimension and total row count
+    store.lock       flock target that serializes writers
+
+New structures are appended to descriptors.f32 without rewriting it, and the matrix is
+read back with np.memmap so nothing has to be parsed. index.csv is written last and is what
+defines the stored rows, so an append interrupted at any point leaves the previous store intact.
+"""
+
+import json
+import os
+import fcntl
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+from pathlib import Path
+
+DATA_FILE = "descriptors.f32"
+INDEX_FILE = "index.csv"
+HEADER_FILE = "store.json"
+LOCK_FILE = "store.lock"
+INDEX_COLUMNS = ["structure", "structure_id", "row_offset", "n_rows"]
+
+def _write_atomic(path, write):
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+@contextmanager
+def _store_lock(store_dir):
+    """Exclusive lock on the store, so concurrent writers (e.g. the pipeline and a rerun) take turns."""
+    with open(Path(store_dir) / LOCK_FILE, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def read_header(store_dir):
+    header_path = Path(store_dir) / HEADER_FILE
+    if not header_path.exists():
+        return {"dtype": "float32", "dim": None, "n_rows": 0}
+    with open(header_path) as f:
+        return json.load(f)
+
+def read_index(store_dir):
+    index_path = Path(store_dir) / INDEX_FILE
+    if not index_path.exists():
+        return pd.DataFrame(columns=INDEX_COLUMNS)
+    return pd.read_csv(index_path, dtype={"structure": str, "structure_id": str})
+
+def indexed_rows(index):
+    """Number of descriptor rows the index refers to; rows past this are left over from an interrupted append."""
+    return int((index["row_offset"] + index["n_rows"]).max()) if len(index) else 0
+
+def open_store(store_dir):
+    """Return (memory-mapped float32 matrix of all patch rows, index DataFrame)."""
+    store_dir = Path(store_dir)
+    header = read_header(store_dir)
+    index = read_index(store_dir)
+    n_rows = indexed_rows(index)
+    if n_rows == 0:
+        return np.empty((0, header["dim"] or 0), dtype=np.float32), index
+    matrix = np.memmap(store_dir / DATA_FILE, dtype=header["dtype"], mode="r", shape=(n_rows, header["dim"]))
+    return matrix, index
+
+def append_structures(store_dir, entries):
+    """
+    Append (structure_id, structure, array) entries to the store.
+    Each array is stored as (n_patches, dim) float32 rows; arrays without rows and structures already in
+    the store (checked under the store lock, so concurrent writers never both add one) are skipped.
+    Returns the number of structures added.
+    """
+    store_dir = Path(store_dir)
+    os.makedirs(store_dir, exist_ok=True)
+    with _store_lock(store_dir):
+        header = read_header(store_dir)
+        index = read_index(store_dir)
+        data_path = store_dir / DATA_FILE
+
+        new_rows = []
+        stored = set(index["structure"])
+        n_rows = indexed_rows(index)
+        with open(data_path, "ab") as f:
+            # Drop any rows left behind by an interrupted append
+            f.truncate(n_rows * (header["dim"] or 0) * np.dtype(header["dtype"]).itemsize)
+            for structure_id, structure, array in entries:
+                if structure in stored:
+                    print(f"[INFO] Skipping {structure}: already in the store")
+                    continue
+                array = np.ascontiguousarray(array, dtype=np.float32)
+                if array.size == 0:
+                    print(f"[WARN] Skipping {structure}: no descriptor rows")
+                    continue
+                array = array.reshape(array.shape[0], -1) if array.ndim > 1 else array.reshape(1, -1)
+                if header["dim"] is None:
+                    header["dim"] = array.shape[1]
+                elif array.shape[1] != header["dim"]:
+                    print(f"[WARN] Skipping {structure}: descriptor dim {array.shape[1]} != store dim {header['dim']}")
+                    continue
+                f.write(array.tobytes())
+                new_rows.append({"structure": structure, "structure_id": structure_id,
+                                 "row_offset": n_rows, "n_rows": array.shape[0]})
+                stored.add(structure)
+                n_rows += array.shape[0]
+
+        if new_rows:
+            index = pd.concat([index, pd.DataFrame(new_rows)], ignore_index=True)
+            header["n_rows"] = n_rows
+            # The index commits the append, so it is replaced only after the header is in place
+            _write_atomic(store_dir / HEADER_FILE, lambda p: p.write_text(json.dumps(header, indent=1)))
+            _write_atomic(store_dir / INDEX_FILE, lambda p: index.to_csv(p, index=False))
+    return len(new_rows)
+
+def merge_metadata(store_dir, metadata):
+    """Merge a metadata DataFrame into the store index on 'structure', replacing overlapping columns."""
+    store_dir = Path(store_dir)
+    with _store_lock(store_dir):
+        index = read_index(store_dir)
+        metadata = metadata.astype({"structure": str}).drop_duplicates("structure")
+        replaced = [c for c in metadata.columns if c in index.columns and c not in INDEX_COLUMNS]
+        index = index.drop(columns=replaced).merge(metadata, on="structure", how="left")
+        _write_atomic(store_dir / INDEX_FILE, lambda p: index.to_csv(p, index=False))
+    return index
+
+def structure_matrix(matrix, index):
+    """
+    One flattened row per structure, zero-padded to the longest structure.
+    This matches the layout of the CSV written by extract_descriptors_to_csv.py.
+    """
+    dim = matrix.shape[1]
+    width = int(index["n_rows"].max()) * dim if len(index) else 0
+    out = np.zeros((len(index), width), dtype=np.float32)
+    for i, (offset, n_rows) in enumerate(zip(index["row_offset"], index["n_rows"])):
+        out[i, :n_rows * dim] = matrix[offset:offset + n_rows].ravel()
+    return out
+
+def parse_pooling(pooling):
+    """Turn 'mean,max,p90' into a list of statistic names, validating each one."""
+    stats = [stat.strip() for stat in pooling.split(",") if stat.strip()]
+    for stat in stats:
+        if stat not in ("mean", "max", "min", "std") and not (stat[0] == "p" and stat[1:].isdigit()):
+            raise ValueError(f"Unknown pooling statistic '{stat}' (use mean, max, min, std or pNN)")
+    return stats
+
+def pooled_columns(stats, dim):
+    return [f"{stat}_{i}" for stat in stats for i in range(dim)]
+
+def pool_descriptors(array, stats):
+    """Fixed-length summary of one structure's (n_patches, dim) descriptors, one block per statistic."""
+    array = np.asarray(array, dtype=np.float32)
+    array = array.reshape(array.shape[0], -1) if array.ndim > 1 else array.reshape(1, -1)
+    blocks = []
+    for stat in stats:
+        if stat in ("mean", "max", "min", "std"):
+            blocks.append(getattr(array, stat)(axis=0))
+        else:
+            blocks.append(np.percentile(array, int(stat[1:]), axis=0))
+    return np.concatenate(blocks).astype(np.float32)
+
+def pooled_matrix(matrix, index, stats, block_rows=1_000_000):
+    """
+    Pool every structure in the store, reading the memmap in blocks of about block_rows patch rows.
+    mean/max/min are computed with np.*.reduceat over all structures in a block at once.
+    Structures without rows pool to zeros, like their zero-padded rows in structure_matrix.
+    """
+    dim = matrix.shape[1]
+    offsets = index["row_offset"].to_numpy()
+    counts = index["n_rows"].to_numpy()
+    out = np.zeros((len(index), len(stats) * dim), dtype=np.float32)
+
+    start = 0
+    while start < len(index):
+        stop = start + 1
+        while stop < len(index) and offsets[stop] + counts[stop] - offsets[start] <= block_rows:
+            stop += 1
+        # reduceat would return a neighbouring row for an empty segment, so only pool non-empty structures
+        rows = start + np.flatnonzero(counts[start:stop])
+        if len(rows) == 0:
+            start = stop
+            continue
+        block = np.asarray(matrix[offsets[start]:offsets[stop - 1] + counts[stop - 1]], dtype=np.float32)
+        local = offsets[rows] - offsets[start]
+        for j, stat in enumerate(stats):
+            cols = slice(j * dim, (j + 1) * dim)
+            if stat == "mean":
+                out[rows, cols] = np.add.reduceat(block, local, axis=0) / counts[rows, None]
+            elif stat == "max":
+                out[rows, cols] = np.maximum.reduceat(block, local, axis=0)
+            elif stat == "min":
+                out[rows, cols] = np.minimum.reduceat(block, local, axis=0)
+            else:
+                for row, offset in zip(rows, local):
+                    out[row, cols] = pool_descriptors(block[offset:offset + counts[row]], [stat])
+        start = stop
+    return out
@@ -1,7 +1,13 @@
+import json
+import zipfile
 import numpy as np
 import pandas as pd
 from pathlib import Path
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from descriptor_store import (append_structures, merge_metadata, read_index,
+                              parse_pooling, pool_descriptors, pooled_columns)
 
 def load_mapping(mapping_path):
     """Load mapping from 4-digit symlinks to real file names."""
@@ -12,38 +18,164 @@ def load_mapping(mapping_path):
             mapping[symlink.replace(".pdb", "")] = real.replace(".pdb", "")
     return mapping
 
-def collect_descriptors(output_dir, mapping, use_flipped=False):
+def load_manifest_names(manifest_path):
+    """
+    {structure ID: real file name} from the launcher's persistent pdb_manifest.json. Unlike pdb_mapping.txt,
+    which only lists the last run's inputs, it covers every ID ever assigned. An ID shared by files with
+    identical contents takes the name it was first assigned under, so stored names stay stable.
+    """
+    with open(manifest_path) as f:
+        structures = json.load(f)["structures"]
+    return {entry["id"]: entry["names"][0].replace(".pdb", "") for entry in structures.values() if entry["names"]}
+
+def descriptor_path_for(pdb_dir, use_flipped=False):
+    """Descriptor file of a MaSIF output folder, whichever chain(s) (<id>_A, <id>_AB, ...) it was run on."""
+    desc_file = "p1_desc_flipped.npy" if use_flipped else "p1_desc_straight.npy"
+    all_feat = pdb_dir / "descriptors" / "sc05" / "all_feat"
+    chain_dirs = sorted(all_feat.glob(f"{pdb_dir.name}_*"))
+    return (chain_dirs[0] if chain_dirs else all_feat / f"{pdb_dir.name}_A") / desc_file
+
+def archive_member_for(archive, structure_id, use_flipped=False):
+    """Descriptor member of a per-structure output archive (<id>.zip written by run_masif_sif_v2.py --stage_local)."""
+    desc_file = "p1_desc_flipped.npy" if use_flipped else "p1_desc_straight.npy"
+    prefix = f"descriptors/sc05/all_feat/{structure_id}_"
+    members = sorted(name for name in archive.namelist() if name.startswith(prefix) and name.endswith("/" + desc_file))
+    return members[0] if members else f"{prefix}A/{desc_file}"
+
+def _load_archived_descriptor(archive_path, use_flipped=False):
+    """Read a descriptor array straight out of a zip archive without unpacking it."""
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            member = archive_member_for(archive, archive_path.stem, use_flipped)
+            if member not in archive.NameToInfo:
+                print(f"[WARN] Missing: {archive_path}:{member}")
+                return None
+            with archive.open(member) as f:
+                return np.load(f)
+    except Exception as e:
+        print(f"[WARN] Could not load from {archive_path}: {e}")
+        return None
+
+def _load_descriptor(descriptor_path, use_flipped=False):
+    if descriptor_path.suffix == ".zip":
+        return _load_archived_descriptor(descriptor_path, use_flipped)
+    if not descriptor_path.exists():
+        print(f"[WARN] Missing: {descriptor_path}")
+        return None
+    try:
+        return np.load(descriptor_path)
+    except Exception as e:
+        print(f"[WARN] Could not load {descriptor_path}: {e}")
+        return None
+
+def iter_descriptor_arrays(output_dir, mapping, use_flipped=False, skip=(), workers=1):
+    """
+    Yield (structure_id, real_name, descriptor array) for each MaSIF output folder or <id>.zip
+    output archive, in sorted order (an archive takes precedence over a folder with the same ID).
+    Structures whose real name is in skip are not loaded. With workers > 1 the .npy files are
+    loaded by a thread pool, keeping at most 2 * workers arrays in flight.
+    """
+    sources = {}
+    for entry in sorted(Path(output_dir).glob("*")):
+        if entry.is_dir():
+            sources.setdefault(entry.name, descriptor_path_for(entry, use_flipped))
+        elif entry.suffix == ".zip":
+            sources[entry.stem] = entry
+
+    jobs = []
+    for structure_id in sorted(sources):
+        real_name = mapping.get(structure_id, structure_id)
+        if real_name not in skip:
+            jobs.append((structure_id, real_name, sources[structure_id]))
+
+    if workers <= 1:
+        for structure_id, real_name, descriptor_path in jobs:
+            array = _load_descriptor(descriptor_path, use_flipped)
+            if array is not None:
+                yield structure_id, real_name, array
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for job in jobs:
+            pending.append((job, executor.submit(_load_descriptor, job[2], use_flipped)))
+            if len(pending) >= 2 * workers:
+                (structure_id, real_name, _), future = pending.popleft()
+                array = future.result()
+                if array is not None:
+                    yield structure_id, real_name, array
+        while pending:
+            (structure_id, real_name, _), future = pending.popleft()
+            array = future.result()
+            if array is not None:
+                yield structure_id, real_name, array
+
+def collect_descriptors(output_dir, mapping, use_flipped=False, workers=1):
     """
     Collect descriptor vectors from MaSIF output folders.
     """
     data = []
     labels = []
-    desc_file = "p1_desc_flipped.npy" if use_flipped else "p1_desc_straight.npy"
 
-    for pdb_dir in sorted(Path(output_dir).glob("*")):
-        structure_id = pdb_dir.name
-        descriptor_path = pdb_dir / "descriptors" / "sc05" / "all_feat" / f"{structure_id}_A" / desc_file
-
-        if descriptor_path.exists():
-            try:
-                vector = np.load(descriptor_path).flatten()
-                real_name = mapping.get(structure_id, structure_id)
-                data.append(vector)
-                labels.append(real_name)
-            except Exception as e:
-                print(f"[WARN] Could not load {descriptor_path}: {e}")
-        else:
-            print(f"[WARN] Missing: {descriptor_path}")
+    for _, real_name, array in iter_descriptor_arrays(output_dir, mapping, use_flipped, workers=workers):
+        data.append(array.flatten())
+        labels.append(real_name)
 
     df = pd.DataFrame(data)
     df.insert(0, "structure", labels)
     return df
 
+def write_store(output_dir, mapping, store_dir, metadata=None, use_flipped=False, workers=1):
+    """Append structures not already in the binary store, then merge metadata into its index."""
+    # Only saves loading arrays that are already stored; append_structures rechecks under the store lock
+    existing = set(read_index(store_dir)["structure"])
+    entries = iter_descriptor_arrays(output_dir, mapping, use_flipped, skip=existing, workers=workers)
+    added = append_structures(store_dir, entries)
+    print(f"[INFO] Appended {added} structures to {store_dir} ({len(existing)} already stored)")
+    if metadata is not None:
+        merge_metadata(store_dir, metadata)
+
+def stream_csv(output_dir, mapping, csv_path, layout, stats=None, metadata=None, use_flipped=False, workers=1):
+    """
+    Write descriptors to CSV one structure at a time so the full set is never held in memory.
+    layout 'patch' writes one row per surface patch tagged with structure and vertex index;
+    layout 'pooled' writes one fixed-length row of pooled statistics per structure.
+    """
+    if metadata is not None:
+        metadata = metadata.drop_duplicates("structure").set_index("structure")
+
+    n_structures = 0
+    with open(csv_path, "w", newline="") as f:
+        for _, real_name, array in iter_descriptor_arrays(output_dir, mapping, use_flipped, workers=workers):
+            array = array.reshape(array.shape[0], -1) if array.ndim > 1 else array.reshape(1, -1)
+            if layout == "pooled":
+                df = pd.DataFrame(pool_descriptors(array, stats)[None, :],
+                                  columns=pooled_columns(stats, array.shape[1]))
+                df.insert(0, "structure", real_name)
+            else:
+                df = pd.DataFrame(array, columns=[str(i) for i in range(array.shape[1])])
+                df.insert(0, "vertex", np.arange(len(array)))
+                df.insert(0, "structure", real_name)
+            if metadata is not None:
+                df = df.join(metadata, on="structure")
+            df.to_csv(f, header=n_structures == 0, index=False)
+            n_structures += 1
+    return n_structures
+
 def main():
-    parser = argparse.ArgumentParser(description="Extract MaSIF descriptors into a CSV file.")
+    parser = argparse.ArgumentParser(description="Extract MaSIF descriptors into a CSV file or binary descriptor store.")
     parser.add_argument("--output_dir", type=str, required=True, help="Directory with masif_output/")
     parser.add_argument("--log_dir", type=str, required=True, help="Directory with pdb_mapping.txt")
     parser.add_argument("--csv_path", type=str, default="masif_descriptors.csv", help="Output CSV file path")
+    parser.add_argument("--format", choices=["csv", "store"], default="csv",
+                        help="csv: one flattened row per structure; store: float32 per-patch store that can be appended to")
+    parser.add_argument("--layout", choices=["flat", "patch", "pooled"], default="flat",
+                        help="CSV layout: flat (one flattened row per structure), patch (one row per surface patch) "
+                             "or pooled (fixed-length per-structure summaries, see --pooling)")
+    parser.add_argument("--pooling", type=str, default="mean,max",
+                        help="Statistics for --layout pooled: any of mean, max, min, std, pNN (default: mean,max)")
+    parser.add_argument("--workers", type=int, default=4, help="Threads used to load .npy files (default: 4)")
+    parser.add_argument("--store_dir", type=str, default="masif_descriptors_store", help="Output directory for --format store")
     parser.add_argument("--metadata_csv", type=str, help="Optional metadata CSV to merge on 'structure'")
     parser.add_argument("--use_flipped", action="store_true", help="Use p1_desc_flipped.npy instead of straight")
     args = parser.parse_args()
@@ -51,16 +183,33 @@ def main():
     output_dir = Path(args.output_dir)
     log_dir = Path(args.log_dir)
     mapping_path = log_dir / "pdb_mapping.txt"
+    manifest_path = output_dir / "pdb_manifest.json"
+
+    if not mapping_path.exists() and not manifest_path.exists():
+        print(f"[ERROR] Neither {manifest_path} nor the mapping file {mapping_path} was found")
+        return
+
+    # Names come from the manifest; the mapping file only fills in IDs it does not know (e.g. older outputs)
+    mapping = load_mapping(mapping_path) if mapping_path.exists() else {}
+    if manifest_path.exists():
+        mapping.update(load_manifest_names(manifest_path))
+    metadata = pd.read_csv(args.metadata_csv) if args.metadata_csv else None
+
+    if args.format == "store":
+        write_store(output_dir, mapping, args.store_dir, metadata, use_flipped=args.use_flipped, workers=args.workers)
+        print(f"[INFO] Saved descriptor store: {args.store_dir}")
+        return
 
-    if not mapping_path.exists():
-        print(f"[ERROR] Mapping file not found: {mapping_path}")
+    if args.layout != "flat":
+        stats = parse_pooling(args.pooling) if args.layout == "pooled" else None
+        n_structures = stream_csv(output_dir, mapping, args.csv_path, args.layout, stats, metadata,
+                                  use_flipped=args.use_flipped, workers=args.workers)
+        print(f"[INFO] Saved {args.layout} descriptors for {n_structures} structures: {args.csv_path}")
         return
 
-    mapping = load_mapping(mapping_path)
-    df = collect_descriptors(output_dir, mapping, use_flipped=args.use_flipped)
+    df = collect_descriptors(output_dir, mapping, use_flipped=args.use_flipped, workers=args.workers)
 
-    if args.metadata_csv:
-        metadata = pd.read_csv(args.metadata_csv)
+    if metadata is not None:
         df = df.merge(metadata, on="structure", how="left")
 
     df.to_csv(args.csv_path, index=False)
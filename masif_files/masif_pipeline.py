@@ -0,0 +1,376 @@
+"""
+Streaming AlphaFold -> repack -> MaSIF -> descriptor store pipeline.
+
+Instead of running each stage over a whole directory and waiting for its slowest structure, this
+driver watches the AlphaFold output directories and pushes every model through the remaining
+stages as soon as it appears:
+
+    <af_dir>/**/<name>/ranked_0.pdb   (fasta2AF.py's cached parent prediction in _parent_features/ is skipped)
+        -> repack   2repack_biosensor.py's process_pdb in a process pool (PyRosetta initialized once per worker)
+        -> masif    preprocess_pdb.sh in one persistent container instance, --masif_workers at a time
+        -> append   descriptors appended to the float32 store (one writer thread)
+
+Each stage has its own bounded pool, so a slow MaSIF run never stalls repacking and vice versa.
+
+Usage example:
+python masif_pipeline.py --af_dir <AF structure dir> --work_dir <pipeline dir> -m <comparison csv> \
+    --repack_workers 4 --masif_workers 8 --idle_exit 3600
+
+Freshness is tracked per structure, make-style, so re-running the driver only redoes stale work:
+    repack   <work_dir>/repacked/best_packed_<name>.pdb is up to date if it is newer than the model
+             (and the -m/-r file)
+    masif    structure IDs are content hashes of the repacked PDB (pdb_manifest.json), so descriptors
+             for an ID are up to date by construction
+    append   the store already holds <name> under the same structure ID
+
+Work directory layout:
+    models/<name>.pdb               symlinks to the AlphaFold models
+    repacked/                       repacked structures; scores in logs/repack_scores.csv
+    linked_pdbs/<id>.pdb            MaSIF inputs under their content-hash IDs
+    masif_output/                   MaSIF output folders and pdb_manifest.json
+    descriptor_store/               descriptor store (see descriptor_store.py)
+    logs/                           pipeline.log, pipeline_status.tsv, pdb_mapping.txt, masif_metrics.jsonl
+                                    (summarize with run_masif_sif_v2.py --summary --log_dir <work_dir>/logs)
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import importlib.util
+import multiprocessing
+import concurrent.futures
+import pandas as pd
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from run_masif_sif_v2 import (log, default_workers, assign_structure_ids, load_chain_table, descriptors_complete,
+                              slim_structures, create_structure_script, start_instance, stop_instance, run_structure)
+from extract_descriptors_to_csv import descriptor_path_for, _load_descriptor
+from descriptor_store import append_structures, merge_metadata, read_index
+
+# fasta2AF.py --shared_msa predicts the parent sequence here to cache its features; it is not a library member
+PARENT_FEATURES_DIR = "_parent_features"
+DEFAULT_REPACK_SCRIPT = Path(__file__).resolve().parent.parent / "other_related_files" / "pyrosetta_repack_stuff" / "2repack_biosensor.py"
+
+def load_repack_module(script_path):
+    """Import 2repack_biosensor.py (not importable by name) from its path, alongside its clash_screen helper."""
+    script_path = Path(script_path).resolve()
+    sys.path.insert(0, str(script_path.parent))
+    spec = importlib.util.spec_from_file_location("repack_biosensor", script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Per-process repack module, set up once by init_repack_worker
+repack = None
+
+def init_repack_worker(script_path, log_path, mutation_csv, reference_pdb, shell):
+    """Load the repack script and initialize PyRosetta once per worker process, logging to log_path."""
+    global repack
+    sys.stdout = open(log_path, "a", buffering=1)
+    sys.stderr = sys.stdout
+    repack = load_repack_module(script_path)
+    repack.init_worker(mutation_csv, reference_pdb, shell)
+
+def repack_job(model_path, repacked_dir, cycles, min_improvement, patience):
+    return repack.process_pdb(str(model_path), str(repacked_dir), cycles, min_improvement, patience)
+
+def is_fresh(target, sources):
+    """Make-style check: target exists and is at least as new as every source."""
+    if not target.exists():
+        return False
+    target_mtime = target.stat().st_mtime
+    return all(target_mtime >= source.stat().st_mtime for source in sources)
+
+def find_models(af_dirs, model_name, settle):
+    """
+    Return ({structure name: model path}, {structure name: [duplicate model paths]}) for every finished model
+    under af_dirs, named after the folder holding it. The first model found for a name is used; later ones
+    with the same name are returned as duplicates. Models modified less than settle seconds ago may still be
+    being written and are left for the next poll.
+    """
+    models, duplicates = {}, {}
+    now = time.time()
+    for af_dir in af_dirs:
+        for model_path in sorted(af_dir.rglob(model_name)):
+            if PARENT_FEATURES_DIR in model_path.relative_to(af_dir).parts:
+                continue
+            if now - model_path.stat().st_mtime < settle:
+                continue
+            name = model_path.parent.name
+            if name in models:
+                duplicates.setdefault(name, []).append(model_path)
+            else:
+                models[name] = model_path
+    return models, duplicates
+
+def stored_ids(store_dir):
+    """{structure name: structure ID} of everything already in the descriptor store."""
+    index = read_index(store_dir)
+    return dict(zip(index["structure"], index["structure_id"]))
+
+def load_structure_descriptors(output_dir, structure_id, use_flipped=False):
+    """Descriptor array of one MaSIF output folder or <id>.zip archive."""
+    archive_path = output_dir / f"{structure_id}.zip"
+    source = archive_path if archive_path.exists() else descriptor_path_for(output_dir / structure_id, use_flipped)
+    return _load_descriptor(source, use_flipped)
+
+def link(path, target):
+    if path.is_symlink() or path.exists():
+        path.unlink()
+    path.symlink_to(target.resolve())
+
+def write_status(items, status_path):
+    with open(status_path, "w") as f:
+        f.write("name\tstructure_id\tstatus\tseconds\tdetail\n")
+        for name in sorted(items):
+            item = items[name]
+            seconds = f"{item['end'] - item['start']:.0f}" if "end" in item else ""
+            f.write(f"{name}\t{item.get('structure_id', '')}\t{item['status']}\t{seconds}\t{item.get('detail', '')}\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream finished AlphaFold models through repacking, MaSIF and the descriptor store.")
+    parser.add_argument("--af_dir", type=str, nargs="+", required=True, help="AlphaFold structure directories to watch")
+    parser.add_argument("--work_dir", type=str, required=True, help="Pipeline directory (repacked PDBs, MaSIF output, store, logs)")
+    parser.add_argument("--model", type=str, default="ranked_0.pdb", help="Model file to pick up from each prediction (default: ranked_0.pdb)")
+    parser.add_argument("--store_dir", type=str, help="Descriptor store to append to (default: <work_dir>/descriptor_store)")
+    parser.add_argument("--metadata_csv", type=str, help="Optional metadata CSV merged into the store index on 'structure'")
+    parser.add_argument("--sif", type=str, default="/projects/liwh2139/masif/masif-neosurf.sif", help="Path to .sif image")
+    parser.add_argument("--poll", type=float, default=30, help="Seconds between scans of --af_dir (default: 30)")
+    parser.add_argument("--settle", type=float, default=10,
+                        help="Only pick up models not modified for this many seconds (default: 10)")
+    parser.add_argument("--once", action="store_true", help="Process the models present now and exit instead of watching")
+    parser.add_argument("--idle_exit", type=float,
+                        help="Exit after this many seconds with no new models and nothing in flight (default: watch until killed)")
+    parser.add_argument("--no_repack", action="store_true", help="Feed the AlphaFold models straight to MaSIF")
+    parser.add_argument("--repack_script", type=str, default=str(DEFAULT_REPACK_SCRIPT), help="Path to 2repack_biosensor.py")
+    parser.add_argument("--repack_workers", type=int, default=2, help="Repacking processes (default: 2)")
+    parser.add_argument("-n", "--cycles", type=int, default=3, help="Repacking cycles (default: 3)")
+    parser.add_argument("--min_improvement", type=float, help="Stop repacking cycles early, see 2repack_biosensor.py")
+    parser.add_argument("--patience", type=int, default=2, help="Cycles below --min_improvement before stopping (default: 2)")
+    parser.add_argument("-m", "--mutation_csv", type=str, help="Comparison CSV from csv_to_fasta.py to restrict repacking")
+    parser.add_argument("-r", "--reference_pdb", type=str, help="Wild-type PDB to restrict repacking by sequence diff")
+    parser.add_argument("-s", "--shell", type=float, default=8.0, help="Repack shell (A) around mutated residues (default: 8.0)")
+    parser.add_argument("--masif_workers", type=int, default=default_workers(),
+                        help="Structures run through MaSIF concurrently (default: Slurm CPU allocation, else 1)")
+    parser.add_argument("--chains", type=str, default="A", help="Chain(s) to compute surfaces for (default: A)")
+    parser.add_argument("--chains_csv", type=str, help="CSV with 'structure' and 'chains' columns overriding --chains")
+    parser.add_argument("--slim", action="store_true", help="Feed MaSIF slimmed copies holding only the selected chains")
+    parser.add_argument("--use_flipped", action="store_true", help="Store p1_desc_flipped.npy instead of straight")
+    args = parser.parse_args()
+
+    af_dirs = [Path(d).resolve() for d in args.af_dir]
+    work_dir = Path(args.work_dir).resolve()
+    model_dir = work_dir / "models"
+    repacked_dir = work_dir / "repacked"
+    linked_dir = work_dir / "linked_pdbs"
+    output_dir = work_dir / "masif_output"
+    log_dir = work_dir / "logs"
+    structure_log_dir = log_dir / "structures"
+    store_dir = Path(args.store_dir).resolve() if args.store_dir else work_dir / "descriptor_store"
+    for directory in (model_dir, repacked_dir, linked_dir, output_dir, structure_log_dir):
+        os.makedirs(directory, exist_ok=True)
+    pipeline_log = log_dir / "pipeline.log"
+    status_path = log_dir / "pipeline_status.tsv"
+    mapping_path = log_dir / "pdb_mapping.txt"
+    metrics_path = log_dir / "masif_metrics.jsonl"
+    manifest_path = output_dir / "pdb_manifest.json"
+    scores_csv = log_dir / "repack_scores.csv"
+    cycles_csv = log_dir / "repack_scores.cycles.csv"
+
+    chain_table = load_chain_table(args.chains_csv) if args.chains_csv else {}
+    metadata = pd.read_csv(args.metadata_csv) if args.metadata_csv else None
+    slim_options = {"keep_hetatm": False, "keep_waters": False, "keep_hydrogens": False}
+    repack_sources = [Path(p) for p in (args.mutation_csv, args.reference_pdb) if p]
+    mapped = set()
+    if mapping_path.exists():
+        with open(mapping_path) as f:
+            mapped.update(line.strip() for line in f if line.strip())
+    stored = stored_ids(store_dir)
+
+    instance_name = f"masif_{uuid.uuid4().hex[:8]}"
+    script_path = work_dir / "preprocess_structure.sh"
+    create_structure_script(script_path)
+    binds = [(linked_dir, "/workspace/pdbs"), (output_dir, "/workspace/outputs"),
+             (script_path, "/workspace/preprocess_structure.sh")]
+    log(f"Starting Apptainer instance {instance_name}...", pipeline_log)
+    if start_instance(Path(args.sif).resolve(), binds, instance_name, pipeline_log) != 0:
+        log("[ERROR] Could not start Apptainer instance.", pipeline_log)
+        return
+
+    repack_pool = None
+    if not args.no_repack:
+        repack_module = load_repack_module(args.repack_script)
+        # spawn rather than fork: the parent already runs threads, and each worker initializes PyRosetta itself
+        repack_pool = ProcessPoolExecutor(
+            max_workers=max(1, args.repack_workers), mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_repack_worker,
+            initargs=(args.repack_script, log_dir / "repack.log", args.mutation_csv, args.reference_pdb, args.shell))
+    masif_pool = ThreadPoolExecutor(max_workers=max(1, args.masif_workers))
+    append_pool = ThreadPoolExecutor(max_workers=1)  # the store has a single writer
+
+    items = {}
+    in_flight = {}
+    warned_duplicates = set()
+    run_start = time.time()
+    first_result = None
+    last_activity = time.time()
+
+    def masif_job(item):
+        link_path = linked_dir / f"{item['structure_id']}.pdb"
+        stages = []
+        if args.slim:
+            kept = slim_structures([(link_path, item["name"], item["chains"])], slim_options, 1)
+            n_kept, slim_stage = kept[item["structure_id"]]
+            stages.append(slim_stage)
+            if n_kept == 0:
+                return None, {"structure_id": item["structure_id"], "chains": item["chains"], "status": "failed",
+                              "start": slim_stage["start"], "end": slim_stage["end"], "seconds": slim_stage["seconds"],
+                              "exit_code": None, "peak_rss_mb": None, "output_bytes": 0,
+                              "failure_reason": f"no atoms in chain(s) {item['chains']}", "stages": stages}
+        _, returncode, record = run_structure(instance_name, link_path, item["chains"], structure_log_dir, output_dir)
+        record["stages"] = stages + record["stages"]
+        return returncode, record
+
+    def append_job(item):
+        array = load_structure_descriptors(output_dir, item["structure_id"], args.use_flipped)
+        if array is None:
+            return 0
+        added = append_structures(store_dir, [(item["structure_id"], item["name"], array)])
+        if added and metadata is not None:
+            merge_metadata(store_dir, metadata)
+        return added
+
+    def finish(item, status, detail=""):
+        nonlocal first_result
+        item["status"], item["detail"], item["end"] = status, detail, time.time()
+        if status in ("appended", "cached") and first_result is None:
+            first_result = item["end"] - run_start
+            log(f"[INFO] First result after {first_result:.0f}s ({item['name']})", pipeline_log)
+        level = "INFO" if status in ("appended", "cached") else "WARN"
+        log(f"[{level}] {item['name']}: {status}{f' ({detail})' if detail else ''} "
+            f"after {item['end'] - item['start']:.0f}s", pipeline_log)
+
+    def to_append(item):
+        if stored.get(item["name"]) == item["structure_id"]:
+            finish(item, "cached")
+        elif item["name"] in stored:
+            finish(item, "stale_in_store", f"stored as {stored[item['name']]}; rebuild the store to replace it")
+        else:
+            in_flight[append_pool.submit(append_job, item)] = ("append", item)
+
+    def to_masif(item, pdb_path):
+        ((_, _, structure_id),) = assign_structure_ids([pdb_path], manifest_path)
+        item["structure_id"] = structure_id
+        mapping_line = f"{structure_id}.pdb -> {item['name']}.pdb"
+        if mapping_line not in mapped:
+            with open(mapping_path, "a") as f:
+                f.write(mapping_line + "\n")
+            mapped.add(mapping_line)
+        if descriptors_complete(output_dir, structure_id, item["chains"]):
+            to_append(item)
+            return
+        link(linked_dir / f"{structure_id}.pdb", pdb_path)
+        in_flight[masif_pool.submit(masif_job, item)] = ("masif", item)
+
+    def to_repack(item):
+        model_link = model_dir / f"{item['name']}.pdb"
+        link(model_link, item["model"])
+        if args.no_repack:
+            to_masif(item, model_link)
+            return
+        repacked = repacked_dir / f"best_packed_{item['name']}.pdb"
+        if is_fresh(repacked, [item["model"]] + repack_sources):
+            to_masif(item, repacked)
+            return
+        in_flight[repack_pool.submit(repack_job, model_link, repacked_dir, args.cycles, args.min_improvement,
+                                     args.patience)] = ("repack", item)
+
+    def stage_done(future, stage, item):
+        try:
+            result = future.result()
+        except Exception as e:
+            finish(item, f"{stage}_failed", str(e).splitlines()[0] if str(e) else type(e).__name__)
+            return
+        if stage == "repack":
+            row, cycle_log = result
+            repack_module.append_csv_row(scores_csv, row)
+            for cycle, score, seconds in cycle_log:
+                repack_module.append_csv_row(cycles_csv, {"PDB File": row["PDB File"], "Cycle": cycle,
+                                                          "Score": score, "Seconds": round(seconds, 2)})
+            log(f"[INFO] {item['name']}: repacked in {row['Seconds']:.0f}s (score {row['Best Packed Score']:.1f})", pipeline_log)
+            to_masif(item, repacked_dir / f"best_packed_{item['name']}.pdb")
+        elif stage == "masif":
+            returncode, record = result
+            record.update({"name": item["name"], "run": instance_name, "workers": args.masif_workers})
+            with open(metrics_path, "a") as metrics:
+                metrics.write(json.dumps(record) + "\n")
+            if record["status"] != "ok":
+                finish(item, "masif_failed", record["failure_reason"])
+            else:
+                log(f"[INFO] {item['name']} ({item['structure_id']}): MaSIF finished in {record['seconds']:.0f}s", pipeline_log)
+                to_append(item)
+        elif result:
+            stored[item["name"]] = item["structure_id"]
+            finish(item, "appended")
+        else:
+            finish(item, "append_failed", "descriptors could not be loaded, had no rows or were already stored")
+
+    log(f"Watching {', '.join(map(str, af_dirs))} for {args.model} "
+        f"(repack: {'off' if args.no_repack else args.repack_workers}, MaSIF: {args.masif_workers} workers)", pipeline_log)
+    try:
+        while True:
+            models, duplicates = find_models(af_dirs, args.model, args.settle)
+            for name in sorted(set(duplicates) - warned_duplicates):
+                used = items[name]["model"] if name in items else models[name]
+                ignored = [path for path in [models[name]] + duplicates[name] if path != used]
+                log(f"[WARN] {name}: several models share this name; using {used}, "
+                    f"ignoring {', '.join(map(str, ignored))}", pipeline_log)
+                warned_duplicates.add(name)
+            new = {name: path for name, path in models.items() if name not in items}
+            for name, model_path in new.items():
+                item = {"name": name, "model": model_path, "chains": chain_table.get(f"{name}.pdb", args.chains),
+                        "start": time.time(), "status": "running"}
+                items[name] = item
+                to_repack(item)
+            if new:
+                last_activity = time.time()
+                log(f"Picked up {len(new)} new models ({len(items)} total, {len(in_flight)} in flight)", pipeline_log)
+
+            if not in_flight:
+                write_status(items, status_path)
+                if args.once:
+                    break
+                if args.idle_exit is not None and time.time() - last_activity >= args.idle_exit:
+                    log(f"No new models for {args.idle_exit:.0f}s, stopping", pipeline_log)
+                    break
+                time.sleep(args.poll)
+                continue
+            # Wake up for whichever comes first: a stage finishing or the next scan
+            done, _ = concurrent.futures.wait(list(in_flight), timeout=args.poll,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                stage, item = in_flight.pop(future)
+                stage_done(future, stage, item)
+                last_activity = time.time()
+    finally:
+        for pool in (repack_pool, masif_pool, append_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        stop_instance(instance_name, pipeline_log)
+        write_status(items, status_path)
+
+    counts = {}
+    for item in items.values():
+        counts[item["status"]] = counts.get(item["status"], 0) + 1
+    log(f"Finished {len(items)} structures in {time.time() - run_start:.0f}s: "
+        + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())), pipeline_log)
+    if first_result is not None:
+        log(f"Time to first result: {first_result:.0f}s", pipeline_log)
+    log(f"Per-structure status: {status_path}", pipeline_log)
+    log(f"Descriptor store: {store_dir}", pipeline_log)
+
+if __name__ == "__main__":
+    main()
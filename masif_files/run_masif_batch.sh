@@ -3,9 +3,12 @@
 #SBATCH --job-name=masif-preprocess
 #SBATCH --partition=atesting        # Change if to amilan for full production runs, if need be add #SBATCH --qos=long if runs will be longer than 24hrs
 #SBATCH --nodes=1
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task=4         # Structures processed at once; raise to the full node (e.g. 64) on amilan
 #SBATCH --time=01:00:00		    # Change for full production run
-#SBATCH --output=/scratch/alpine/%u/masif_runs/%x_%j.out
-#SBATCH --error=/scratch/alpine/%u/masif_runs/%x_%j.err
+##SBATCH --array=0-9               # Uncomment to split the PDB directory across 10 array tasks/nodes
+#SBATCH --output=/scratch/alpine/%u/masif_runs/%x_%A_%a.out
+#SBATCH --error=/scratch/alpine/%u/masif_runs/%x_%A_%a.err
 
 # Load required modules
 module purge
@@ -38,9 +41,13 @@ echo "Log directory:    $LOG_DIR"
 echo "SIF path:         $SIF_PATH"
 
 # Run the wrapper Python script
+# Add --stage_local to run the container on node-local $TMPDIR and keep one <id>.zip per structure in $OUT_DIR
 python3 /projects/liwh2139/masif/run_masif_sif_v2.py \
   --pdb_dir "$PDB_DIR" \
   --output_dir "$OUT_DIR" \
   --log_dir "$LOG_DIR" \
-  --sif "$SIF_PATH"
+  --sif "$SIF_PATH" \
+  --workers "${SLURM_CPUS_PER_TASK:-1}"
 
+# Array jobs write pdb_mapping.shardNNN.txt fragments; once every task has finished combine them with:
+#   python3 /projects/liwh2139/masif/run_masif_sif_v2.py --merge --log_dir "$LOG_DIR"
@@ -1,8 +1,32 @@
 import os
+import csv
+import json
+import fcntl
+import time
+import shutil
+import statistics
+import zipfile
+import hashlib
 import argparse
 import subprocess
+import uuid
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# MaSIF wants PDB-like codes: a leading digit 1-9 followed by three [0-9A-Z] characters
+ID_FIRST_CHARS = "123456789"
+ID_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+ID_SLOTS = len(ID_FIRST_CHARS) * len(ID_CHARS) ** 3
+
+# Folders preprocess_pdb.sh writes for each stage, in pipeline order. The container script is not
+# instrumented, so each stage's end time is taken from the newest file it wrote.
+MASIF_STAGES = [
+    ("protonate", ("data_preparation/00-raw_pdbs", "data_preparation/01-benchmark_pdbs")),
+    ("surface", ("data_preparation/01-benchmark_surfaces",)),
+    ("precompute", ("data_preparation/04a-precomputation_*",)),
+    ("descriptors", ("descriptors",)),
+]
 
 def log(message, logfile):
     timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
@@ -11,81 +35,613 @@ def log(message, logfile):
     with open(logfile, "a") as f:
         f.write(full_msg + "\n")
 
-def create_symlinked_pdb_dir(original_dir, log_dir):
+def timestamp(seconds):
+    return datetime.fromtimestamp(seconds).isoformat(timespec="seconds")
+
+def stage_record(stage, start, end):
+    return {"stage": stage, "start": timestamp(start), "end": timestamp(end), "seconds": round(max(end - start, 0.0), 2)}
+
+def default_workers():
+    """Number of workers to use, taken from the Slurm CPU allocation when available."""
+    for var in ("SLURM_CPUS_PER_TASK", "SLURM_CPUS_ON_NODE"):
+        value = os.environ.get(var, "")
+        if value.isdigit() and int(value) > 0:
+            return int(value)
+    return 1
+
+def default_shard():
+    """Shard index and count taken from a Slurm job array, or (0, 1) outside of one."""
+    task_id = os.environ.get("SLURM_ARRAY_TASK_ID", "")
+    task_count = os.environ.get("SLURM_ARRAY_TASK_COUNT", "")
+    if not (task_id.isdigit() and task_count.isdigit()):
+        return 0, 1
+    task_min = os.environ.get("SLURM_ARRAY_TASK_MIN", "0")
+    return int(task_id) - int(task_min if task_min.isdigit() else 0), int(task_count)
+
+def shard_suffix(shard_index, shard_count):
+    """File name suffix for per-shard fragments; empty when the run is not sharded."""
+    return "" if shard_count == 1 else f".shard{shard_index:03d}"
+
+def hash_file(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def slot_to_id(slot):
+    slot, c3 = divmod(slot, len(ID_CHARS))
+    slot, c2 = divmod(slot, len(ID_CHARS))
+    c0, c1 = divmod(slot, len(ID_CHARS))
+    return ID_FIRST_CHARS[c0] + ID_CHARS[c1] + ID_CHARS[c2] + ID_CHARS[c3]
+
+def id_from_hash(digest, taken):
+    """Derive a 4-character ID from a content hash, probing past IDs already in use."""
+    slot = int(digest, 16) % ID_SLOTS
+    for _ in range(ID_SLOTS):
+        structure_id = slot_to_id(slot)
+        if structure_id not in taken:
+            return structure_id
+        slot = (slot + 1) % ID_SLOTS
+    raise RuntimeError("No free structure IDs left in the manifest.")
+
+def assign_structure_ids(pdb_files, manifest_path):
+    """
+    Look up or assign a stable ID for every PDB using the persistent manifest.
+    The manifest maps content hash -> ID, so adding files never renumbers existing structures.
+    It is updated under a file lock so concurrent shards agree on new IDs.
+    Returns a list of (pdb_file, digest, structure_id) in the order given.
+    """
+    with open(f"{manifest_path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = {"structures": {}}
+        if manifest_path.exists():
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        structures = manifest["structures"]
+        taken = {entry["id"] for entry in structures.values()}
+
+        assignments = []
+        for pdb_file in pdb_files:
+            digest = hash_file(pdb_file)
+            entry = structures.get(digest)
+            if entry is None:
+                entry = {"id": id_from_hash(digest, taken), "names": []}
+                structures[digest] = entry
+                taken.add(entry["id"])
+            if pdb_file.name not in entry["names"]:
+                entry["names"].append(pdb_file.name)
+            assignments.append((pdb_file, digest, entry["id"]))
+
+        tmp_path = manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, manifest_path)
+    return assignments
+
+def load_chain_table(chains_csv):
+    """
+    {file name: chains} from a CSV with 'structure' and 'chains' columns.
+    The structure column may be given with or without the .pdb extension.
+    """
+    table = {}
+    with open(chains_csv, newline="") as f:
+        for row in csv.DictReader(f):
+            name = row["structure"].strip()
+            table[name if name.endswith(".pdb") else f"{name}.pdb"] = row["chains"].strip()
+    return table
+
+def descriptors_complete(output_dir, structure_id, chains="A"):
+    """True when MaSIF has already written both descriptor files for this structure (as files or in its archive)."""
+    desc_dir = f"descriptors/sc05/all_feat/{structure_id}_{chains}"
+    members = [f"{desc_dir}/{name}" for name in ("p1_desc_straight.npy", "p1_desc_flipped.npy")]
+    if all((output_dir / structure_id / member).exists() for member in members):
+        return True
+    archive_path = output_dir / f"{structure_id}.zip"
+    if not archive_path.exists():
+        return False
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            return all(member in archive.NameToInfo for member in members)
+    except zipfile.BadZipFile:
+        return False
+
+def archive_structure_output(structure_output_dir, archive_path):
+    """
+    Pack one structure's MaSIF output tree into a single uncompressed zip, written atomically,
+    so the shared filesystem sees one file per structure instead of hundreds of small ones.
+    """
+    tmp_path = archive_path.with_suffix(".zip.tmp")
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED) as archive:
+        for path in sorted(structure_output_dir.rglob("*")):
+            if path.is_file():
+                archive.write(path, path.relative_to(structure_output_dir).as_posix())
+    os.replace(tmp_path, archive_path)
+
+def stage_inputs(pdb_files, stage_dir):
+    """Copy the inputs about to be processed to node-local storage; returns the staged pdb directory."""
+    staged_pdb_dir = stage_dir / "pdbs"
+    os.makedirs(staged_pdb_dir, exist_ok=True)
+    os.makedirs(stage_dir / "outputs", exist_ok=True)
+    for link_path, _, _ in pdb_files:
+        shutil.copyfile(link_path, staged_pdb_dir / link_path.name)
+    return staged_pdb_dir
+
+def create_symlinked_pdb_dir(original_dir, log_dir, assignments, shard_index=0, shard_count=1):
+    """
+    Symlink this shard's slice of the sorted PDB list into linked_pdbs/ under its content-derived ID.
+    Returns the linked directory and a list of (link_path, original_name) for the slice.
+    """
     linked_dir = original_dir.parent / "linked_pdbs"
     os.makedirs(linked_dir, exist_ok=True)
-    mapping_file = log_dir / "pdb_mapping.txt"
+    mapping_file = log_dir / f"pdb_mapping{shard_suffix(shard_index, shard_count)}.txt"
+
+    # Shard over unique IDs so files with identical contents always land in the same shard
+    shard_of = {}
+    for _, _, structure_id in assignments:
+        shard_of.setdefault(structure_id, len(shard_of) % shard_count)
 
+    linked_files = []
     with open(mapping_file, "w") as f:
-        for idx, pdb_file in enumerate(sorted(original_dir.glob("*.pdb"))):
-            new_name = f"{idx+1:04d}.pdb"
+        for pdb_file, _, structure_id in assignments:
+            if shard_of[structure_id] != shard_index:
+                continue
+            new_name = f"{structure_id}.pdb"
             link_path = linked_dir / new_name
-            if link_path.exists():
+            if link_path.is_symlink() or link_path.exists():
                 link_path.unlink()
             link_path.symlink_to(pdb_file.resolve())
             f.write(f"{new_name} -> {pdb_file.name}\n")
+            linked_files.append((link_path, pdb_file.name))
+
+    return linked_dir, linked_files
+
+def slim_structures(structures, options, workers):
+    """
+    Replace the symlinks of structures about to be processed with slimmed copies holding only their chains.
+    structures is a list of (link_path, original_name, chains); returns {structure_id: (atom records kept, stage record)}.
+    """
+    from pdb_slim import slim_pdb  # needs numpy, so only imported when --slim is used
+
+    def slim_one(structure):
+        link_path, _, chains = structure
+        source = link_path.resolve()
+        tmp_path = link_path.with_suffix(".pdb.tmp")
+        _, n_kept = slim_pdb(source, tmp_path, chains, **options)
+        link_path.unlink()
+        os.replace(tmp_path, link_path)
+        return link_path.stem, n_kept
+
+    def slim_one_timed(structure):
+        start = time.time()
+        structure_id, n_kept = slim_one(structure)
+        return structure_id, (n_kept, stage_record("slim", start, time.time()))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(slim_one_timed, structures))
+
+def merge_shards(log_dir):
+    """Combine per-shard mapping and status fragments into pdb_mapping.txt and masif_status.tsv."""
+    merged = {}
+    for name, pattern in (("pdb_mapping.txt", "pdb_mapping.shard*.txt"),
+                          ("masif_status.tsv", "masif_status.shard*.tsv")):
+        lines = set()
+        fragments = sorted(log_dir.glob(pattern))
+        for fragment in fragments:
+            with open(fragment) as f:
+                lines.update(line.rstrip("\n") for line in f if line.strip())
+        if fragments:
+            with open(log_dir / name, "w") as f:
+                for line in sorted(lines):
+                    f.write(line + "\n")
+        merged[name] = (len(fragments), len(lines))
+    return merged
+
+def load_metrics(log_dir):
+    """Latest metrics record per structure from every masif_metrics*.jsonl in log_dir (all shards and runs)."""
+    latest = {}
+    for metrics_path in sorted(log_dir.glob("masif_metrics*.jsonl")):
+        with open(metrics_path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if record["structure_id"] not in latest or record["end"] >= latest[record["structure_id"]]["end"]:
+                        latest[record["structure_id"]] = record
+    return latest
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+def summarize_metrics(log_dir, top=10):
+    """Print throughput, per-stage timings, the slowest structures and failures; write masif_metrics.csv."""
+    records = load_metrics(log_dir)
+    if not records:
+        print(f"[INFO] No masif_metrics*.jsonl records in {log_dir}")
+        return
+    ok = [r for r in records.values() if r["status"] == "ok"]
+    failed = [r for r in records.values() if r["status"] != "ok"]
+    print(f"Structures: {len(records)} ({len(ok)} ok, {len(failed)} failed)")
+
+    # Throughput per run (wall clock from first start to last end), so idle time between runs is not counted
+    runs = {}
+    for r in records.values():
+        runs.setdefault((r.get("run"), r.get("shard")), []).append(r)
+    wall = sum((datetime.fromisoformat(max(r["end"] for r in group)) -
+                datetime.fromisoformat(min(r["start"] for r in group))).total_seconds() for group in runs.values())
+    if wall > 0:
+        print(f"Throughput: {len(records) / wall * 3600:.1f} structures/hour over {len(runs)} run(s) ({wall / 60:.1f} min wall)")
+
+    seconds = [r["seconds"] for r in ok] or [r["seconds"] for r in records.values()]
+    print(f"Seconds per structure: mean {statistics.mean(seconds):.0f}, median {statistics.median(seconds):.0f}, "
+          f"p95 {percentile(seconds, 95):.0f}, max {max(seconds):.0f}")
+    print(f"Per worker: {3600 / statistics.mean(seconds):.1f} structures/hour; a Slurm job of N structures on W workers "
+          f"needs about N / W x {percentile(seconds, 95):.0f}s (p95) plus container startup")
+    rss = [r["peak_rss_mb"] for r in records.values() if r.get("peak_rss_mb") is not None]
+    if rss:
+        print(f"Peak RSS per structure: median {statistics.median(rss):.0f} MB, max {max(rss):.0f} MB")
+
+    stage_seconds = {}
+    for r in ok:
+        for stage in r["stages"]:
+            stage_seconds.setdefault(stage["stage"], []).append(stage["seconds"])
+    if stage_seconds:
+        total = sum(sum(v) for v in stage_seconds.values()) or 1.0
+        print("Stages (mean seconds, share of stage time):")
+        for stage, values in stage_seconds.items():
+            print(f"  {stage:<12} {statistics.mean(values):8.1f}  {100 * sum(values) / total:5.1f}%")
+
+    print(f"Slowest {min(top, len(records))}:")
+    for r in sorted(records.values(), key=lambda r: r["seconds"], reverse=True)[:top]:
+        print(f"  {r['structure_id']}  {r.get('name', '')}  {r['seconds']:.0f}s  {r['status']}")
+    if failed:
+        print("Failures:")
+        for r in sorted(failed, key=lambda r: r["structure_id"]):
+            print(f"  {r['structure_id']}  {r.get('name', '')}  {r['failure_reason']}")
 
-    return linked_dir
+    stage_names = list(stage_seconds) or [stage for stage, _ in MASIF_STAGES]
+    columns = ["structure_id", "name", "chains", "status", "start", "end", "seconds", "exit_code",
+               "peak_rss_mb", "output_bytes", "failure_reason", "run", "shard"]
+    csv_path = log_dir / "masif_metrics.csv"
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns + [f"{stage}_seconds" for stage in stage_names])
+        for structure_id in sorted(records):
+            r = records[structure_id]
+            by_stage = {stage["stage"]: stage["seconds"] for stage in r["stages"]}
+            writer.writerow([r.get(c, "") for c in columns] + [by_stage.get(stage, "") for stage in stage_names])
+    print(f"Per-structure metrics table: {csv_path}")
 
-def create_batch_script(script_path):
+def create_structure_script(script_path):
+    """Write the in-container script that preprocesses a single structure."""
     with open(script_path, "w") as f:
         f.write("#!/bin/bash\n\n")
-        f.write("INPUT_DIR=/workspace/pdbs\n")
         f.write("OUTPUT_DIR=/workspace/outputs\n\n")
+        f.write("pdb_file=\"$1\"\n")
+        f.write("chains=\"${2:-A}\"\n")
+        f.write("filename=$(basename \"$pdb_file\")\n")
+        f.write("pdbid=\"${filename%.pdb}\"\n")
         f.write("mkdir -p \"$OUTPUT_DIR\"\n")
         f.write("cd /opt/masif\n")
-        f.write("for pdb_file in \"$INPUT_DIR\"/*.pdb; do\n")
-        f.write("    filename=$(basename \"$pdb_file\")\n")
-        f.write("    pdbid=\"${filename%.pdb}\"\n")
-        f.write("    echo \"[INFO] Processing $pdbid...\"\n")
-        f.write("    ./preprocess_pdb.sh \"$pdb_file\" \"${pdbid}_A\" -o \"$OUTPUT_DIR/$pdbid\"\n")
-        f.write("done\n")
+        f.write("echo \"[INFO] Processing $pdbid...\"\n")
+        f.write("./preprocess_pdb.sh \"$pdb_file\" \"${pdbid}_${chains}\" -o \"$OUTPUT_DIR/$pdbid\"\n")
     os.chmod(script_path, 0o755)
 
+def start_instance(sif_path, binds, instance_name, logfile):
+    """Start a persistent container instance so each structure does not pay the startup cost."""
+    cmd = ["singularity", "instance", "start"]
+    for host_path, container_path in binds:
+        cmd += ["--bind", f"{host_path}:{container_path}"]
+    cmd += [str(sif_path), instance_name]
+    with open(logfile, "a") as log_file:
+        return subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT).returncode
+
+def stop_instance(instance_name, logfile):
+    with open(logfile, "a") as log_file:
+        subprocess.run(["singularity", "instance", "stop", instance_name],
+                       stdout=log_file, stderr=subprocess.STDOUT)
+
+def inspect_output(structure_output_dir, start):
+    """
+    Stage records inferred from the output tree, its total size in bytes, and the last stage that wrote anything.
+    Each stage is taken to run from the end of the previous one to the newest file in its folders.
+    """
+    output_bytes = sum(path.stat().st_size for path in structure_output_dir.rglob("*") if path.is_file())
+    stages, previous, reached = [], start, None
+    for stage, patterns in MASIF_STAGES:
+        mtimes = [path.stat().st_mtime for pattern in patterns for folder in structure_output_dir.glob(pattern)
+                  for path in folder.rglob("*") if path.is_file()]
+        if not mtimes:
+            break
+        end = max(max(mtimes), previous)
+        stages.append(stage_record(stage, previous, end))
+        previous, reached = end, stage
+    return stages, output_bytes, reached
+
+def last_error_line(stderr_path, tail_bytes=4096):
+    with open(stderr_path, "rb") as f:
+        f.seek(max(0, os.path.getsize(stderr_path) - tail_bytes))
+        lines = [line.strip() for line in f.read().decode(errors="replace").splitlines() if line.strip()]
+    return lines[-1] if lines else ""
+
+def failure_reason(returncode, complete, reached, stderr_path):
+    """Short description of why a structure produced no descriptors, or None if it succeeded."""
+    if returncode == 0 and complete:
+        return None
+    detail = last_error_line(stderr_path)
+    if returncode == 0:
+        reason = f"exit status 0 but no descriptors written (last stage with output: {reached or 'none'})"
+    else:
+        names = [stage for stage, _ in MASIF_STAGES]
+        failed_stage = names[names.index(reached) + 1] if reached in names[:-1] else (reached or names[0])
+        reason = f"exit status {returncode} in {failed_stage}"
+    return reason + (f": {detail}" if detail else "")
+
+def run_structure(instance_name, pdb_file, chains, structure_log_dir, output_root):
+    """
+    Preprocess the given chains of one structure inside the running instance, keeping its output separate.
+    Returns (pdbid, exit status, metrics record) where the record holds timestamps, peak RSS (largest
+    process in the exec tree, from wait4), output size, per-stage timings and a failure reason.
+    """
+    pdbid = pdb_file.stem
+    stdout_path = structure_log_dir / f"{pdbid}.out"
+    stderr_path = structure_log_dir / f"{pdbid}.err"
+    start = time.time()
+    with open(stdout_path, "w") as out, open(stderr_path, "w") as err:
+        process = subprocess.Popen([
+            "singularity", "exec", f"instance://{instance_name}",
+            "bash", "/workspace/preprocess_structure.sh", f"/workspace/pdbs/{pdb_file.name}", chains
+        ], stdout=out, stderr=err)
+        _, wait_status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(wait_status)
+    end = time.time()
+
+    structure_output_dir = output_root / pdbid
+    stages, output_bytes, reached = inspect_output(structure_output_dir, start) if structure_output_dir.is_dir() else ([], 0, None)
+    complete = descriptors_complete(output_root, pdbid, chains)
+    reason = failure_reason(process.returncode, complete, reached, stderr_path)
+    record = {
+        "structure_id": pdbid, "chains": chains, "status": "ok" if reason is None else "failed",
+        "start": timestamp(start), "end": timestamp(end), "seconds": round(end - start, 2),
+        "exit_code": process.returncode, "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "output_bytes": output_bytes, "failure_reason": reason, "stages": stages,
+    }
+    return pdbid, process.returncode, record
+
+def run_pool(instance_name, pdb_files, structure_log_dir, workers, launcher_log, output_root,
+             metrics_path, metrics_extra, finish=None):
+    """
+    Run (pdb_file, chains) pairs through the instance N at a time and return {pdbid: exit status}.
+    finish(pdbid, ok), if given, runs in the worker thread right after each structure completes, with ok
+    telling whether MaSIF produced complete descriptors.
+    One metrics record per structure (merged with metrics_extra[pdbid]) is appended to metrics_path as it finishes.
+    An exception while running or finishing one structure is logged and recorded as status "error" for
+    that structure only, so the rest of the run and its status file are unaffected.
+    """
+    def run_one(pdb_file, chains):
+        pdbid, returncode, record = run_structure(instance_name, pdb_file, chains, structure_log_dir, output_root)
+        if finish is not None:
+            start = time.time()
+            finish(pdbid, record["status"] == "ok")
+            record["stages"].append(stage_record("archive", start, time.time()))
+        return pdbid, returncode, record
+
+    statuses = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor, open(metrics_path, "a") as metrics:
+        futures = {executor.submit(run_one, pdb_file, chains): (pdb_file, chains) for pdb_file, chains in pdb_files}
+        for future in as_completed(futures):
+            try:
+                pdbid, returncode, record = future.result()
+                # MaSIF can exit 0 without producing descriptors, which would otherwise look like a success
+                statuses[pdbid] = "no_descriptors" if returncode == 0 and record["status"] != "ok" else returncode
+            except Exception as e:
+                pdb_file, chains = futures[future]
+                pdbid, returncode, now = pdb_file.stem, "error", timestamp(time.time())
+                record = {"structure_id": pdbid, "chains": chains, "status": "failed", "start": now, "end": now,
+                          "seconds": 0.0, "exit_code": None, "peak_rss_mb": None, "output_bytes": 0,
+                          "failure_reason": f"launcher error: {type(e).__name__}: {e}", "stages": []}
+                statuses[pdbid] = returncode
+            extra = dict(metrics_extra.get(pdbid, {}))
+            record["stages"] = extra.pop("stages", []) + record["stages"]
+            metrics.write(json.dumps({**extra, **record}) + "\n")
+            metrics.flush()
+            level = "INFO" if record["status"] == "ok" else "WARN"
+            detail = f" ({record['failure_reason']})" if record["failure_reason"] else ""
+            log(f"[{level}] {pdbid} finished with exit status {returncode} in {record['seconds']:.0f}s{detail} "
+                f"({len(statuses)}/{len(pdb_files)})", launcher_log)
+    return statuses
+
+def write_status_file(statuses, status_path):
+    with open(status_path, "w") as f:
+        for pdbid in sorted(statuses):
+            f.write(f"{pdbid}\t{statuses[pdbid]}\n")
+
 def main():
     parser = argparse.ArgumentParser(description="Run MaSIF-NeoSurf preprocessing using an Apptainer .sif container.")
-    parser.add_argument("--pdb_dir", type=str, required=True, help="Directory with PDB files")
+    parser.add_argument("--pdb_dir", type=str, help="Directory with PDB files")
     parser.add_argument("--output_dir", type=str, default="masif_output", help="Output directory")
     parser.add_argument("--log_dir", type=str, default="logs", help="Log directory")
     parser.add_argument("--sif", type=str, default="/projects/liwh2139/masif/masif-neosurf.sif", help="Path to .sif image")
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="Structures to process concurrently (default: Slurm CPU allocation, else 1)")
+    shard_index, shard_count = default_shard()
+    parser.add_argument("--shard_index", type=int, default=shard_index,
+                        help="Slice of the sorted PDB list to process (default: SLURM_ARRAY_TASK_ID)")
+    parser.add_argument("--shard_count", type=int, default=shard_count,
+                        help="Total number of shards (default: SLURM_ARRAY_TASK_COUNT, else 1)")
+    parser.add_argument("--force", action="store_true",
+                        help="Reprocess structures even if their descriptors already exist")
+    parser.add_argument("--chains", type=str, default="A",
+                        help="Chain(s) to compute surfaces for, e.g. A or AB (default: A)")
+    parser.add_argument("--chains_csv", type=str,
+                        help="CSV with 'structure' and 'chains' columns overriding --chains per input file")
+    parser.add_argument("--slim", action="store_true",
+                        help="Feed MaSIF slimmed copies holding only the selected chains, without waters, hydrogens or HETATMs")
+    parser.add_argument("--keep_hetatm", action="store_true", help="With --slim, keep HETATM records (ligands, ions)")
+    parser.add_argument("--keep_waters", action="store_true", help="With --slim, keep water molecules")
+    parser.add_argument("--keep_hydrogens", action="store_true", help="With --slim, keep hydrogen atoms")
+    parser.add_argument("--stage_local", action="store_true",
+                        help="Run the container on node-local storage and store each structure's output as <output_dir>/<id>.zip")
+    parser.add_argument("--stage_dir", type=str, default=os.environ.get("TMPDIR", "/tmp"),
+                        help="Node-local directory used by --stage_local (default: $TMPDIR, else /tmp)")
+    parser.add_argument("--merge", action="store_true",
+                        help="Merge per-shard mapping/status fragments in --log_dir and exit")
+    parser.add_argument("--summary", action="store_true",
+                        help="Summarize the per-structure metrics in --log_dir (throughput, slowest, failures) and exit")
+    parser.add_argument("--top", type=int, default=10, help="Slowest structures listed by --summary (default: 10)")
     args = parser.parse_args()
 
+    log_dir = Path(args.log_dir).resolve()
+    if args.merge:
+        for name, (n_fragments, n_lines) in merge_shards(log_dir).items():
+            print(f"[INFO] Merged {n_fragments} fragments into {log_dir / name} ({n_lines} entries)")
+        return
+    if args.summary:
+        summarize_metrics(log_dir, args.top)
+        return
+
+    if not args.pdb_dir:
+        parser.error("--pdb_dir is required unless --merge or --summary is given")
+    if args.shard_count < 1 or not 0 <= args.shard_index < args.shard_count:
+        parser.error(f"--shard_index must be in [0, {args.shard_count})")
+
     pdb_dir = Path(args.pdb_dir).resolve()
     output_dir = Path(args.output_dir).resolve()
-    log_dir = Path(args.log_dir).resolve()
     sif_path = Path(args.sif).resolve()
-    script_path = pdb_dir.parent / "batch_preprocess.sh"
-    launcher_log = log_dir / "masif_launcher.log"
-    run_log = log_dir / "masif_run.log"
+    suffix = shard_suffix(args.shard_index, args.shard_count)
+    script_path = pdb_dir.parent / f"preprocess_structure{suffix}.sh"
+    launcher_log = log_dir / f"masif_launcher{suffix}.log"
+    structure_log_dir = log_dir / "structures"
+    status_path = log_dir / f"masif_status{suffix}.tsv"
+    metrics_path = log_dir / f"masif_metrics{suffix}.jsonl"
 
     os.makedirs(output_dir, exist_ok=True)
     os.makedirs(log_dir, exist_ok=True)
+    os.makedirs(structure_log_dir, exist_ok=True)
 
     if not pdb_dir.exists():
         log(f"[ERROR] PDB directory not found: {pdb_dir}", launcher_log)
         return
 
+    workers = max(1, args.workers)
+    chain_table = load_chain_table(args.chains_csv) if args.chains_csv else {}
+
+    if args.shard_count > 1:
+        log(f"Processing shard {args.shard_index + 1}/{args.shard_count}", launcher_log)
+
+    manifest_path = output_dir / "pdb_manifest.json"
+    log(f"Hashing inputs against manifest {manifest_path}...", launcher_log)
+    assignments = assign_structure_ids(sorted(pdb_dir.glob("*.pdb")), manifest_path)
+
     log("Creating symlinked PDB directory...", launcher_log)
-    linked_pdb_dir = create_symlinked_pdb_dir(pdb_dir, log_dir)
-
-    log("Creating batch preprocessing script...", launcher_log)
-    create_batch_script(script_path)
-
-    log("Running Apptainer container...", launcher_log)
-    with open(run_log, "w") as log_file:
-        subprocess.run([
-            "singularity", "exec",
-            "--bind", f"{linked_pdb_dir}:/workspace/pdbs",
-            "--bind", f"{output_dir}:/workspace/outputs",
-            "--bind", f"{script_path}:/workspace/batch_preprocess.sh",
-            str(sif_path),
-            "bash", "/workspace/batch_preprocess.sh"
-        ], stdout=log_file, stderr=subprocess.STDOUT)
+    linked_pdb_dir, linked_files = create_symlinked_pdb_dir(
+        pdb_dir, log_dir, assignments, args.shard_index, args.shard_count)
+
+    pdb_files = []
+    statuses = {}
+    seen = set()
+    for link_path, original_name in linked_files:
+        structure_id = link_path.stem
+        if structure_id in seen:
+            log(f"[INFO] {original_name} has the same contents as an earlier file ({structure_id}), not rerunning", launcher_log)
+            continue
+        seen.add(structure_id)
+        chains = chain_table.get(original_name, args.chains)
+        if not args.force and descriptors_complete(output_dir, structure_id, chains):
+            statuses[structure_id] = "cached"
+        else:
+            pdb_files.append((link_path, original_name, chains))
+    if statuses:
+        log(f"Skipping {len(statuses)} structures with existing descriptors (use --force to rerun)", launcher_log)
+    if not pdb_files:
+        write_status_file(statuses, status_path)
+        log("Nothing to process.", launcher_log)
+        return
+
+    instance_name = f"masif_{uuid.uuid4().hex[:8]}"
+    metrics_extra = {link_path.stem: {"name": original_name, "run": instance_name, "shard": args.shard_index,
+                                      "workers": workers, "stages": []}
+                     for link_path, original_name, _ in pdb_files}
+
+    if args.slim:
+        log(f"Slimming {len(pdb_files)} inputs to their selected chains...", launcher_log)
+        options = {"keep_hetatm": args.keep_hetatm, "keep_waters": args.keep_waters,
+                   "keep_hydrogens": args.keep_hydrogens}
+        kept = slim_structures(pdb_files, options, workers)
+        with open(metrics_path, "a") as metrics:
+            for link_path, original_name, chains in pdb_files:
+                n_kept, slim_stage = kept[link_path.stem]
+                metrics_extra[link_path.stem]["stages"].append(slim_stage)
+                if n_kept == 0:
+                    log(f"[WARN] {original_name} has no atoms in chain(s) {chains}, skipping", launcher_log)
+                    statuses[link_path.stem] = "no_atoms"
+                    metrics.write(json.dumps({
+                        **metrics_extra[link_path.stem], "structure_id": link_path.stem, "chains": chains,
+                        "status": "failed", "start": slim_stage["start"], "end": slim_stage["end"],
+                        "seconds": slim_stage["seconds"], "exit_code": None, "peak_rss_mb": None, "output_bytes": 0,
+                        "failure_reason": f"no atoms in chain(s) {chains}"}) + "\n")
+        pdb_files = [entry for entry in pdb_files if kept[entry[0].stem][0] > 0]
+        if not pdb_files:
+            write_status_file(statuses, status_path)
+            log("Nothing to process.", launcher_log)
+            return
+
+    finish = None
+    stage_dir = None
+    if args.stage_local:
+        # Inputs, outputs and the script live on node-local disk; only one archive per structure goes back to scratch
+        stage_dir = Path(args.stage_dir).resolve() / instance_name
+        log(f"Staging {len(pdb_files)} inputs to {stage_dir}...", launcher_log)
+        linked_pdb_dir = stage_inputs(pdb_files, stage_dir)
+        script_path = stage_dir / "preprocess_structure.sh"
+
+        def finish(pdbid, ok):
+            # Only complete outputs are archived; partial ones would later pass for cached descriptors
+            structure_output_dir = stage_dir / "outputs" / pdbid
+            if structure_output_dir.is_dir():
+                if ok:
+                    archive_structure_output(structure_output_dir, output_dir / f"{pdbid}.zip")
+                shutil.rmtree(structure_output_dir, ignore_errors=True)
+
+    log("Creating preprocessing script...", launcher_log)
+    create_structure_script(script_path)
+
+    log(f"Starting Apptainer instance {instance_name}...", launcher_log)
+    binds = [
+        (linked_pdb_dir, "/workspace/pdbs"),
+        (stage_dir / "outputs" if stage_dir else output_dir, "/workspace/outputs"),
+        (script_path, "/workspace/preprocess_structure.sh"),
+    ]
+    if start_instance(sif_path, binds, instance_name, launcher_log) != 0:
+        log("[ERROR] Could not start Apptainer instance.", launcher_log)
+        if stage_dir:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+        return
+
+    try:
+        log(f"Running {len(pdb_files)} structures with {workers} workers...", launcher_log)
+        statuses.update(run_pool(instance_name, [(link_path, chains) for link_path, _, chains in pdb_files],
+                                 structure_log_dir, workers, launcher_log,
+                                 stage_dir / "outputs" if stage_dir else output_dir,
+                                 metrics_path, metrics_extra, finish))
+    finally:
+        stop_instance(instance_name, launcher_log)
+        if stage_dir:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+
+    write_status_file(statuses, status_path)
+    failed = sorted(pdbid for pdbid, code in statuses.items() if code not in (0, "cached"))
+    if failed:
+        log(f"[WARN] {len(failed)} structures failed: {', '.join(failed)}", launcher_log)
 
     log("Finished processing.", launcher_log)
     log(f"Launcher log: {launcher_log}", launcher_log)
-    log(f"Run log: {run_log}", launcher_log)
+    log(f"Per-structure logs: {structure_log_dir}", launcher_log)
+    log(f"Exit statuses: {status_path}", launcher_log)
+    log(f"Per-structure metrics: {metrics_path} (summarize with --summary --log_dir {log_dir})", launcher_log)
+    if args.shard_count > 1:
+        log(f"Run with --merge --log_dir {log_dir} once all shards finish to build pdb_mapping.txt", launcher_log)
 
 if __name__ == "__main__":
     main()
-
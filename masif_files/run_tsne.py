@@ -1,44 +1,254 @@
+import os
+import json
+import pickle
+import hashlib
+import itertools
+import numpy as np
 import pandas as pd
+from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
+from sklearn.neighbors import NearestNeighbors
 import matplotlib.pyplot as plt
 import seaborn as sns
 import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from descriptor_store import open_store, structure_matrix, parse_pooling, pooled_matrix
+
+try:
+    from openTSNE import TSNE as OpenTSNE
+except ImportError:
+    OpenTSNE = None
+
+def load_features(input_csv=None, store=None, pooling=None):
+    """Return (float32 feature matrix, structure names) from a descriptor CSV or store."""
+    if store:
+        # Rows come straight from the memory-mapped float32 store, pooled or padded like the CSV layout
+        matrix, index = open_store(store)
+        if pooling:
+            features = pooled_matrix(matrix, index, parse_pooling(pooling))
+        else:
+            features = structure_matrix(matrix, index)
+        return features, index['structure']
+
+    # Load input descriptor data
+    df = pd.read_csv(input_csv)
+    if 'structure' not in df.columns:
+        raise ValueError("Input CSV must have a 'structure' column.")
+    if 'vertex' in df.columns:
+        raise ValueError("Input CSV has one row per surface patch (--layout patch); t-SNE needs one row per "
+                         "structure. Use a flat or pooled CSV, or a descriptor store with -s.")
+
+    # Split features and fill missing values
+    features = df.drop(columns=['structure']).fillna(0)
+    return features.to_numpy(dtype=np.float32), df['structure']
+
+def match_width(features, width):
+    """Zero-pad or truncate rows to the feature width a saved model was fitted on."""
+    if features.shape[1] == width:
+        return features
+    print(f"[WARN] Input has {features.shape[1]} features, model expects {width}; padding/truncating.")
+    out = np.zeros((len(features), width), dtype=np.float32)
+    n = min(width, features.shape[1])
+    out[:, :n] = features[:, :n]
+    return out
+
+def fit_embedding(features, perplexity, n_iter, engine='sklearn', method='barnes_hut', pca_components=None, n_jobs=-1):
+    """
+    Fit a 2-D t-SNE embedding. Returns (coords, model) where model holds what is needed
+    to place new structures into the same map later. n_jobs is the thread count of the openTSNE engine.
+    """
+    pca = None
+    if pca_components and pca_components < features.shape[1]:
+        # Randomized SVD keeps the pre-reduction cheap for wide flattened/pooled descriptors
+        pca = PCA(n_components=min(pca_components, len(features)), svd_solver='randomized', random_state=42)
+        features = pca.fit_transform(features).astype(np.float32)
+        print(f"[INFO] PCA kept {pca.explained_variance_ratio_.sum():.1%} of the variance in {pca.n_components_} components")
+
+    embedding = None
+    if engine == 'opentsne':
+        if OpenTSNE is None:
+            raise ImportError("--engine opentsne needs the openTSNE package (pip install openTSNE).")
+        # FFT-accelerated gradients and approximate neighbours scale to hundreds of thousands of rows
+        embedding = OpenTSNE(n_components=2, perplexity=perplexity, n_iter=n_iter, neighbors='auto',
+                             negative_gradient_method='fft', n_jobs=n_jobs, random_state=42).fit(features)
+        coords = np.asarray(embedding)
+    else:
+        tsne = TSNE(n_components=2, perplexity=perplexity, n_iter=n_iter, method=method, random_state=42)
+        coords = tsne.fit_transform(features)
+
+    model = {'pca': pca, 'features': features, 'coords': coords, 'embedding': embedding}
+    return coords, model
+
+def place_new(model, features, n_neighbors=10):
+    """
+    Place new structures into a saved embedding without refitting it.
+    openTSNE models optimise the new points against the fixed map; otherwise each point is put at
+    the distance-weighted mean of its nearest training points.
+    """
+    if model['pca'] is not None:
+        features = model['pca'].transform(match_width(features, model['pca'].n_features_in_)).astype(np.float32)
+    else:
+        features = match_width(features, model['features'].shape[1])
+
+    if model['embedding'] is not None:
+        return np.asarray(model['embedding'].transform(features))
+
+    nn = NearestNeighbors(n_neighbors=min(n_neighbors, len(model['features']))).fit(model['features'])
+    distances, neighbors = nn.kneighbors(features)
+    weights = 1.0 / np.maximum(distances, 1e-8)
+    weights /= weights.sum(axis=1, keepdims=True)
+    return np.einsum('ij,ijk->ik', weights, model['coords'][neighbors])
+
+_SWEEP_FEATURES = None
+
+def _init_sweep_worker(features):
+    global _SWEEP_FEATURES
+    _SWEEP_FEATURES = features
+
+def _sweep_worker(perplexity, n_iter, engine, method, n_jobs):
+    coords, _ = fit_embedding(_SWEEP_FEATURES, perplexity, n_iter, engine, method, n_jobs=n_jobs)
+    return coords
+
+def features_hash(features):
+    digest = hashlib.sha256(str(features.shape).encode())
+    digest.update(np.ascontiguousarray(features, dtype=np.float32).tobytes())
+    return digest.hexdigest()[:16]
+
+def run_sweep(features, perplexities, n_iters, engine, method, cache_dir, jobs):
+    """
+    Embed every (perplexity, n_iter) combination of an already preprocessed matrix.
+    Embeddings are cached as <cache_dir>/<data hash>_<params hash>.npy, and missing ones
+    are computed in parallel processes that share the CPUs between them. Returns {(perplexity, n_iter): coords}.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    data_key = features_hash(features)
+    results, todo = {}, {}
+    for perplexity, n_iter in itertools.product(perplexities, n_iters):
+        if perplexity >= len(features):
+            print(f"[WARN] Skipping perplexity {perplexity}: must be < number of samples ({len(features)}).")
+            continue
+        params = json.dumps({'perplexity': perplexity, 'n_iter': n_iter, 'engine': engine, 'method': method}, sort_keys=True)
+        cache_path = Path(cache_dir) / f"{data_key}_{hashlib.sha256(params.encode()).hexdigest()[:16]}.npy"
+        if cache_path.exists():
+            results[(perplexity, n_iter)] = np.load(cache_path)
+        else:
+            todo[(perplexity, n_iter)] = cache_path
+    if not todo:
+        print(f"[INFO] Sweep: all {len(results)} embeddings cached")
+        return results
+    jobs = max(1, min(jobs, len(todo)))
+    # Each process gets its share of the CPUs, so jobs x threads never oversubscribes the machine
+    threads = max(1, (os.cpu_count() or 1) // jobs)
+    print(f"[INFO] Sweep: {len(results)} cached, {len(todo)} to compute with {jobs} processes x {threads} threads")
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_sweep_worker, initargs=(features,)) as executor:
+        futures = {key: executor.submit(_sweep_worker, key[0], key[1], engine, method, threads) for key in todo}
+        for key, future in futures.items():
+            results[key] = future.result()
+            np.save(todo[key], results[key])
+    return results
+
+def save_sweep(results, structures, perplexities, n_iters, output_prefix):
+    """Write one combined coordinates table and a perplexity x n_iter grid of scatter plots."""
+    tables = [pd.DataFrame({'perplexity': p, 'n_iter': n, 'x': coords[:, 0], 'y': coords[:, 1],
+                            'structure': list(structures)})
+              for (p, n), coords in sorted(results.items())]
+    pd.concat(tables, ignore_index=True).to_csv(f"{output_prefix}_sweep.csv", index=False)
+
+    fig, axes = plt.subplots(len(perplexities), len(n_iters), squeeze=False,
+                             figsize=(4 * len(n_iters), 4 * len(perplexities)))
+    for (i, p), (j, n) in itertools.product(enumerate(perplexities), enumerate(n_iters)):
+        ax = axes[i, j]
+        ax.axis('off')
+        if (p, n) in results:
+            coords = results[(p, n)]
+            ax.scatter(coords[:, 0], coords[:, 1], s=10, alpha=0.8)
+        ax.set_title(f"perplexity={p:g}, n_iter={n}", fontsize=9)
+    fig.suptitle("t-SNE of MaSIF Descriptors")
+    fig.tight_layout()
+    fig.savefig(f"{output_prefix}_sweep.png", dpi=200)
+    plt.close(fig)
+
+def save_plot(result_df, path, hue=None, title="t-SNE of MaSIF Descriptors"):
+    plt.figure(figsize=(8, 6))
+    sns.scatterplot(data=result_df, x='x', y='y', hue=hue, s=40, alpha=0.8)
+    plt.title(title)
+    plt.axis('off')
+    plt.tight_layout()
+    plt.savefig(path, dpi=300)
+    plt.close()
 
 def main():
     parser = argparse.ArgumentParser(description="Run t-SNE on MaSIF descriptors.")
-    parser.add_argument('-i','--input_csv', type=str, required=True, help='CSV file with descriptors')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-i','--input_csv', type=str, help='CSV file with descriptors')
+    source.add_argument('-s', '--store', type=str, help='Descriptor store directory written by extract_descriptors_to_csv.py --format store')
     parser.add_argument('-o', '--output_prefix', type=str, default='tsne_output', help='Prefix for output files')
     parser.add_argument('-p', '--perplexity', type=float, default=20.0, help='Perplexity for t-SNE (must be < num samples)')
     parser.add_argument('-n', '--n_iter', type=int, default=1000, help='Number of iterations for t-SNE')
+    parser.add_argument('--pooling', type=str, help='With --store, pool each structure into fixed-length statistics (e.g. mean,max,p90) instead of zero-padded flattening')
+    parser.add_argument('--pca', type=int, help='Reduce features to this many components with randomized PCA before t-SNE (e.g. 50)')
+    parser.add_argument('--engine', choices=['sklearn', 'opentsne'], default='sklearn',
+                        help='sklearn, or openTSNE (FFT gradients + approximate neighbours, for large N)')
+    parser.add_argument('--method', choices=['barnes_hut', 'exact'], default='barnes_hut', help='Gradient method for the sklearn engine')
+    parser.add_argument('--save_model', type=str, help='Save the fitted embedding to this .pkl so new structures can be placed into it later')
+    parser.add_argument('--place', type=str, help='Place the input structures into the embedding saved in this .pkl instead of fitting a new one')
+    parser.add_argument('--sweep_perplexity', type=str, help='Comma-separated perplexities to sweep (e.g. 5,20,50)')
+    parser.add_argument('--sweep_n_iter', type=str, help='Comma-separated iteration counts to sweep (e.g. 500,1000)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Processes for --sweep_* runs (default: all CPUs)')
+    parser.add_argument('--cache_dir', type=str, default='tsne_cache', help='Where sweep embeddings are cached (default: tsne_cache)')
     args = parser.parse_args()
 
-    # Load input descriptor data
-    df = pd.read_csv(args.input_csv)
-    if 'structure' not in df.columns:
-        raise ValueError("Input CSV must have a 'structure' column.")
+    features, structures = load_features(args.input_csv, args.store, args.pooling)
 
-    # Split features and fill missing values
-    features = df.drop(columns=['structure']).fillna(0)
-    structures = df['structure']
+    if args.sweep_perplexity or args.sweep_n_iter:
+        perplexities = [float(p) for p in args.sweep_perplexity.split(',')] if args.sweep_perplexity else [args.perplexity]
+        n_iters = [int(n) for n in args.sweep_n_iter.split(',')] if args.sweep_n_iter else [args.n_iter]
+        if args.pca and args.pca < features.shape[1]:
+            # Reduce once and share the result across every configuration
+            features = PCA(n_components=min(args.pca, len(features)), svd_solver='randomized',
+                           random_state=42).fit_transform(features).astype(np.float32)
+        results = run_sweep(features, perplexities, n_iters, args.engine, args.method, args.cache_dir, args.jobs)
+        save_sweep(results, structures, perplexities, n_iters, args.output_prefix)
+        print(f"[INFO] Sweep complete. Saved to {args.output_prefix}_sweep.csv and _sweep.png")
+        return
+
+    if args.place:
+        with open(args.place, 'rb') as f:
+            model = pickle.load(f)
+        new = ~structures.isin(set(model['structures'])).to_numpy()
+        # Re-placing the same input is common; with nothing new there is nothing to place
+        coords = place_new(model, features[new]) if new.any() else np.empty((0, 2), dtype=np.float32)
+        result_df = pd.concat([
+            pd.DataFrame({'x': model['coords'][:, 0], 'y': model['coords'][:, 1],
+                          'structure': model['structures'], 'batch': 'existing'}),
+            pd.DataFrame({'x': coords[:, 0], 'y': coords[:, 1],
+                          'structure': structures[new].to_numpy(), 'batch': 'new'}),
+        ], ignore_index=True)
+        result_df.to_csv(f"{args.output_prefix}.csv", index=False)
+        save_plot(result_df, f"{args.output_prefix}.png", hue='batch')
+        print(f"[INFO] Placed {new.sum()} new structures into {args.place}. Saved to {args.output_prefix}.csv and .png")
+        return
 
     if args.perplexity >= len(features):
         raise ValueError(f"Perplexity ({args.perplexity}) must be < number of samples ({len(features)}).")
 
     # Run t-SNE
-    tsne = TSNE(n_components=2, perplexity=args.perplexity, n_iter=args.n_iter, random_state=42)
-    coords = tsne.fit_transform(features)
+    coords, model = fit_embedding(features, args.perplexity, args.n_iter, args.engine, args.method, args.pca)
 
     # Save results
     result_df = pd.DataFrame({'x': coords[:, 0], 'y': coords[:, 1], 'structure': structures})
     result_df.to_csv(f"{args.output_prefix}.csv", index=False)
 
+    if args.save_model:
+        model['structures'] = list(structures)
+        with open(args.save_model, 'wb') as f:
+            pickle.dump(model, f)
+        print(f"[INFO] Saved embedding model to {args.save_model}")
+
     # Plot
-    plt.figure(figsize=(8, 6))
-    sns.scatterplot(data=result_df, x='x', y='y', s=40, alpha=0.8)
-    plt.title("t-SNE of MaSIF Descriptors")
-    plt.axis('off')
-    plt.tight_layout()
-    plt.savefig(f"{args.output_prefix}.png", dpi=300)
+    save_plot(result_df, f"{args.output_prefix}.png")
 
     print(f"[INFO] t-SNE complete. Saved to {args.output_prefix}.csv and .png")
 
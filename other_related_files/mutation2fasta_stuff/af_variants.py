@@ -0,0 +1,164 @@
+"""
+Predict many point mutants of one parent with AlphaFold2 while reusing the parent's MSA/template features.
+
+The parent is run once through run_alphafold, which leaves <parent_dir>/features.pkl behind. Every
+variant of the same length gets its features by substituting its residues into the query row of those
+cached features (aatype, sequence and the first MSA row), so no MSA/template search is repeated.
+The model parameters are loaded once per job and every variant in the job reuses the compiled model.
+
+Usage example (normally written into job scripts by fasta2AF.py --shared_msa):
+python af_variants.py predict --parent_features <parent_dir>/features.pkl --parent_fasta parent.fasta \
+    --variants chunk_000.txt --data_dir $CURC_AF_DBS
+
+chunk_000.txt lists one "<fasta file>\t<output directory>" line per variant. --features_only writes the mutated
+features.pkl for each variant and skips prediction, which runs without a GPU or the alphafold package.
+"""
+
+import os
+import json
+import time
+import pickle
+import argparse
+import numpy as np
+
+# Mirrors alphafold.common.residue_constants so feature substitution works without alphafold installed
+RESTYPES = "ARNDCQEGHILKMFPSTWYV"
+RESTYPE_ORDER_WITH_X = {aa: i for i, aa in enumerate(RESTYPES + "X")}
+HHBLITS_AA_TO_ID = {aa: i for i, aa in enumerate("ACDEFGHIKLMNPQRSTVWYX-")}
+HHBLITS_AA_TO_ID.update({"B": 2, "J": 20, "O": 20, "U": 1, "Z": 3})
+MONOMER_MODELS = ("model_1", "model_2", "model_3", "model_4", "model_5")
+
+def read_fasta_records(fasta_path):
+    """[(name, sequence)] for every record in a (multi-)FASTA file."""
+    records = []
+    with open(fasta_path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(">"):
+                records.append([line[1:].split()[0], []])
+            elif line and records:
+                records[-1][1].append(line)
+    return [(name, "".join(chunks).upper()) for name, chunks in records]
+
+def substitutions(parent_sequence, variant_sequence):
+    """[(0-based position, parent residue, variant residue)]; the sequences must have the same length."""
+    if len(parent_sequence) != len(variant_sequence):
+        raise ValueError(f"Variant length {len(variant_sequence)} != parent length {len(parent_sequence)}")
+    return [(i, a, b) for i, (a, b) in enumerate(zip(parent_sequence, variant_sequence)) if a != b]
+
+def mutate_features(parent_features, parent_sequence, variant_sequence):
+    """
+    Copy of the parent's monomer feature dict with the variant's residues substituted into the query.
+    MSA rows of homologues, deletion matrices and template features are shared with the parent.
+    """
+    features = dict(parent_features)
+    changes = substitutions(parent_sequence, variant_sequence)
+    positions = np.array([pos for pos, _, _ in changes], dtype=np.int64)
+
+    aatype = np.array(parent_features["aatype"], copy=True)
+    aatype[positions] = 0
+    aatype[positions, [RESTYPE_ORDER_WITH_X.get(new, 20) for _, _, new in changes]] = 1
+    features["aatype"] = aatype
+
+    msa = np.array(parent_features["msa"], copy=True)
+    msa[0, positions] = [HHBLITS_AA_TO_ID.get(new, 20) for _, _, new in changes]
+    features["msa"] = msa
+
+    features["sequence"] = np.array([variant_sequence.encode()], dtype=np.object_)
+    return features
+
+def read_variant_list(list_path):
+    """[(fasta file, output directory)] from a chunk file written by fasta2AF.py."""
+    with open(list_path) as f:
+        return [tuple(line.rstrip("\n").split("\t")) for line in f if line.strip()]
+
+def load_model_runners(data_dir, model_names=MONOMER_MODELS):
+    from alphafold.model import config, data, model
+    runners = {}
+    for model_name in model_names:
+        model_config = config.model_config(model_name)
+        model_config.data.eval.num_ensemble = 1
+        params = data.get_model_haiku_params(model_name=model_name, data_dir=data_dir)
+        runners[model_name] = model.RunModel(model_config, params)
+    return runners
+
+def predict_variant(features, runners, output_dir, random_seed, relaxer=None):
+    """Run every model on one feature dict and write ranked_*.pdb and ranking_debug.json like run_alphafold."""
+    from alphafold.common import protein, residue_constants
+    timings, confidences, unrelaxed = {}, {}, {}
+    for model_name, runner in runners.items():
+        t_0 = time.time()
+        processed = runner.process_features(features, random_seed=random_seed)
+        result = runner.predict(processed, random_seed=random_seed)
+        timings[f"predict_{model_name}"] = time.time() - t_0
+        b_factors = np.repeat(result["plddt"][:, None], residue_constants.atom_type_num, axis=-1)
+        unrelaxed[model_name] = protein.from_prediction(
+            features=processed, result=result, b_factors=b_factors, remove_leading_feature_dimension=True)
+        confidences[model_name] = float(result["ranking_confidence"])
+        with open(os.path.join(output_dir, f"unrelaxed_{model_name}.pdb"), "w") as f:
+            f.write(protein.to_pdb(unrelaxed[model_name]))
+
+    ranked = sorted(confidences, key=confidences.get, reverse=True)
+    for rank, model_name in enumerate(ranked):
+        pdb_string = protein.to_pdb(unrelaxed[model_name])
+        if rank == 0 and relaxer is not None:
+            t_0 = time.time()
+            pdb_string, _, _ = relaxer.process(prot=unrelaxed[model_name])
+            timings["relax"] = time.time() - t_0
+            with open(os.path.join(output_dir, f"relaxed_{model_name}.pdb"), "w") as f:
+                f.write(pdb_string)
+        # ranked_0.pdb is written last-to-first so its presence means the variant is complete
+        with open(os.path.join(output_dir, f"ranked_{rank}.pdb.tmp"), "w") as f:
+            f.write(pdb_string)
+    for rank in reversed(range(len(ranked))):
+        os.replace(os.path.join(output_dir, f"ranked_{rank}.pdb.tmp"), os.path.join(output_dir, f"ranked_{rank}.pdb"))
+
+    with open(os.path.join(output_dir, "ranking_debug.json"), "w") as f:
+        json.dump({"plddts": confidences, "order": ranked}, f, indent=4)
+    with open(os.path.join(output_dir, "timings.json"), "w") as f:
+        json.dump(timings, f, indent=4)
+
+def run_predict(args):
+    with open(args.parent_features, "rb") as f:
+        parent_features = pickle.load(f)
+    _, parent_sequence = read_fasta_records(args.parent_fasta)[0]
+
+    runners, relaxer = None, None
+    if not args.features_only:
+        runners = load_model_runners(args.data_dir)
+        if args.relax:
+            from alphafold.relax import relax
+            relaxer = relax.AmberRelaxation(max_iterations=0, tolerance=2.39, stiffness=10.0, exclude_residues=[],
+                                            max_outer_iterations=3, use_gpu=args.gpu_relax)
+
+    variants = read_variant_list(args.variants)
+    for i, (fasta_file, output_dir) in enumerate(variants, 1):
+        name, sequence = read_fasta_records(fasta_file)[0]
+        if not args.force and os.path.exists(os.path.join(output_dir, "ranked_0.pdb")):
+            print(f"[{i}/{len(variants)}] {name}: ranked_0.pdb exists, skipping")
+            continue
+        os.makedirs(output_dir, exist_ok=True)
+        features = mutate_features(parent_features, parent_sequence, sequence)
+        changes = " ".join(f"{a}{pos+1}{b}" for pos, a, b in substitutions(parent_sequence, sequence))
+        print(f"[{i}/{len(variants)}] {name}: {changes or 'parent sequence'}")
+        if args.features_only:
+            with open(os.path.join(output_dir, "features.pkl"), "wb") as f:
+                pickle.dump(features, f, protocol=4)
+            continue
+        predict_variant(features, runners, output_dir, args.random_seed, relaxer)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AlphaFold2 point-mutant prediction on shared parent features.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    predict = subparsers.add_parser("predict", help="Predict every variant listed in a chunk file.")
+    predict.add_argument("--parent_features", required=True, help="features.pkl written by run_alphafold for the parent.")
+    predict.add_argument("--parent_fasta", required=True, help="FASTA of the parent sequence the features belong to.")
+    predict.add_argument("--variants", required=True, help="Chunk file of '<fasta>\\t<output dir>' lines.")
+    predict.add_argument("--data_dir", default=os.environ.get("CURC_AF_DBS"), help="AlphaFold data directory holding params/ (default: $CURC_AF_DBS).")
+    predict.add_argument("--random_seed", type=int, default=0)
+    predict.add_argument("--relax", action="store_true", help="Amber-relax the top-ranked model.")
+    predict.add_argument("--gpu_relax", action="store_true", help="Run the relaxation on the GPU.")
+    predict.add_argument("--features_only", action="store_true", help="Only write each variant's mutated features.pkl (no alphafold/GPU needed).")
+    predict.add_argument("--force", action="store_true", help="Re-predict variants that already have ranked_0.pdb.")
+    args = parser.parse_args()
+    run_predict(args)
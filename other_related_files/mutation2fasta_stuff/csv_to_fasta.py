@@ -1,6 +1,9 @@
 """
 Usage example:
 python csv_to_fasta.py --fasta_file </path/to/base/seq/fasta> --input_csv </path/to/mutation/csv> --output_dir <output directory> --output_csv <output csv>
+
+Batch mode (several mutation CSVs, identical sequences collapsed, one multi-FASTA + index):
+python csv_to_fasta.py --batch -f </path/to/base/seq/fasta> -i <HMH.csv> <L06_N.csv> -o <output directory> -c <output csv>
 """
 
 
@@ -8,8 +11,12 @@ import os
 import csv
 import re
 import string
+import numpy as np
 from Bio import SeqIO
 
+BATCH_FASTA = "mutants.fasta"
+BATCH_INDEX = "mutants_index.csv"
+
 # Step 1: Read Sequence from FASTA
 def read_fasta_sequence(fasta_file):
     with open(fasta_file, "r") as handle:
@@ -111,17 +118,134 @@ def process_mutations(fasta_file, input_csv_file, output_dir, output_comparison_
     print(f"Comparison CSV written to: {output_comparison_csv}")
     print("Processing complete.")
 
+# Batch engine: all mutants as one uint8 array, identical sequences collapsed to a canonical entry
+def encode_sequence(sequence):
+    return np.frombuffer("".join(sequence).encode("ascii"), dtype=np.uint8)
+
+def decode_sequence(row):
+    return row.tobytes().decode("ascii")
+
+def check_wild_type(base_sequence, mutation_columns, csv_file):
+    """Warn when a column header (e.g. 'K59') disagrees with the base sequence at that position."""
+    for header, pos in mutation_columns.items():
+        if pos < len(base_sequence) and header[0] != base_sequence[pos]:
+            print(f"Warning: {os.path.basename(csv_file)} column {header} does not match the base sequence "
+                  f"({base_sequence[pos]}{pos+1}); using the sequence as wild type.")
+
+def build_mutant_matrix(base_sequence, entries):
+    """
+    (n_entries, len(base_sequence)) uint8 matrix with every entry's mutations applied.
+    Mutations are scattered with one fancy-indexing assignment instead of per-sequence list copies.
+    """
+    base = encode_sequence(base_sequence)
+    matrix = np.tile(base, (len(entries), 1))
+    rows, cols, residues = [], [], []
+    for i, entry in enumerate(entries):
+        for pos, new_res in entry["Mutations"].items():
+            new_res = new_res.strip().upper()
+            if not (0 <= pos < len(base)):
+                print(f"Warning: Mutation position {pos+1} is out of range for sequence length {len(base)}.")
+            elif len(new_res) != 1 or not new_res.isalpha():
+                print(f"Warning: Ignoring mutation '{new_res}' at position {pos+1} for {entry['Chemical']}.")
+            else:
+                rows.append(i)
+                cols.append(pos)
+                residues.append(ord(new_res))
+    matrix[np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)] = np.array(residues, dtype=np.uint8)
+    return matrix
+
+def collapse_duplicates(matrix):
+    """
+    Return (canonical_rows, inverse): canonical_rows are the first occurrence of each distinct
+    sequence in input order, and inverse maps every row to its position in canonical_rows.
+    """
+    _, first, inverse = np.unique(matrix, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return first[order], rank[inverse]
+
+def describe_mutations(base, row):
+    changed = np.flatnonzero(row != base)
+    return ";".join(f"{chr(base[i])}{i+1}{chr(row[i])}" for i in changed)
+
+def process_mutation_batch(fasta_file, input_csv_files, output_dir, output_comparison_csv):
+    """
+    Build every mutant from several mutation CSVs in one pass, write one FASTA record per distinct
+    sequence to output_dir/mutants.fasta, and an alias index (output_dir/mutants_index.csv) mapping
+    every chemical name back to the canonical record that carries its sequence.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    base_sequence = read_fasta_sequence(fasta_file)
+    print(f"Base sequence extracted ({len(base_sequence)} residues): {''.join(base_sequence)}")
+
+    entries = []
+    seen_names = set()
+    for csv_file in input_csv_files:
+        mutations_data, mutation_columns = parse_mutations_from_csv(csv_file)
+        check_wild_type(base_sequence, mutation_columns, csv_file)
+        for entry in mutations_data:
+            name = sanitize_filename(entry["Chemical"])
+            if name in seen_names:
+                print(f"Warning: {name} appears more than once; later rows are kept as {name}_2, {name}_3, ...")
+                suffix = 2
+                while f"{name}_{suffix}" in seen_names:
+                    suffix += 1
+                name = f"{name}_{suffix}"
+            seen_names.add(name)
+            entries.append({"Chemical": entry["Chemical"], "Name": name, "Mutations": entry["Mutations"],
+                            "Source CSV": os.path.basename(csv_file)})
+
+    matrix = build_mutant_matrix(base_sequence, entries)
+    canonical_rows, inverse = collapse_duplicates(matrix)
+    base = encode_sequence(base_sequence)
+    print(f"{len(entries)} mutants from {len(input_csv_files)} CSV(s) -> {len(canonical_rows)} distinct sequences.")
+
+    fasta_path = os.path.join(output_dir, BATCH_FASTA)
+    with open(fasta_path, "w") as f:
+        for row in canonical_rows:
+            f.write(f">{entries[row]['Name']}\n{decode_sequence(matrix[row])}\n")
+    print(f"Multi-FASTA written to: {fasta_path}")
+
+    index_path = os.path.join(output_dir, BATCH_INDEX)
+    with open(index_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Chemical", "Name", "Canonical", "Source CSV", "Mutations"])
+        for i, entry in enumerate(entries):
+            canonical = entries[canonical_rows[inverse[i]]]["Name"]
+            if canonical != entry["Name"]:
+                print(f"{entry['Name']} was duplicate of {canonical}")
+            writer.writerow([entry["Chemical"], entry["Name"], canonical, entry["Source CSV"],
+                             describe_mutations(base, matrix[i])])
+    print(f"Alias index written to: {index_path}")
+
+    with open(output_comparison_csv, "w", newline="") as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(["Chemical"] + [f"{i+1}" for i in range(len(base_sequence))])
+        csv_writer.writerow(["Wild-Type"] + base_sequence)
+        for entry, row in zip(entries, matrix):
+            csv_writer.writerow([entry["Name"]] + list(decode_sequence(row)))
+    print(f"Comparison CSV written to: {output_comparison_csv}")
+    print("Processing complete.")
+
 # Step 6: Command-Line Interface
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="Process mutations and generate mutated FASTA and comparison CSV files.")
     parser.add_argument("-f", "--fasta_file", required=True, help="Path to the input FASTA file.")
-    parser.add_argument("-i", "--input_csv", required=True, help="Path to the input CSV file containing mutations.")
+    parser.add_argument("-i", "--input_csv", required=True, nargs="+", help="Path to the input CSV file(s) containing mutations (several only with --batch).")
     parser.add_argument("-o", "--output_dir", required=True, help="Directory to save the mutated FASTA files.")
     parser.add_argument("-c", "--output_csv", required=True, help="Path to save the sequence comparison CSV file.")
+    parser.add_argument("--batch", action="store_true", help=f"Collapse identical sequences and write {BATCH_FASTA} + {BATCH_INDEX} instead of one FASTA per row.")
 
     args = parser.parse_args()
 
     # Run processing
-    process_mutations(args.fasta_file, args.input_csv, args.output_dir, args.output_csv)
+    if args.batch:
+        process_mutation_batch(args.fasta_file, args.input_csv, args.output_dir, args.output_csv)
+    elif len(args.input_csv) > 1:
+        parser.error("Several input CSVs require --batch.")
+    else:
+        process_mutations(args.fasta_file, args.input_csv[0], args.output_dir, args.output_csv)
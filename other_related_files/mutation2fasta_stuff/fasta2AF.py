@@ -1,8 +1,54 @@
+"""
+Usage example (one AlphaFold2 job per FASTA):
+python fasta2AF.py -i <fasta directory> -c <command directory> -o <structure directory>
+
+Shared-MSA mode (parent MSA/features computed once, point mutants packed into a GPU job array):
+python fasta2AF.py --shared_msa --parent_fasta <parent.fasta> -i <mutants.fasta or fasta directory> -c <command directory> -o <structure directory>
+bash <command directory>/submit_shared_msa_<batch>.sh   (the exact path is printed)
+
+Every shared-MSA batch gets its own chunk directory and scripts, keyed by a hash of the parent and the
+variants it holds, so a new batch never touches the inputs of one still waiting in the queue.
+"""
+
 import os
 import shutil
 import glob
+import hashlib
 import argparse
 
+AF_VARIANTS_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "af_variants.py")
+
+def sbatch_header(time_limit, extra=()):
+    return [
+        "#!/bin/bash\n",
+        "#SBATCH --account=ucb-general",
+        "#SBATCH --partition=aa100",
+        "#SBATCH --output=test.%j.out",
+        f"#SBATCH --time={time_limit}",
+        "#SBATCH --nodes=1",
+        "#SBATCH --ntasks=10",
+        "#SBATCH --gres=gpu:1",
+        *extra,
+        "\n",
+        "module purge",
+        "module load alphafold",
+        "\n",
+    ]
+
+def write_script(command_script_path, commands):
+    with open(command_script_path, 'w') as file:
+        file.write("\n".join(commands))
+    os.chmod(command_script_path, 0o755)
+
+def write_af2_script(command_script_path, molecule_dir, fasta_name, run_alphafold="run_alphafold"):
+    """Script that runs the full AlphaFold2 pipeline (MSA search + prediction) for one FASTA."""
+    commands = sbatch_header("00:20:00") + [
+        f"cd {molecule_dir}",
+        "\n",
+        f'{run_alphafold} -d $CURC_AF_DBS -o {molecule_dir} -f {fasta_name} -t 2023-10-10 -m "monomer" -g true -p true'
+    ]
+    write_script(command_script_path, commands)
+
 def create_commands(AF2_input_directory, output_cmd_directory, output_structure_directory):
     # Ensure the output directories exist
     os.makedirs(output_cmd_directory, exist_ok=True)
@@ -27,41 +73,139 @@ def create_commands(AF2_input_directory, output_cmd_directory, output_structure_
         # Create the AlphaFold2 command script and save it in the output commands directory
         command_script_path = os.path.join(output_cmd_directory, f"{fasta_file_base}_AF2.sh")
 
-        commands = [
-            "#!/bin/bash\n",
-            "#SBATCH --account=ucb-general",
-            "#SBATCH --partition=aa100",
-            "#SBATCH --output=test.%j.out",
-            "#SBATCH --time=00:20:00",
-            "#SBATCH --nodes=1",
-            "#SBATCH --ntasks=10",
-            "#SBATCH --gres=gpu:1",
-            "\n",
-            "module purge",
-            "module load alphafold",
-            "\n",
-            f"cd {molecule_dir}",
-            "\n",
-            f'run_alphafold -d $CURC_AF_DBS -o {molecule_dir} -f {os.path.basename(fasta_file_path)} -t 2023-10-10 -m "monomer" -g true -p true'
-        ]
-
         # Write the command script
-        with open(command_script_path, 'w') as file:
-            file.write("\n".join(commands))
-
-        # Make the script executable
-        os.chmod(command_script_path, 0o755)
+        write_af2_script(command_script_path, molecule_dir, os.path.basename(fasta_file_path))
 
         print(f"Setup completed for {fasta_file_base}.")
         print(f"   - FASTA copied to: {fasta_dest_path}")
         print(f"   - Command script saved to: {command_script_path}")
 
+def read_variants(variant_input):
+    """[(name, sequence)] from a multi-FASTA file (e.g. csv_to_fasta.py --batch) or a directory of FASTA files."""
+    from af_variants import read_fasta_records  # needs numpy, so only imported for --shared_msa
+    if os.path.isdir(variant_input):
+        records = []
+        for fasta_file_path in sorted(glob.glob(os.path.join(variant_input, '*.fasta'))):
+            name = os.path.splitext(os.path.basename(fasta_file_path))[0]
+            records.append((name, read_fasta_records(fasta_file_path)[0][1]))
+        return records
+    return read_fasta_records(variant_input)
+
+def create_shared_msa_commands(parent_fasta, variant_input, output_cmd_directory, output_structure_directory,
+                               variants_per_job=25, minutes_per_variant=3, run_alphafold="run_alphafold",
+                               python="python", force=False):
+    """
+    Write one parent job that computes the MSA/template features once, and a job array whose tasks each
+    predict a chunk of variants from those cached features. The parent job is skipped when the features
+    for the parent sequence are already cached, and variants that already have ranked_0.pdb are skipped.
+    Variants whose length differs from the parent cannot reuse its features and get a normal per-FASTA script.
+    """
+    from af_variants import read_fasta_records  # needs numpy, so only imported for --shared_msa
+    os.makedirs(output_cmd_directory, exist_ok=True)
+    os.makedirs(output_structure_directory, exist_ok=True)
+    output_cmd_directory = os.path.abspath(output_cmd_directory)
+    output_structure_directory = os.path.abspath(output_structure_directory)
+
+    # Parent features are cached per sequence, so any later batch of the same parent reuses them
+    parent_name, parent_sequence = read_fasta_records(parent_fasta)[0]
+    parent_key = hashlib.sha1(parent_sequence.encode()).hexdigest()[:12]
+    parent_dir = os.path.join(output_structure_directory, "_parent_features", parent_key)
+    os.makedirs(parent_dir, exist_ok=True)
+    parent_fasta_path = os.path.join(parent_dir, "parent.fasta")
+    with open(parent_fasta_path, "w") as f:
+        f.write(f">{parent_name}\n{parent_sequence}\n")
+    parent_features = os.path.join(parent_dir, "parent", "features.pkl")
+
+    shared, fallback, done = [], [], 0
+    for name, sequence in read_variants(variant_input):
+        molecule_dir = os.path.join(output_structure_directory, name)
+        prediction_dir = os.path.join(molecule_dir, name)
+        if not force and os.path.exists(os.path.join(prediction_dir, "ranked_0.pdb")):
+            done += 1
+            continue
+        os.makedirs(molecule_dir, exist_ok=True)
+        fasta_dest_path = os.path.join(molecule_dir, f"{name}.fasta")
+        with open(fasta_dest_path, "w") as f:
+            f.write(f">{name}\n{sequence}\n")
+        if len(sequence) == len(parent_sequence):
+            shared.append((fasta_dest_path, prediction_dir))
+        else:
+            fallback.append((name, molecule_dir))
+
+    parent_script = os.path.join(output_cmd_directory, f"parent_features_{parent_key}_AF2.sh")
+    submit = ["#!/bin/bash", "# Submits the parent feature job (if its features are not cached yet) and the variant array after it", ""]
+    dependency = ""
+    if shared and not os.path.exists(parent_features):
+        write_af2_script(parent_script, parent_dir, "parent.fasta", run_alphafold)
+        submit.append(f"parent_job=$(sbatch --parsable {parent_script})")
+        dependency = "--dependency=afterok:$parent_job "
+        print(f"Parent features will be computed by: {parent_script}")
+    elif shared:
+        if os.path.exists(parent_script):
+            os.remove(parent_script)
+        print(f"Reusing cached parent features: {parent_features}")
+
+    # Chunk files are read by array tasks that may still be queued, so each batch gets its own directory
+    # and scripts, and an existing batch directory (same parent, same variants) is never rewritten
+    batch_key = hashlib.sha1("\n".join([parent_key, str(variants_per_job)] +
+                                       [f"{fasta}\t{prediction_dir}" for fasta, prediction_dir in shared] +
+                                       [molecule_dir for _, molecule_dir in fallback]).encode()).hexdigest()[:12]
+    if shared:
+        chunk_dir = os.path.join(output_cmd_directory, "variant_chunks", batch_key)
+        chunks = [shared[i:i + variants_per_job] for i in range(0, len(shared), variants_per_job)]
+        if not os.path.isdir(chunk_dir):
+            os.makedirs(f"{chunk_dir}.tmp", exist_ok=True)
+            for i, chunk in enumerate(chunks):
+                with open(os.path.join(f"{chunk_dir}.tmp", f"chunk_{i:03d}.txt"), "w") as f:
+                    f.writelines(f"{fasta}\t{prediction_dir}\n" for fasta, prediction_dir in chunk)
+            os.replace(f"{chunk_dir}.tmp", chunk_dir)
+        else:
+            print(f"Reusing the chunk files of an identical earlier batch: {chunk_dir}")
+
+        minutes = 10 + minutes_per_variant * len(chunks[0])
+        array_script = os.path.join(output_cmd_directory, f"variants_AF2_array_{batch_key}.sh")
+        commands = sbatch_header(f"{minutes // 60:02d}:{minutes % 60:02d}:00", [f"#SBATCH --array=0-{len(chunks) - 1}"]) + [
+            f'chunk=$(printf "{chunk_dir}/chunk_%03d.txt" "${{SLURM_ARRAY_TASK_ID:-0}}")',
+            "\n",
+            f"{python} {AF_VARIANTS_SCRIPT} predict --parent_features {parent_features} --parent_fasta {parent_fasta_path} "
+            f'--variants "$chunk" --data_dir $CURC_AF_DBS --relax --gpu_relax'
+        ]
+        write_script(array_script, commands)
+        submit.append(f"sbatch {dependency}{array_script}")
+        print(f"{len(shared)} variants packed into {len(chunks)} array task(s) of up to {variants_per_job}: {array_script}")
+
+    for name, molecule_dir in fallback:
+        command_script_path = os.path.join(output_cmd_directory, f"{name}_AF2.sh")
+        write_af2_script(command_script_path, molecule_dir, f"{name}.fasta", run_alphafold)
+        submit.append(f"sbatch {command_script_path}")
+        print(f"{name} differs in length from the parent; full AlphaFold2 script saved to: {command_script_path}")
+
+    if done:
+        print(f"{done} variants already have ranked_0.pdb and were skipped (use --force to redo them).")
+    submit_script = os.path.join(output_cmd_directory, f"submit_shared_msa_{batch_key}.sh")
+    write_script(submit_script, submit + [""])
+    print(f"Submit everything with: bash {submit_script}")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate AlphaFold2 commands with organized directory structure.")
-    parser.add_argument("-i", "--input_directory", help="Path to directory containing FASTA files.")
+    parser.add_argument("-i", "--input_directory", help="Path to directory containing FASTA files (or, with --shared_msa, a multi-FASTA file).")
     parser.add_argument("-c", "--command_output_directory", help="Path to output directory for generated AlphaFold2 command scripts.")
     parser.add_argument("-o", "--structure_output_directory", help="Path to directory where structured FASTA subdirectories will be created.")
+    parser.add_argument("--shared_msa", action="store_true", help="Compute the parent's MSA/features once and predict the variants from them in packed GPU jobs.")
+    parser.add_argument("--parent_fasta", help="FASTA of the parent sequence the variants are point mutants of (required with --shared_msa).")
+    parser.add_argument("--variants_per_job", type=int, default=25, help="Variants predicted per array task with --shared_msa (default: 25).")
+    parser.add_argument("--minutes_per_variant", type=int, default=3, help="Wall time budgeted per variant in array tasks (default: 3).")
+    parser.add_argument("--run_alphafold", default="run_alphafold", help="Command used for full AlphaFold2 runs, e.g. a local stand-in for testing.")
+    parser.add_argument("--python", default="python", help="Python interpreter with alphafold installed, used by the array tasks.")
+    parser.add_argument("--force", action="store_true", help="Re-predict variants that already have ranked_0.pdb.")
 
     args = parser.parse_args()
-    create_commands(args.input_directory, args.command_output_directory, args.structure_output_directory)
+    if args.shared_msa:
+        if not args.parent_fasta:
+            parser.error("--shared_msa requires --parent_fasta.")
+        create_shared_msa_commands(args.parent_fasta, args.input_directory, args.command_output_directory,
+                                   args.structure_output_directory, args.variants_per_job, args.minutes_per_variant,
+                                   args.run_alphafold, args.python, args.force)
+    else:
+        create_commands(args.input_directory, args.command_output_directory, args.structure_output_directory)
 
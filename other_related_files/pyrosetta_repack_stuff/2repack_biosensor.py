@@ -3,11 +3,15 @@
 import pyrosetta
 import os
 import argparse
-import pandas as pd
 import sys
+import time
 import datetime
+import multiprocessing
+import csv
+from clash_screen import screen_directory, write_report, read_report
 from pyrosetta.rosetta.core.pack.task import TaskFactory
 from pyrosetta.rosetta.core.pack.task import operation
+from pyrosetta.rosetta.core.select import residue_selector
 from pyrosetta.rosetta.protocols import minimization_packing as pack_min
 
 def parse_args():
@@ -17,7 +21,45 @@ def parse_args():
     parser.add_argument("-o", "--output_directory", type=str, required=True, help="Directory to save repacked structures.")
     parser.add_argument("-c", "--csv_file", type=str, default="./pack_score_log.csv", help="CSV file to save score results.")
     parser.add_argument("-n", "--cycles", type=int, default=3, help="Number of repacking cycles (default: 3)")
-    return parser.parse_args()
+    parser.add_argument("--min_improvement", type=float,
+                        help="Stop cycling once --patience consecutive cycles each improve the best score by less than this many REU")
+    parser.add_argument("--patience", type=int, default=2,
+                        help="Consecutive cycles below --min_improvement before stopping early (default: 2)")
+    parser.add_argument("--rerun", action="store_true",
+                        help="Reprocess every PDB instead of skipping ones already in the CSV or output directory")
+    parser.add_argument("-m", "--mutation_csv", type=str,
+                        help="Comparison CSV from csv_to_fasta.py; only mutated positions plus a --shell around them are repacked")
+    parser.add_argument("-r", "--reference_pdb", type=str,
+                        help="Wild-type PDB; mutated positions are found by sequence diff and only they plus a --shell are repacked")
+    parser.add_argument("-s", "--shell", type=float, default=8.0,
+                        help="Distance (A) around mutated residues that is also repacked with -m/-r (default: 8.0)")
+    parser.add_argument("--clash_report", type=str,
+                        help="Clash report from clash_screen.py (created if missing) used by --clash_order/--max_clashes")
+    parser.add_argument("--clash_order", choices=["worst_first", "best_first"],
+                        help="Process PDBs in order of clashes per 1000 heavy atoms from --clash_report")
+    parser.add_argument("--max_clashes", type=float,
+                        help="Skip PDBs with more clashes per 1000 heavy atoms than this in --clash_report")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Worker processes, each with its own PyRosetta instance (default: 1)")
+    shard_index, shard_count = default_shard()
+    parser.add_argument("--shard_index", type=int, default=shard_index,
+                        help="Slice of the sorted PDB list to process (default: SLURM_ARRAY_TASK_ID)")
+    parser.add_argument("--shard_count", type=int, default=shard_count,
+                        help="Total number of shards; each shard writes <csv_file>.shardNNN.csv (default: SLURM_ARRAY_TASK_COUNT, else 1)")
+    args = parser.parse_args()
+    if args.shard_count < 1:
+        parser.error("--shard_count must be at least 1")
+    if not 0 <= args.shard_index < args.shard_count:
+        parser.error(f"--shard_index must be between 0 and {args.shard_count - 1} for --shard_count {args.shard_count}")
+    return args
+
+def default_shard():
+    """Shard index and count taken from a Slurm job array, or (0, 1) outside of one."""
+    task_id = os.environ.get("SLURM_ARRAY_TASK_ID", "")
+    task_count = os.environ.get("SLURM_ARRAY_TASK_COUNT", "")
+    if not (task_id.isdigit() and task_count.isdigit()):
+        return 0, 1
+    task_min = os.environ.get("SLURM_ARRAY_TASK_MIN", "0")
+    return int(task_id) - int(task_min if task_min.isdigit() else 0), int(task_count)
 
 def setup_logging():
     """Redirect stdout and stderr to a log file."""
@@ -27,90 +69,295 @@ def setup_logging():
     sys.stderr = sys.stdout
     print(f"Logging output to {log_file}\n")
 
-def setup_packer():
+def setup_packer(positions=None, shell=8.0):
+    """
+    Build the packer. With positions (1-based pose numbering), only those residues and
+    residues within shell A of them are repacked; everything else is held fixed.
+    """
     tf = TaskFactory()
     tf.push_back(operation.InitializeFromCommandline())  # Initialize with Rosetta command-line options
     tf.push_back(operation.IncludeCurrent())  # Include current rotamer states
     tf.push_back(operation.NoRepackDisulfides())  # Keep disulfide bonds intact
     tf.push_back(operation.RestrictToRepacking())  # Allow only repacking, no design
+    if positions:
+        tf.push_back(operation.OperateOnResidueSubset(
+            operation.PreventRepackingRLT(), repack_selector(positions, shell), True))  # Freeze everything outside the shell
 
     packer = pack_min.PackRotamersMover()
     packer.task_factory(tf)
     
     return packer
 
-def repack_pose(pose, scorefxn, packer, cycles):
+def repack_selector(positions, shell):
+    """Mutated residues plus every residue within shell A of them."""
+    focus = residue_selector.ResidueIndexSelector(",".join(str(p) for p in sorted(positions)))
+    return residue_selector.NeighborhoodResidueSelector(focus, shell, True)
+
+def load_mutation_table(mutation_csv):
+    """Read a csv_to_fasta.py comparison CSV into {chemical name: ([mutated 1-based sequence positions], mutant sequence)}."""
+    with open(mutation_csv, newline="") as f:
+        rows = list(csv.reader(f))
+    wild_type = next(row[1:] for row in rows[1:] if row[0] == "Wild-Type")
+    table = {}
+    for row in rows[1:]:
+        if row[0] != "Wild-Type":
+            positions = [i + 1 for i, (wt, res) in enumerate(zip(wild_type, row[1:])) if wt != res]
+            table[row[0]] = (positions, "".join(row[1:]))
+    return table
+
+def mutation_positions(pose, pdb_file):
+    """
+    Pose residue numbers of the mutated positions in this structure, or None when they are unknown.
+    Comparison-CSV positions are offset to every place the mutant sequence occurs in each chain,
+    so they also work when the mutated domain is embedded in a longer biosensor chain or, as in the
+    biosensor models, several copies of it are stacked in one chain.
+    """
+    if reference_sequence is not None:
+        sequence = pose.sequence()
+        if len(sequence) != len(reference_sequence):
+            print(f"[WARN] {pdb_file} has {len(sequence)} residues, reference has {len(reference_sequence)}; repacking everything")
+            return None
+        return [i + 1 for i, (ref, res) in enumerate(zip(reference_sequence, sequence)) if ref != res]
+
+    if mutation_table is not None:
+        stem = os.path.splitext(pdb_file)[0]
+        name = stem if stem in mutation_table else stem.replace("best_packed_", "", 1)
+        if name not in mutation_table:
+            print(f"[WARN] {pdb_file} not found in the mutation CSV; repacking everything")
+            return None
+        mutated, mutant_sequence = mutation_table[name]
+        positions = []
+        for chain in range(1, pose.num_chains() + 1):
+            chain_sequence = pose.chain_sequence(chain)
+            start = 0
+            while mutant_sequence and (offset := chain_sequence.find(mutant_sequence, start)) >= 0:
+                positions.extend(pose.chain_begin(chain) + offset + p - 1 for p in mutated)
+                start = offset + len(mutant_sequence)
+        if not positions and mutated:
+            print(f"[WARN] Sequence of {name} from the mutation CSV not found in {pdb_file}; repacking everything")
+            return None
+        return positions
+
+    return None
+
+def repack_pose(pose, scorefxn, packer, cycles, min_improvement=None, patience=2):
+    """
+    Run up to cycles rounds of packing and keep the lowest-energy pose.
+    Stops early once patience consecutive cycles (default 2) have each improved the best score by less
+    than min_improvement, so a single cycle that scores worse does not end the run.
+    Returns the best pose, its score and a (cycle, score, seconds) record per cycle.
+    """
     best_pose = pose.clone()
     best_score = scorefxn(pose)
+    cycle_log = []
+    stalled = 0
 
     for i in range(cycles):
         print(f"Running repacking cycle {i+1}/{cycles}...")
+        start = time.time()
         packer.apply(pose)
 
         # Score the current pose
         current_score = scorefxn(pose)
+        cycle_log.append((i + 1, current_score, time.time() - start))
         print(f"Cycle {i+1} score: {current_score}")
 
-        # Keep the lowest-energy structure
+        # Keep the lowest-energy structure, copying into the existing best pose rather than cloning
+        improvement = best_score - current_score
         if current_score < best_score:
             best_score = current_score
-            best_pose = pose.clone()
+            best_pose.assign(pose)
             print(f"New best score found: {best_score}")
 
-    return best_pose, best_score
+        if min_improvement is not None:
+            stalled = stalled + 1 if improvement < min_improvement else 0
+            if stalled >= patience:
+                print(f"Converged after {i+1} cycles ({stalled} cycles improving by < {min_improvement})")
+                break
+
+    return best_pose, best_score, cycle_log
+
+def append_csv_row(csv_file, row):
+    """Append one row, writing the header first for a new file, and flush it to disk right away."""
+    exists = os.path.exists(csv_file) and os.path.getsize(csv_file) > 0
+    fieldnames = list(row)
+    if exists:
+        with open(csv_file, newline="") as f:
+            fieldnames = next(csv.reader(f))
+    with open(csv_file, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        if not exists:
+            writer.writeheader()
+        writer.writerow(row)
+        f.flush()
+        os.fsync(f.fileno())
+
+def completed_pdbs(csv_file, output_directory):
+    """PDB files that have both a row in the CSV and a repacked structure in the output directory."""
+    scored = set()
+    if os.path.exists(csv_file) and os.path.getsize(csv_file) > 0:
+        with open(csv_file, newline="") as f:
+            scored.update(row["PDB File"] for row in csv.DictReader(f))
+    return {f for f in scored if os.path.exists(os.path.join(output_directory, f"best_packed_{f}"))}
+
+# Per-process PyRosetta state, set up once by init_worker
+scorefxn = None
+packer = None
+mutation_table = None
+reference_sequence = None
+shell_distance = None
+
+def init_worker(mutation_csv=None, reference_pdb=None, shell=8.0):
+    """Initialize PyRosetta, the score function, the packer and the mutation lookup once per process."""
+    global scorefxn, packer, mutation_table, reference_sequence, shell_distance
+    pyrosetta.init("-ignore_unrecognized_res 1 -ex1 -ex2aro")
+    scorefxn = pyrosetta.create_score_function("ref2015")
+    packer = setup_packer()
+    shell_distance = shell
+    if mutation_csv:
+        mutation_table = load_mutation_table(mutation_csv)
+    if reference_pdb:
+        reference_sequence = pyrosetta.pose_from_file(reference_pdb).sequence()
+
+def restricted_mode():
+    return mutation_table is not None or reference_sequence is not None
+
+def process_pdb(pdb_path, output_directory, cycles, min_improvement=None, patience=2):
+    """Repack one PDB, save the best pose and return its score row and per-cycle records."""
+    start = time.time()
+    pdb_file = os.path.basename(pdb_path)
+    print(f"\nProcessing {pdb_file} with {cycles} repacking cycles...")
+
+    # Load the PDB file into a pose
+    pose = pyrosetta.pose_from_file(pdb_path)
+
+    # Compute initial score
+    original_score = scorefxn(pose)
+    print(f"Original pose score: {original_score}")
+
+    # Restrict the packer to the mutated residues and their neighbourhood when they are known
+    pose_packer = packer
+    positions = mutation_positions(pose, pdb_file) if restricted_mode() else None
+    if positions:
+        pose_packer = setup_packer(positions, shell_distance)
+        n_repacked = sum(repack_selector(positions, shell_distance).apply(pose))
+        print(f"Repacking {n_repacked}/{pose.total_residue()} residues around {len(positions)} mutated positions")
+    elif positions is not None:
+        print("No mutated positions found; repacking everything")
+
+    # Apply repacking and keep the lowest-energy structure
+    best_pose, best_score, cycle_log = repack_pose(pose, scorefxn, pose_packer, cycles, min_improvement, patience)
+
+    # Save the best structure to PDB, moved into place only once complete so a killed run leaves no partial file
+    output_file = os.path.join(output_directory, f"best_packed_{pdb_file}")
+    best_pose.dump_pdb(f"{output_file}.tmp")
+    os.replace(f"{output_file}.tmp", output_file)
+    print(f"Lowest-energy structure saved as {output_file}")
+    sys.stdout.flush()
+
+    row = {
+        "PDB File": pdb_file,
+        "Original Score": original_score,
+        "Best Packed Score": best_score,
+        "Δ Score (Repacking)": best_score - original_score,
+        "Cycles Run": len(cycle_log),
+        "Seconds": round(time.time() - start, 2)
+    }
+    if restricted_mode():
+        row["Mutated Positions"] = len(positions) if positions is not None else ""
+    return row, cycle_log
+
+def _process_pdb_star(job):
+    """process_pdb for one job tuple; a failure is returned as an error row so the other PDBs still run."""
+    try:
+        return process_pdb(*job)
+    except Exception as e:
+        pdb_file = os.path.basename(job[0])
+        print(f"Error processing {pdb_file}: {type(e).__name__}: {e}")
+        sys.stdout.flush()
+        return {"PDB File": pdb_file, "Error": f"{type(e).__name__}: {e}"}, []
 
 def main():
     args = parse_args()
     setup_logging()  # Start logging
 
-    # Initialize PyRosetta
-    pyrosetta.init("-ignore_unrecognized_res 1 -ex1 -ex2aro")
-
     # Ensure output directory exists
     os.makedirs(args.output_directory, exist_ok=True)
 
-    # Load optimized scoring function
-    scorefxn = pyrosetta.create_score_function("ref2015")
+    # This task's slice of the sorted PDB files (the whole directory unless run as an array task)
+    pdb_files = sorted(f for f in os.listdir(args.pdb_directory) if f.endswith(".pdb"))
+    pdb_files = pdb_files[args.shard_index::args.shard_count]
 
-    # Setup the packer (initialized once for efficiency)
-    packer = setup_packer()
+    csv_file = args.csv_file
+    if args.shard_count > 1:
+        root, ext = os.path.splitext(csv_file)
+        csv_file = f"{root}.shard{args.shard_index:03d}{ext}"
+        print(f"Shard {args.shard_index + 1}/{args.shard_count}: {len(pdb_files)} PDBs")
+    root, ext = os.path.splitext(csv_file)
+    cycles_csv = f"{root}.cycles{ext}"
+    errors_csv = f"{root}.errors{ext}"
+
+    # Resume: skip PDBs finished by an earlier (possibly killed) run
+    if args.rerun:
+        for path in (csv_file, cycles_csv, errors_csv):
+            if os.path.exists(path):
+                os.remove(path)
+    else:
+        done = completed_pdbs(csv_file, args.output_directory)
+        skipped = [f for f in pdb_files if f in done]
+        pdb_files = [f for f in pdb_files if f not in done]
+        if skipped:
+            print(f"Skipping {len(skipped)} PDBs already in {csv_file} and {args.output_directory}")
+
+    # Triage with the clash pre-screen: order by clash density and/or drop hopeless structures
+    if args.clash_report:
+        if not os.path.exists(args.clash_report):
+            write_report(screen_directory(args.pdb_directory), args.clash_report)
+            print(f"Clash report saved to {args.clash_report}")
+        clashes = read_report(args.clash_report)
+        if args.max_clashes is not None:
+            hopeless = [f for f in pdb_files if clashes.get(f, 0.0) > args.max_clashes]
+            pdb_files = [f for f in pdb_files if clashes.get(f, 0.0) <= args.max_clashes]
+            if hopeless:
+                print(f"Skipping {len(hopeless)} PDBs above {args.max_clashes} clashes per 1000 atoms: {', '.join(hopeless)}")
+        if args.clash_order:
+            pdb_files.sort(key=lambda f: clashes.get(f, 0.0), reverse=args.clash_order == "worst_first")
+
+    jobs = [(os.path.join(args.pdb_directory, f), args.output_directory, args.cycles, args.min_improvement, args.patience)
+            for f in pdb_files]
+
+    n_failed = 0
+
+    def record(row, cycle_log):
+        """Write a finished structure's score and cycle rows (or its error) as soon as it completes."""
+        nonlocal n_failed
+        if "Error" in row:
+            # Failed PDBs are kept out of the score CSV, so a later run retries them
+            append_csv_row(errors_csv, row)
+            n_failed += 1
+            return
+        append_csv_row(csv_file, row)
+        for cycle, score, seconds in cycle_log:
+            append_csv_row(cycles_csv, {"PDB File": row["PDB File"], "Cycle": cycle,
+                                        "Score": score, "Seconds": round(seconds, 2)})
+
+    if args.jobs <= 1:
+        # PyRosetta, the score function and the packer are initialized once for efficiency
+        init_worker(args.mutation_csv, args.reference_pdb, args.shell)
+        for job in jobs:
+            record(*_process_pdb_star(job))
+    else:
+        # Each worker initializes PyRosetta once, then pulls PDBs from the pool's queue
+        with multiprocessing.Pool(processes=args.jobs, initializer=init_worker,
+                                  initargs=(args.mutation_csv, args.reference_pdb, args.shell)) as pool:
+            for n_done, (row, cycle_log) in enumerate(pool.imap_unordered(_process_pdb_star, jobs), start=1):
+                record(row, cycle_log)
+                print(f"Finished {row['PDB File']} ({n_done}/{len(jobs)})")
+                sys.stdout.flush()
 
-    # Prepare a list to store score results
-    score_data = []
-
-    # Loop through all PDB files in the directory
-    for pdb_file in os.listdir(args.pdb_directory):
-        if pdb_file.endswith(".pdb"):  # Process only PDB files
-            pdb_path = os.path.join(args.pdb_directory, pdb_file)
-            print(f"\nProcessing {pdb_file} with {args.cycles} repacking cycles...")
-
-            # Load the PDB file into a pose
-            pose = pyrosetta.pose_from_file(pdb_path)
-
-            # Compute initial score
-            original_score = scorefxn(pose)
-            print(f"Original pose score: {original_score}")
-
-            # Apply repacking and keep the lowest-energy structure
-            best_pose, best_score = repack_pose(pose, scorefxn, packer, args.cycles)
-
-            # Save the best structure to PDB
-            output_file = os.path.join(args.output_directory, f"best_packed_{pdb_file}")
-            best_pose.dump_pdb(output_file)
-            print(f"Lowest-energy structure saved as {output_file}")
-
-            # Store score data for CSV
-            score_data.append({
-                "PDB File": pdb_file,
-                "Original Score": original_score,
-                "Best Packed Score": best_score,
-                "Δ Score (Repacking)": best_score - original_score
-            })
-
-    # Save score data to CSV
-    df = pd.DataFrame(score_data)
-    df.to_csv(args.csv_file, index=False)
-    print(f"\nAll PDBs have been processed! Score results saved to {args.csv_file}.")
+    print(f"\nAll PDBs have been processed! Score results saved to {csv_file} (per-cycle scores in {cycles_csv}).")
+    if n_failed:
+        print(f"{n_failed} PDBs failed; their errors are in {errors_csv}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
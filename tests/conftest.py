@@ -0,0 +1,26 @@
+"""
+Shared test helpers. The scripts live in plain folders rather than a package, so their directories are
+put on sys.path here; 2repack_biosensor.py runs against the PyRosetta stand-in in benchmarks/stubs.
+"""
+
+import importlib.util
+import sys
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+MASIF_DIR = REPO_DIR / "masif_files"
+REPACK_DIR = REPO_DIR / "other_related_files" / "pyrosetta_repack_stuff"
+MUTATION_DIR = REPO_DIR / "other_related_files" / "mutation2fasta_stuff"
+STUB_DIR = REPO_DIR / "benchmarks" / "stubs"
+
+for path in (MASIF_DIR, REPACK_DIR, MUTATION_DIR):
+    sys.path.insert(0, str(path))
+
+def load_repack_module():
+    """Import 2repack_biosensor.py (not importable by name) with the PyRosetta stand-in."""
+    if str(STUB_DIR) not in sys.path:
+        sys.path.append(str(STUB_DIR))
+    spec = importlib.util.spec_from_file_location("repack_biosensor", REPACK_DIR / "2repack_biosensor.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
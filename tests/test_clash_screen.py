@@ -0,0 +1,33 @@
+from clash_screen import read_pdb_atoms, count_clashes, screen_directory
+
+def atom_line(serial, name, resname, resseq, x, y=0.0, z=0.0, element="C"):
+    return (f"ATOM  {serial:5d} {name:<4} {resname} A{resseq:4d}    {x:8.3f}{y:8.3f}{z:8.3f}"
+            f"  1.00  0.00          {element:>2}\n")
+
+def test_empty_and_atomless_files_give_no_clashes(tmp_path):
+    (tmp_path / "empty.pdb").write_text("")
+    (tmp_path / "header_only.pdb").write_text("HEADER    NOTHING HERE\nEND\n")
+
+    for name in ("empty.pdb", "header_only.pdb"):
+        atoms = read_pdb_atoms(tmp_path / name)
+        assert len(atoms["coords"]) == 0 and len(atoms["segment"]) == 0
+        assert count_clashes(atoms) == (0, 0.0, 0)
+    rows = screen_directory(tmp_path)
+    assert [row["Clashes"] for row in rows] == [0, 0]
+
+def test_contacts_between_stacked_copies_are_not_ranked_as_clashes(tmp_path):
+    # Two copies of a 3-residue segment (numbering restarts) lying on top of each other,
+    # plus one genuine clash inside the first copy between residues 1 and 3
+    lines = [atom_line(1, "CA", "ALA", 1, 0.0), atom_line(2, "CA", "ALA", 2, 3.8), atom_line(3, "CA", "ALA", 3, 1.0),
+             atom_line(4, "CA", "ALA", 1, 0.2, 5.0), atom_line(5, "CA", "ALA", 2, 3.9, 5.0), atom_line(6, "CA", "ALA", 3, 7.6, 5.0),
+             atom_line(7, "CA", "ALA", 1, 0.1, 0.5), atom_line(8, "CA", "ALA", 2, 3.8, 0.5), atom_line(9, "CA", "ALA", 3, 7.6, 9.0)]
+    pdb_path = tmp_path / "stacked.pdb"
+    pdb_path.write_text("".join(lines))
+
+    atoms = read_pdb_atoms(pdb_path)
+    n_clashes, worst, n_contacts = count_clashes(atoms)
+
+    assert list(atoms["segment"]) == [0, 0, 0, 1, 1, 1, 2, 2, 2]
+    assert n_clashes == 1
+    assert abs(worst - 1.5) < 1e-5
+    assert n_contacts > 0
@@ -0,0 +1,70 @@
+import csv
+from csv_to_fasta import process_mutation_batch, BATCH_FASTA, BATCH_INDEX
+
+BASE = "MKTAYIAKQR"
+
+def write_sheet(path, header, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Chemical", *header])
+        writer.writerows(rows)
+    return path
+
+def read_fasta(path):
+    lines = path.read_text().split()
+    return dict(zip((name[1:] for name in lines[::2]), lines[1::2]))
+
+def read_csv(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+def run_batch(tmp_path, sheets):
+    fasta = tmp_path / "base.fasta"
+    fasta.write_text(f">base\n{BASE}\n")
+    out = tmp_path / "out"
+    process_mutation_batch(str(fasta), [str(s) for s in sheets], str(out), str(tmp_path / "comparison.csv"))
+    return out
+
+def test_identical_sequences_across_sheets_collapse_to_one_record(tmp_path):
+    hmh = write_sheet(tmp_path / "HMH.csv", ["A4", "K8"], [["Nitazene A", "P", ""], ["Nitazene B", "P", "E"]])
+    # Same A4P mutant as Nitazene A, plus one new sequence, in another sheet with its own columns
+    l06 = write_sheet(tmp_path / "L06_N.csv", ["A4", "Y5"], [["Fentanyl", "P", ""], ["Opioid", "", "W"]])
+
+    out = run_batch(tmp_path, [hmh, l06])
+
+    assert read_fasta(out / BATCH_FASTA) == {"Nitazene_A": "MKTPYIAKQR", "Nitazene_B": "MKTPYIAEQR",
+                                             "Opioid": "MKTAWIAKQR"}
+    index = read_csv(out / BATCH_INDEX)
+    assert [(row["Name"], row["Canonical"], row["Source CSV"], row["Mutations"]) for row in index] == [
+        ("Nitazene_A", "Nitazene_A", "HMH.csv", "A4P"),
+        ("Nitazene_B", "Nitazene_B", "HMH.csv", "A4P;K8E"),
+        ("Fentanyl", "Nitazene_A", "L06_N.csv", "A4P"),
+        ("Opioid", "Opioid", "L06_N.csv", "Y5W"),
+    ]
+
+def test_every_source_row_keeps_its_own_name_and_sequence(tmp_path):
+    first = write_sheet(tmp_path / "first.csv", ["A4"], [["Mutant 1", "P"], ["Mutant 1", "P"], ["Wild", ""]])
+    second = write_sheet(tmp_path / "second.csv", ["A4"], [["Mutant 1", "G"]])
+
+    out = run_batch(tmp_path, [first, second])
+
+    # Repeated names get a suffix, and every row is still in the index and the comparison CSV
+    index = read_csv(out / BATCH_INDEX)
+    assert [(row["Chemical"], row["Name"], row["Canonical"]) for row in index] == [
+        ("Mutant 1", "Mutant_1", "Mutant_1"), ("Mutant 1", "Mutant_1_2", "Mutant_1"),
+        ("Wild", "Wild", "Wild"), ("Mutant 1", "Mutant_1_3", "Mutant_1_3")]
+    comparison = read_csv(tmp_path / "comparison.csv")
+    assert [row["Chemical"] for row in comparison] == ["Wild-Type", "Mutant_1", "Mutant_1_2", "Wild", "Mutant_1_3"]
+    assert ["".join(row[str(i)] for i in range(1, len(BASE) + 1)) for row in comparison] == [
+        BASE, "MKTPYIAKQR", "MKTPYIAKQR", BASE, "MKTGYIAKQR"]
+    assert set(read_fasta(out / BATCH_FASTA).values()) == {"MKTPYIAKQR", BASE, "MKTGYIAKQR"}
+
+def test_header_that_disagrees_with_the_base_sequence_warns(tmp_path, capsys):
+    # Position 4 is A in the base sequence, not K
+    sheet = write_sheet(tmp_path / "sheet.csv", ["K4"], [["Mutant", "P"]])
+
+    out = run_batch(tmp_path, [sheet])
+
+    assert "sheet.csv column K4 does not match the base sequence (A4)" in capsys.readouterr().out
+    assert read_fasta(out / BATCH_FASTA) == {"Mutant": "MKTPYIAKQR"}
+    assert read_csv(out / BATCH_INDEX)[0]["Mutations"] == "A4P"
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.spatial.distance import cdist
+import descriptor_distances
+from descriptor_store import append_structures, merge_metadata
+
+def make_entries(n_structures, dim=6, start=0, seed=0):
+    rng = np.random.default_rng([seed, start])
+    return [(f"id{i}", f"s{i}", rng.standard_normal((int(rng.integers(3, 30)), dim)).astype(np.float32))
+            for i in range(start, start + n_structures)]
+
+def brute_force(arrays, metric):
+    n = len(arrays)
+    out = np.zeros((n, n))
+    for i in range(n):
+        for j in range(n):
+            d = cdist(arrays[i], arrays[j])
+            a_to_b, b_to_a = d.min(axis=1), d.min(axis=0)
+            if metric == "chamfer":
+                out[i, j] = 0.5 * (a_to_b.mean() + b_to_a.mean())
+            elif metric == "modified_hausdorff":
+                out[i, j] = max(a_to_b.mean(), b_to_a.mean())
+            else:
+                out[i, j] = max(a_to_b.max(), b_to_a.max())
+    return out
+
+def compute(store_dir, out_dir, **kwargs):
+    descriptor_distances.compute_distances(store_dir, out_dir, max_patches=0, **kwargs)
+    return np.load(out_dir / descriptor_distances.DATA_FILE)
+
+@pytest.mark.parametrize("metric", descriptor_distances.METRICS)
+def test_matches_brute_force(tmp_path, metric):
+    entries = make_entries(7)
+    append_structures(tmp_path / "store", entries)
+
+    distances = compute(tmp_path / "store", tmp_path / "out", metric=metric, tile=3)
+
+    np.testing.assert_allclose(distances, brute_force([a for _, _, a in entries], metric), rtol=1e-4, atol=1e-4)
+    np.testing.assert_array_equal(distances, distances.T)
+    assert (np.diag(distances) == 0).all()
+
+def test_tile_and_worker_count_do_not_change_the_matrix(tmp_path):
+    append_structures(tmp_path / "store", make_entries(9))
+    reference = compute(tmp_path / "store", tmp_path / "one", tile=32, workers=1)
+    for tile, workers in [(1, 1), (4, 1), (2, 2)]:
+        out_dir = tmp_path / f"tile{tile}_workers{workers}"
+        np.testing.assert_array_equal(compute(tmp_path / "store", out_dir, tile=tile, workers=workers), reference)
+
+def test_rerun_after_append_reuses_the_existing_matrix(tmp_path, capsys):
+    store_dir, out_dir = tmp_path / "store", tmp_path / "out"
+    append_structures(store_dir, make_entries(5))
+    before = compute(store_dir, out_dir, tile=2)
+    # Mark one stored pair, so the rerun shows it was copied rather than recomputed
+    marked = np.load(out_dir / descriptor_distances.DATA_FILE, mmap_mode="r+")
+    marked[0, 1] = marked[1, 0] = 123.0
+    marked.flush()
+    del marked
+
+    append_structures(store_dir, make_entries(3, start=5))
+    capsys.readouterr()
+    after = compute(store_dir, out_dir, tile=2)
+
+    assert "8 structures (3 new, 5 reused)" in capsys.readouterr().out
+    assert after[0, 1] == after[1, 0] == 123.0
+    after[0, 1] = after[1, 0] = before[0, 1]
+    np.testing.assert_array_equal(after, compute(store_dir, tmp_path / "fresh", tile=2))
+    assert pd.read_csv(out_dir / descriptor_distances.STRUCTURES_FILE)["structure"].tolist() == [f"s{i}" for i in range(8)]
+
+def test_copy_previous_moves_kept_rows_to_their_new_positions(tmp_path):
+    old = np.arange(16, dtype=np.float32).reshape(4, 4)
+    np.save(tmp_path / "old.npy", old)
+    distances = np.zeros((5, 5), dtype=np.float32)
+
+    # Old structures 3 and 1 are kept and now sit at rows 0 and 4
+    descriptor_distances.copy_previous(tmp_path / "old.npy", distances, [3, 1], [0, 4])
+
+    assert distances[0, 0] == old[3, 3] and distances[4, 4] == old[1, 1]
+    assert distances[0, 4] == old[3, 1] and distances[4, 0] == old[1, 3]
+    assert distances[1:4].sum() == 0 and distances[:, 1:4].sum() == 0
+
+def test_cluster_recovers_separated_families(tmp_path, capsys):
+    rng = np.random.default_rng(0)
+    centres = {"nitazene": np.zeros(6), "fentanyl": np.full(6, 10.0), "piperidine": np.full(6, -10.0)}
+    entries, families = [], []
+    for i in range(12):
+        family = list(centres)[i % 3]
+        entries.append((f"id{i}", f"s{i}", (centres[family] + rng.standard_normal((10, 6))).astype(np.float32)))
+        families.append(family)
+    append_structures(tmp_path / "store", entries)
+    merge_metadata(tmp_path / "store", pd.DataFrame({"structure": [f"s{i}" for i in range(12)], "ligand_family": families}))
+    compute(tmp_path / "store", tmp_path / "out")
+
+    descriptor_distances.cluster_structures(tmp_path / "out")
+
+    clusters = pd.read_csv(tmp_path / "out" / "clusters.csv")
+    assert clusters["cluster"].nunique() == 3
+    assert (clusters.groupby("ligand_family")["cluster"].nunique() == 1).all()
+    assert "Adjusted Rand index vs ligand_family: 1.000" in capsys.readouterr().out
+    assert np.load(tmp_path / "out" / "linkage.npy").shape == (11, 4)
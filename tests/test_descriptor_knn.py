@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+import descriptor_knn
+from descriptor_store import append_structures
+
+def make_store(store_dir, n_structures=12, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    entries = [(f"id{i}", f"s{i}", rng.standard_normal((int(rng.integers(5, 40)), dim)).astype(np.float32))
+               for i in range(n_structures)]
+    append_structures(store_dir, entries)
+    return {structure: array for _, structure, array in entries}
+
+@pytest.mark.parametrize("nlist", [1, 4])
+def test_query_by_name_returns_that_structures_patches(tmp_path, nlist):
+    arrays = make_store(tmp_path / "store")
+    descriptor_knn.build_index(tmp_path / "store", tmp_path / "index", level="patch", nlist=nlist)
+    index = descriptor_knn.load_index(tmp_path / "index")
+
+    for i, (structure, array) in enumerate(arrays.items()):
+        vectors, row = descriptor_knn.query_vectors(index, structure)
+        assert row == i
+        assert len(vectors) == len(array)
+        # The index reorders rows by inverted list, so compare the patches as sets
+        np.testing.assert_array_equal(np.unique(vectors, axis=0), np.unique(array, axis=0))
+
+def test_query_by_name_without_positions_falls_back_to_labels(tmp_path):
+    arrays = make_store(tmp_path / "store")
+    descriptor_knn.build_index(tmp_path / "store", tmp_path / "index", level="patch", nlist=4)
+    index = descriptor_knn.load_index(tmp_path / "index")
+    del index["positions"]
+
+    vectors, row = descriptor_knn.query_vectors(index, "id3")
+    assert row == 3
+    np.testing.assert_array_equal(np.unique(vectors, axis=0), np.unique(arrays["s3"], axis=0))
+
+def test_search_scans_at_most_max_lists(tmp_path):
+    make_store(tmp_path / "store", n_structures=20)
+    descriptor_knn.build_index(tmp_path / "store", tmp_path / "index", level="patch", nlist=8)
+    index = descriptor_knn.load_index(tmp_path / "index")
+    queries, _ = descriptor_knn.query_vectors(index, "s0")
+
+    _, rows = descriptor_knn.search(index, queries, 5, nprobe=4, max_lists=2)
+
+    hit_lists = np.searchsorted(index["list_offsets"], rows[rows >= 0], side="right") - 1
+    assert 0 < len(np.unique(hit_lists)) <= 2
+
+def test_search_probing_every_list_matches_exhaustive_search(tmp_path):
+    make_store(tmp_path / "store", n_structures=20)
+    descriptor_knn.build_index(tmp_path / "store", tmp_path / "index", level="patch", nlist=8)
+    index = descriptor_knn.load_index(tmp_path / "index")
+    queries, _ = descriptor_knn.query_vectors(index, "s0")
+
+    d, _ = descriptor_knn.search(index, queries, 5, nprobe=8, max_lists=8)
+    expected, _ = descriptor_knn.exhaustive_search(queries, index["vectors"], index["norms"], 5)
+    np.testing.assert_allclose(np.sort(d, axis=1), np.sort(expected, axis=1), rtol=1e-4, atol=1e-4)
+
+def test_patch_query_is_capped_at_max_query_patches(tmp_path):
+    rng = np.random.default_rng(1)
+    centres = rng.standard_normal((2, 8)).astype(np.float32) * 10
+    # Structures alternate between two well-separated surfaces
+    entries = [(f"id{i}", f"s{i}", centres[i % 2] + rng.standard_normal((40, 8)).astype(np.float32))
+               for i in range(10)]
+    append_structures(tmp_path / "store", entries)
+    descriptor_knn.build_index(tmp_path / "store", tmp_path / "index", level="patch", nlist=4)
+    index = descriptor_knn.load_index(tmp_path / "index")
+
+    results = descriptor_knn.rank_structures(index, "s0", k=4, max_query_patches=16)
+
+    assert results["votes"].sum() <= 16
+    assert set(results["structure"]) <= {"s2", "s4", "s6", "s8"}
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+from descriptor_store import append_structures, merge_metadata, open_store, pooled_matrix, parse_pooling
+
+def test_append_skips_structures_without_rows(tmp_path, capsys):
+    rng = np.random.default_rng(0)
+    first, last = rng.standard_normal((4, 8)), rng.standard_normal((3, 8))
+    entries = [("id0", "s0", first), ("id1", "empty", np.empty((0, 8))), ("id2", "s2", last),
+               ("id3", "empty_3d", np.empty((0, 5, 16)))]
+
+    assert append_structures(tmp_path, entries) == 2
+
+    matrix, index = open_store(tmp_path)
+    assert index["structure"].tolist() == ["s0", "s2"]
+    np.testing.assert_array_equal(matrix, np.concatenate([first, last]).astype(np.float32))
+    assert "[WARN] Skipping empty: no descriptor rows" in capsys.readouterr().out
+
+@pytest.mark.parametrize("block_rows", [1, 4, 1_000_000])
+def test_pooled_matrix_with_zero_row_structures(block_rows):
+    rng = np.random.default_rng(1)
+    counts = [0, 3, 0, 0, 5, 2, 0]
+    matrix = rng.standard_normal((sum(counts), 4)).astype(np.float32)
+    index = pd.DataFrame({"row_offset": np.concatenate([[0], np.cumsum(counts)[:-1]]), "n_rows": counts})
+
+    pooled = pooled_matrix(matrix, index, parse_pooling("mean,max,min,p90"), block_rows=block_rows)
+
+    for row, (offset, n_rows) in enumerate(zip(index["row_offset"], counts)):
+        rows = matrix[offset:offset + n_rows]
+        if n_rows == 0:
+            expected = np.zeros(16, dtype=np.float32)
+        else:
+            expected = np.concatenate([rows.mean(0), rows.max(0), rows.min(0), np.percentile(rows, 90, axis=0)])
+        np.testing.assert_allclose(pooled[row], expected, rtol=1e-5, atol=1e-6)
+
+def test_append_skips_structures_already_stored(tmp_path):
+    rng = np.random.default_rng(2)
+    assert append_structures(tmp_path, [("id0", "s0", rng.standard_normal((2, 8)))]) == 1
+    again = [("id0", "s0", rng.standard_normal((3, 8))), ("id1", "s1", rng.standard_normal((3, 8))),
+             ("id1", "s1", rng.standard_normal((4, 8)))]
+    assert append_structures(tmp_path, again) == 1
+
+    matrix, index = open_store(tmp_path)
+    assert index["structure"].tolist() == ["s0", "s1"]
+    assert index["n_rows"].tolist() == [2, 3] and len(matrix) == 5
+
+def test_append_after_interrupted_write_keeps_indexed_rows(tmp_path):
+    rng = np.random.default_rng(3)
+    first = rng.standard_normal((2, 8)).astype(np.float32)
+    append_structures(tmp_path, [("id0", "s0", first)])
+    index_before = (tmp_path / "index.csv").read_text()
+    # Interrupted after the data and header were written but before the index was replaced
+    append_structures(tmp_path, [("id1", "s1", rng.standard_normal((3, 8)))])
+    (tmp_path / "index.csv").write_text(index_before)
+
+    matrix, index = open_store(tmp_path)
+    assert len(matrix) == 2
+    second = rng.standard_normal((4, 8)).astype(np.float32)
+    append_structures(tmp_path, [("id2", "s2", second)])
+
+    matrix, index = open_store(tmp_path)
+    assert index["row_offset"].tolist() == [0, 2]
+    np.testing.assert_array_equal(matrix, np.concatenate([first, second]))
+
+def test_merge_metadata_ignores_duplicate_metadata_rows(tmp_path):
+    append_structures(tmp_path, [("id0", "s0", np.ones((2, 4))), ("id1", "s1", np.ones((2, 4)))])
+    metadata = pd.DataFrame({"structure": ["s0", "s0", "s1"], "ligand_family": ["a", "b", "c"]})
+
+    index = merge_metadata(tmp_path, metadata)
+
+    assert index["structure"].tolist() == ["s0", "s1"]
+    assert index["ligand_family"].tolist() == ["a", "c"]
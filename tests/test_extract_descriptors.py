@@ -0,0 +1,43 @@
+import sys
+import json
+import numpy as np
+import extract_descriptors_to_csv
+from descriptor_store import read_index
+
+def write_output(output_dir, structure_id, n_patches=3):
+    desc_dir = output_dir / structure_id / "descriptors" / "sc05" / "all_feat" / f"{structure_id}_A"
+    desc_dir.mkdir(parents=True)
+    for name in ("p1_desc_straight.npy", "p1_desc_flipped.npy"):
+        np.save(desc_dir / name, np.ones((n_patches, 4), dtype=np.float32))
+
+def test_store_names_come_from_manifest_for_earlier_runs(tmp_path, monkeypatch):
+    output_dir, log_dir = tmp_path / "masif_output", tmp_path / "logs"
+    log_dir.mkdir()
+    for structure_id in ("1AAA", "2BBB", "3CCC"):
+        write_output(output_dir, structure_id)
+    manifest = {"structures": {"d1": {"id": "1AAA", "names": ["Mutant_1.pdb"]},
+                               "d2": {"id": "2BBB", "names": ["Mutant_2.pdb", "Mutant_2_copy.pdb"]},
+                               "d3": {"id": "3CCC", "names": ["Mutant_3.pdb"]}}}
+    (output_dir / "pdb_manifest.json").write_text(json.dumps(manifest))
+    # The last (incremental) run only saw the new file
+    (log_dir / "pdb_mapping.txt").write_text("3CCC.pdb -> Mutant_3.pdb\n")
+
+    monkeypatch.setattr(sys, "argv", ["extract_descriptors_to_csv.py", "--output_dir", str(output_dir), "--log_dir",
+                                      str(log_dir), "--format", "store", "--store_dir", str(tmp_path / "store")])
+    extract_descriptors_to_csv.main()
+
+    index = read_index(tmp_path / "store")
+    assert dict(zip(index["structure_id"], index["structure"])) == {
+        "1AAA": "Mutant_1", "2BBB": "Mutant_2", "3CCC": "Mutant_3"}
+
+def test_mapping_file_is_used_without_a_manifest(tmp_path, monkeypatch):
+    output_dir, log_dir = tmp_path / "masif_output", tmp_path / "logs"
+    log_dir.mkdir()
+    write_output(output_dir, "1AAA")
+    (log_dir / "pdb_mapping.txt").write_text("1AAA.pdb -> Mutant_1.pdb\n")
+
+    monkeypatch.setattr(sys, "argv", ["extract_descriptors_to_csv.py", "--output_dir", str(output_dir), "--log_dir",
+                                      str(log_dir), "--format", "store", "--store_dir", str(tmp_path / "store")])
+    extract_descriptors_to_csv.main()
+
+    assert read_index(tmp_path / "store")["structure"].tolist() == ["Mutant_1"]
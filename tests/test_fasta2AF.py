@@ -0,0 +1,39 @@
+import subprocess
+import sys
+from pathlib import Path
+from conftest import MUTATION_DIR
+from fasta2AF import create_shared_msa_commands
+
+PARENT = "MKTAYIAKQRQISFVKSHFSRQ"
+
+def write_fasta(path, records):
+    path.write_text("".join(f">{name}\n{sequence}\n" for name, sequence in records))
+
+def mutant(position, residue):
+    return PARENT[:position] + residue + PARENT[position + 1:]
+
+def test_plain_mode_does_not_import_numpy():
+    code = "import sys, fasta2AF; sys.exit(int('numpy' in sys.modules or 'af_variants' in sys.modules))"
+    assert subprocess.run([sys.executable, "-c", code], cwd=MUTATION_DIR).returncode == 0
+
+def test_batches_do_not_overwrite_each_others_chunks(tmp_path):
+    parent = tmp_path / "parent.fasta"
+    write_fasta(parent, [("parent", PARENT)])
+    first, second = tmp_path / "first.fasta", tmp_path / "second.fasta"
+    write_fasta(first, [("m1", mutant(3, "P")), ("m2", mutant(5, "W"))])
+    write_fasta(second, [("m3", mutant(7, "G"))])
+    commands, structures = tmp_path / "cmds", tmp_path / "structures"
+
+    create_shared_msa_commands(parent, first, commands, structures, variants_per_job=1)
+    first_chunks = {p: p.read_text() for p in (commands / "variant_chunks").rglob("chunk_*.txt")}
+    create_shared_msa_commands(parent, second, commands, structures, variants_per_job=1)
+
+    assert len(first_chunks) == 2
+    assert all(p.read_text() == text for p, text in first_chunks.items())
+    assert len(list((commands / "variant_chunks").iterdir())) == 2
+    assert len(list(commands.glob("submit_shared_msa_*.sh"))) == 2
+    arrays = sorted(commands.glob("variants_AF2_array_*.sh"))
+    assert len(arrays) == 2
+    for array in arrays:
+        chunk_dir = next(line for line in array.read_text().splitlines() if line.startswith("chunk="))
+        assert Path(chunk_dir.split('"')[1]).parent.name == array.stem.rsplit("_", 1)[1]
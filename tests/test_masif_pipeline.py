@@ -0,0 +1,94 @@
+import os
+import sys
+import csv
+import pytest
+import masif_pipeline
+from conftest import REPACK_DIR, STUB_DIR
+from descriptor_store import read_index
+
+RESIDUES = ["MET", "LYS", "THR", "ALA", "TYR", "ILE", "ALA", "LYS", "GLN", "ARG"]
+
+def write_model(path, chain="A"):
+    os.makedirs(path.parent, exist_ok=True)
+    lines = [f"ATOM  {i:5d}  CA  {resname} {chain}{i:4d}    {3.8 * i:8.3f}{0.0:8.3f}{0.0:8.3f}  1.00  0.00           C\n"
+             for i, resname in enumerate(RESIDUES, start=1)]
+    path.write_text("".join(lines) + "END\n")
+    return path
+
+def test_find_models_skips_parent_features_and_reports_duplicates(tmp_path):
+    first, second = tmp_path / "af1", tmp_path / "af2"
+    write_model(first / "Mutant_1" / "Mutant_1" / "ranked_0.pdb")
+    write_model(first / "_parent_features" / "0123456789ab" / "parent" / "ranked_0.pdb")
+    write_model(second / "Mutant_1" / "Mutant_1" / "ranked_0.pdb")
+    write_model(second / "Mutant_2" / "ranked_0.pdb")
+
+    models, duplicates = masif_pipeline.find_models([first, second], "ranked_0.pdb", settle=0)
+
+    assert models == {"Mutant_1": first / "Mutant_1" / "Mutant_1" / "ranked_0.pdb",
+                      "Mutant_2": second / "Mutant_2" / "ranked_0.pdb"}
+    assert duplicates == {"Mutant_1": [second / "Mutant_1" / "Mutant_1" / "ranked_0.pdb"]}
+
+def test_find_models_leaves_unsettled_models(tmp_path):
+    write_model(tmp_path / "Mutant_1" / "Mutant_1" / "ranked_0.pdb")
+    models, _ = masif_pipeline.find_models([tmp_path], "ranked_0.pdb", settle=60)
+    assert models == {}
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """Run masif_pipeline.main() --once against the stub container and PyRosetta; returns a runner."""
+    monkeypatch.setenv("PATH", f"{STUB_DIR}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("BENCH_STUB_STATE", str(tmp_path / "stub_state"))
+    monkeypatch.setenv("BENCH_VERTICES_PER_RESIDUE", "2")
+    monkeypatch.setenv("BENCH_MAX_PATCH", "4")
+    monkeypatch.syspath_prepend(str(STUB_DIR))
+    work_dir = tmp_path / "work"
+
+    def run():
+        monkeypatch.setattr(sys, "argv", ["masif_pipeline.py", "--af_dir", str(tmp_path / "af"), "--work_dir", str(work_dir),
+                                          "--sif", str(tmp_path / "stub.sif"), "--once", "--settle", "0",
+                                          "--repack_workers", "1", "--masif_workers", "2", "-n", "1",
+                                          "--repack_script", str(REPACK_DIR / "2repack_biosensor.py")])
+        masif_pipeline.main()
+        with open(work_dir / "logs" / "pipeline_status.tsv", newline="") as f:
+            return {row["name"]: row for row in csv.DictReader(f, delimiter="\t")}
+
+    run.af_dir, run.work_dir = tmp_path / "af", work_dir
+    return run
+
+def repack_rows(work_dir):
+    with open(work_dir / "logs" / "repack_scores.csv", newline="") as f:
+        return [row["PDB File"] for row in csv.DictReader(f)]
+
+def test_pipeline_end_to_end_with_one_failing_structure(pipeline):
+    write_model(pipeline.af_dir / "Mutant_1" / "Mutant_1" / "ranked_0.pdb")
+    write_model(pipeline.af_dir / "Mutant_2" / "Mutant_2" / "ranked_0.pdb")
+    # No chain A atoms, so MaSIF fails for this structure alone
+    write_model(pipeline.af_dir / "Mutant_3" / "Mutant_3" / "ranked_0.pdb", chain="B")
+    write_model(pipeline.af_dir / "_parent_features" / "0123456789ab" / "parent" / "ranked_0.pdb")
+
+    status = pipeline()
+
+    assert {name: row["status"] for name, row in status.items()} == {
+        "Mutant_1": "appended", "Mutant_2": "appended", "Mutant_3": "masif_failed"}
+    index = read_index(pipeline.work_dir / "descriptor_store")
+    assert sorted(index["structure"]) == ["Mutant_1", "Mutant_2"]
+    assert "parent" not in (pipeline.work_dir / "logs" / "pdb_mapping.txt").read_text()
+
+def test_pipeline_rerun_only_redoes_stale_work(pipeline):
+    model_1 = write_model(pipeline.af_dir / "Mutant_1" / "Mutant_1" / "ranked_0.pdb")
+    write_model(pipeline.af_dir / "Mutant_2" / "Mutant_2" / "ranked_0.pdb")
+    pipeline()
+    assert sorted(repack_rows(pipeline.work_dir)) == ["Mutant_1.pdb", "Mutant_2.pdb"]
+
+    status = pipeline()
+    assert {row["status"] for row in status.values()} == {"cached"}
+    assert len(repack_rows(pipeline.work_dir)) == 2
+
+    # A model newer than its repacked PDB is repacked again; the stub repacks it to the same PDB,
+    # so its descriptors stay cached
+    earlier = model_1.stat().st_mtime - 60
+    os.utime(pipeline.work_dir / "repacked" / "best_packed_Mutant_1.pdb", (earlier, earlier))
+    status = pipeline()
+    assert repack_rows(pipeline.work_dir)[2:] == ["Mutant_1.pdb"]
+    assert {row["status"] for row in status.values()} == {"cached"}
+    assert len(read_index(pipeline.work_dir / "descriptor_store")) == 2
@@ -0,0 +1,68 @@
+from pdb_slim import read_pdb_records, slim_pdb, slim_mask
+
+def atom(serial, name, resname, chain, resseq, altloc=" ", occupancy=1.0, element="C", record="ATOM  "):
+    return (f"{record}{serial:5d} {name:<4s}{altloc}{resname} {chain}{resseq:4d}    "
+            f"{1.0 * serial:8.3f}{0.0:8.3f}{0.0:8.3f}{occupancy:6.2f}  0.00          {element:>2s}\n")
+
+def write(path, lines):
+    path.write_text("".join(lines) + "END\n")
+    return path
+
+def kept_atoms(path):
+    return [(line[12:16].strip(), line[16], line[17:20], line[21], int(line[22:26]), float(line[54:60]))
+            for line in path.read_text().splitlines() if line.startswith(("ATOM", "HETATM"))]
+
+def test_default_slimming_keeps_protein_atoms_of_the_chosen_chains(tmp_path):
+    pdb = write(tmp_path / "in.pdb", [
+        atom(1, "N", "MET", "A", 1, element="N"),
+        atom(2, "CA", "MET", "A", 1),
+        atom(3, "H", "MET", "A", 1, element="H"),
+        atom(4, "CA", "LYS", "B", 1),
+        atom(5, "O", "HOH", "A", 101, element="O", record="HETATM"),
+        atom(6, "ZN", "ZN", "A", 102, element="ZN", record="HETATM"),
+        "ENDMDL\n",
+        atom(7, "CA", "MET", "A", 1),
+    ])
+
+    n_read, n_kept = slim_pdb(pdb, tmp_path / "out.pdb", chains="A")
+
+    assert (n_read, n_kept) == (6, 2)
+    assert [a[:2] for a in kept_atoms(tmp_path / "out.pdb")] == [("N", " "), ("CA", " ")]
+    assert (tmp_path / "out.pdb").read_text().splitlines()[-2:] == ["TER", "END"]
+
+def test_keep_options(tmp_path):
+    pdb = write(tmp_path / "in.pdb", [
+        atom(1, "CA", "MET", "A", 1),
+        atom(2, "H", "MET", "A", 1, element="H"),
+        atom(3, "O", "HOH", "A", 101, element="O", record="HETATM"),
+        atom(4, "ZN", "ZN", "A", 102, element="ZN", record="HETATM"),
+    ])
+    raw = read_pdb_records(pdb)
+
+    assert slim_mask(raw).tolist() == [True, False, False, False]
+    assert slim_mask(raw, keep_hetatm=True).tolist() == [True, False, False, True]
+    assert slim_mask(raw, keep_hetatm=True, keep_waters=True, keep_hydrogens=True).tolist() == [True] * 4
+
+def test_highest_occupancy_altloc_is_kept_per_atom(tmp_path):
+    pdb = write(tmp_path / "in.pdb", [
+        atom(1, "CA", "SER", "A", 5),
+        # B is the major conformer of CB, A of OG; C does not exist for CB
+        atom(2, "CB", "SER", "A", 5, altloc="A", occupancy=0.30),
+        atom(3, "CB", "SER", "A", 5, altloc="B", occupancy=0.70),
+        atom(4, "OG", "SER", "A", 5, altloc="A", occupancy=0.60, element="O"),
+        atom(5, "OG", "SER", "A", 5, altloc="B", occupancy=0.40, element="O"),
+        # Equal occupancies keep the first listed; the same atom name in another residue is a different atom
+        atom(6, "CB", "SER", "A", 6, altloc="A", occupancy=0.50),
+        atom(7, "CB", "SER", "A", 6, altloc="B", occupancy=0.50),
+        atom(8, "CB", "SER", "B", 5, altloc="B", occupancy=0.20),
+    ])
+
+    slim_pdb(pdb, tmp_path / "out.pdb")
+
+    assert kept_atoms(tmp_path / "out.pdb") == [
+        ("CA", " ", "SER", "A", 5, 1.0),
+        ("CB", " ", "SER", "A", 5, 0.7),
+        ("OG", " ", "SER", "A", 5, 0.6),
+        ("CB", " ", "SER", "A", 6, 0.5),
+        ("CB", " ", "SER", "B", 5, 0.2),
+    ]
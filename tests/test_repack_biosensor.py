@@ -0,0 +1,138 @@
+import csv
+import sys
+import pytest
+from conftest import load_repack_module
+
+WILD_TYPE = "MKTAYIAKQR"
+MUTANT = "MKTPYIAKQR"  # A4P
+ONE_TO_THREE = {"A": "ALA", "I": "ILE", "K": "LYS", "M": "MET", "P": "PRO", "Q": "GLN", "R": "ARG",
+                "T": "THR", "Y": "TYR"}
+
+@pytest.fixture
+def repack():
+    module = load_repack_module()
+    yield module
+    module.mutation_table = None
+    module.reference_sequence = None
+
+def write_stacked_pdb(path, sequence, copies):
+    """Copies of one domain stacked in chain A with numbering restarting at 1, like the biosensor models."""
+    lines = []
+    serial = 1
+    for copy in range(copies):
+        for i, aa in enumerate(sequence, start=1):
+            x = 3.8 * (copy * len(sequence) + i)
+            lines.append(f"ATOM  {serial:5d}  CA  {ONE_TO_THREE[aa]} A{i:4d}    {x:8.3f}{0.0:8.3f}{0.0:8.3f}  1.00  0.00           C\n")
+            serial += 1
+    path.write_text("".join(lines) + "END\n")
+
+def test_mutation_positions_cover_every_stacked_copy(repack, tmp_path):
+    pdb_path = tmp_path / "best_packed_Mutant_1.pdb"
+    write_stacked_pdb(pdb_path, MUTANT, copies=5)
+    repack.mutation_table = {"Mutant_1": ([4], MUTANT)}
+    pose = repack.pyrosetta.pose_from_file(str(pdb_path))
+
+    positions = repack.mutation_positions(pose, pdb_path.name)
+
+    assert positions == [4 + copy * len(MUTANT) for copy in range(5)]
+    assert all(pose.sequence()[p - 1] == "P" for p in positions)
+
+def test_mutation_positions_unknown_sequence_repacks_everything(repack, tmp_path):
+    pdb_path = tmp_path / "Mutant_1.pdb"
+    write_stacked_pdb(pdb_path, WILD_TYPE, copies=2)
+    repack.mutation_table = {"Mutant_1": ([4], MUTANT)}
+    pose = repack.pyrosetta.pose_from_file(str(pdb_path))
+
+    assert repack.mutation_positions(pose, pdb_path.name) is None
+
+class ScriptedPose:
+    """Pose whose score after each packing cycle comes from a fixed script."""
+    def __init__(self, scores):
+        self.scores, self.cycle = scores, 0
+
+    def clone(self):
+        return ScriptedPose(self.scores)
+
+    def assign(self, other):
+        self.cycle = other.cycle
+
+class ScriptedPacker:
+    def apply(self, pose):
+        pose.cycle += 1
+
+def score(pose):
+    return pose.scores[pose.cycle]
+
+@pytest.mark.parametrize("patience, cycles_run, best", [(1, 2, 90.0), (2, 5, 69.9), (3, 6, 69.9)])
+def test_repack_pose_patience(repack, patience, cycles_run, best):
+    # Start at 100; cycle 2 scores worse, cycle 3 recovers, then the gains are below 1 REU
+    scores = [100.0, 90.0, 95.0, 70.0, 69.9, 69.9, 69.95, 69.9]
+    best_pose, best_score, cycle_log = repack.repack_pose(ScriptedPose(scores), score, ScriptedPacker(), cycles=7,
+                                                          min_improvement=1.0, patience=patience)
+
+    assert len(cycle_log) == cycles_run
+    assert best_score == best and score(best_pose) == best
+
+def test_repack_pose_without_min_improvement_runs_every_cycle(repack):
+    scores = [100.0, 90.0, 95.0, 70.0]
+    _, best_score, cycle_log = repack.repack_pose(ScriptedPose(scores), score, ScriptedPacker(), cycles=3)
+    assert len(cycle_log) == 3 and best_score == 70.0
+
+def test_completed_pdbs_needs_both_score_row_and_structure(repack, tmp_path):
+    csv_file, out = tmp_path / "scores.csv", tmp_path / "out"
+    out.mkdir()
+    for name in ("Mutant_1.pdb", "Mutant_2.pdb"):
+        repack.append_csv_row(str(csv_file), {"PDB File": name, "Best Packed Score": -1.0})
+    (out / "best_packed_Mutant_1.pdb").write_text("END\n")
+    # A structure dumped by a killed run before its score row was written
+    (out / "best_packed_Mutant_3.pdb").write_text("ATOM")
+
+    assert repack.completed_pdbs(str(csv_file), str(out)) == {"Mutant_1.pdb"}
+
+def test_process_pdb_leaves_no_temporary_file(repack, tmp_path):
+    pdb_path = tmp_path / "Mutant_1.pdb"
+    write_stacked_pdb(pdb_path, MUTANT, copies=1)
+    out = tmp_path / "out"
+    out.mkdir()
+    repack.init_worker()
+
+    row, _ = repack.process_pdb(str(pdb_path), str(out), 1)
+
+    assert row["PDB File"] == "Mutant_1.pdb"
+    assert sorted(p.name for p in out.iterdir()) == ["best_packed_Mutant_1.pdb"]
+
+@pytest.fixture
+def run_main(repack, tmp_path, monkeypatch):
+    """Run main() with the given extra arguments; its log file goes to tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "stdout", sys.stdout)
+    monkeypatch.setattr(sys, "stderr", sys.stderr)
+
+    def run(*extra):
+        monkeypatch.setattr(sys, "argv", ["2repack_biosensor.py", "-p", str(tmp_path / "pdbs"), "-o", str(tmp_path / "out"),
+                                          "-c", str(tmp_path / "scores.csv"), "-n", "1", *extra])
+        repack.main()
+    return run
+
+def read_rows(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+def test_failing_pdb_is_recorded_as_error_and_the_rest_still_run(tmp_path, run_main):
+    (tmp_path / "pdbs").mkdir()
+    write_stacked_pdb(tmp_path / "pdbs" / "Mutant_1.pdb", MUTANT, copies=1)
+    write_stacked_pdb(tmp_path / "pdbs" / "Mutant_3.pdb", MUTANT, copies=1)
+    (tmp_path / "pdbs" / "Mutant_2.pdb").write_text("ATOM      1  CA  ALA A   1    not-a-coordinate\n")
+
+    run_main()
+
+    assert [row["PDB File"] for row in read_rows(tmp_path / "scores.csv")] == ["Mutant_1.pdb", "Mutant_3.pdb"]
+    errors = read_rows(tmp_path / "scores.errors.csv")
+    assert [row["PDB File"] for row in errors] == ["Mutant_2.pdb"]
+    assert errors[0]["Error"].startswith("ValueError")
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["best_packed_Mutant_1.pdb", "best_packed_Mutant_3.pdb"]
+
+@pytest.mark.parametrize("shard_index, shard_count", [("2", "2"), ("-1", "2"), ("0", "0")])
+def test_invalid_shard_is_rejected(run_main, shard_index, shard_count):
+    with pytest.raises(SystemExit):
+        run_main("--shard_index", shard_index, "--shard_count", shard_count)
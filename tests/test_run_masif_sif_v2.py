@@ -0,0 +1,35 @@
+import json
+from pathlib import Path
+import run_masif_sif_v2
+
+def fake_run_structure(instance_name, pdb_file, chains, structure_log_dir, output_root):
+    if pdb_file.stem == "2BAD":
+        raise OSError("exec failed")
+    status = "failed" if pdb_file.stem == "3NOD" else "ok"
+    return pdb_file.stem, 0, {"structure_id": pdb_file.stem, "chains": chains, "status": status,
+                              "start": "2026-01-01T00:00:00", "end": "2026-01-01T00:00:01", "seconds": 1.0,
+                              "exit_code": 0, "peak_rss_mb": 1.0, "output_bytes": 0,
+                              "failure_reason": None if status == "ok" else "no descriptors", "stages": []}
+
+def test_run_pool_records_one_structure_error_and_keeps_going(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_masif_sif_v2, "run_structure", fake_run_structure)
+    finished = {}
+
+    def finish(pdbid, ok):
+        if pdbid == "4ARC":
+            raise OSError("disk full")
+        finished[pdbid] = ok
+
+    pdb_files = [(Path(f"{pdbid}.pdb"), "A") for pdbid in ("1AOK", "2BAD", "3NOD", "4ARC")]
+    metrics_path = tmp_path / "metrics.jsonl"
+
+    statuses = run_masif_sif_v2.run_pool("instance", pdb_files, tmp_path, 2, tmp_path / "launcher.log", tmp_path,
+                                         metrics_path, {}, finish)
+
+    assert statuses == {"1AOK": 0, "2BAD": "error", "3NOD": "no_descriptors", "4ARC": "error"}
+    # Only the successful structure is archived; the failed one is cleaned up without archiving
+    assert finished == {"1AOK": True, "3NOD": False}
+    records = {r["structure_id"]: r for r in map(json.loads, metrics_path.read_text().splitlines())}
+    assert records["2BAD"]["status"] == "failed"
+    assert records["2BAD"]["failure_reason"] == "launcher error: OSError: exec failed"
+    assert records["4ARC"]["failure_reason"] == "launcher error: OSError: disk full"
@@ -0,0 +1,81 @@
+import sys
+import pytest
+from concurrent.futures import Future
+import numpy as np
+import pandas as pd
+import run_tsne
+
+def run(monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["run_tsne.py", *argv])
+    run_tsne.main()
+
+def write_descriptor_csv(path, n, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.standard_normal((n, 8)), columns=[str(i) for i in range(8)])
+    df.insert(0, "structure", [f"s{i}" for i in range(n)])
+    df.to_csv(path, index=False)
+
+def test_place_with_no_new_structures_keeps_existing_map(tmp_path, monkeypatch, capsys):
+    csv_path = tmp_path / "descriptors.csv"
+    write_descriptor_csv(csv_path, 30)
+    model_path = tmp_path / "map.pkl"
+    run(monkeypatch, "-i", str(csv_path), "-o", str(tmp_path / "fit"), "-p", "5", "-n", "250",
+        "--method", "exact", "--save_model", str(model_path))
+
+    run(monkeypatch, "-i", str(csv_path), "-o", str(tmp_path / "placed"), "--place", str(model_path))
+
+    placed = pd.read_csv(tmp_path / "placed.csv")
+    fitted = pd.read_csv(tmp_path / "fit.csv")
+    assert len(placed) == 30 and (placed["batch"] == "existing").all()
+    np.testing.assert_allclose(placed[["x", "y"]].to_numpy(), fitted[["x", "y"]].to_numpy(), rtol=1e-5)
+    assert "Placed 0 new structures" in capsys.readouterr().out
+
+def test_patch_layout_csv_is_rejected(tmp_path, monkeypatch):
+    csv_path = tmp_path / "patch.csv"
+    df = pd.DataFrame(np.random.default_rng(0).standard_normal((6, 4)), columns=[str(i) for i in range(4)])
+    df.insert(0, "vertex", [0, 1, 2, 0, 1, 2])
+    df.insert(0, "structure", ["a"] * 3 + ["b"] * 3)
+    df.to_csv(csv_path, index=False)
+
+    with pytest.raises(ValueError, match="one row per surface patch"):
+        run(monkeypatch, "-i", str(csv_path), "-o", str(tmp_path / "out"))
+
+class InlineExecutor:
+    """Runs submitted work in the test process and records how it was sized."""
+    created = []
+
+    def __init__(self, max_workers, initializer, initargs):
+        InlineExecutor.created.append(max_workers)
+        initializer(*initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+def test_sweep_shares_cpus_and_skips_the_pool_when_cached(tmp_path, monkeypatch):
+    threads = []
+    def fake_fit(features, perplexity, n_iter, engine, method, pca_components=None, n_jobs=-1):
+        threads.append(n_jobs)
+        return np.full((len(features), 2), perplexity, dtype=np.float32), None
+    monkeypatch.setattr(run_tsne, "fit_embedding", fake_fit)
+    monkeypatch.setattr(run_tsne, "ProcessPoolExecutor", InlineExecutor)
+    monkeypatch.setattr(run_tsne.os, "cpu_count", lambda: 8)
+    InlineExecutor.created = []
+    features = np.random.default_rng(0).standard_normal((20, 4)).astype(np.float32)
+
+    results = run_tsne.run_sweep(features, [5.0, 10.0], [250], "opentsne", "barnes_hut", tmp_path, jobs=8)
+
+    # Two configurations: two processes with four threads each, not 8 x all CPUs
+    assert InlineExecutor.created == [2] and threads == [4, 4]
+    assert sorted(results) == [(5.0, 250), (10.0, 250)]
+
+    cached = run_tsne.run_sweep(features, [5.0, 10.0], [250], "opentsne", "barnes_hut", tmp_path, jobs=8)
+    assert InlineExecutor.created == [2] and len(threads) == 2
+    np.testing.assert_array_equal(cached[(10.0, 250)], results[(10.0, 250)])